@@ -5,6 +5,8 @@ API for E. Bertin's Astromatic software suite
 """
 import subprocess
 import os
+import copy
+import functools
 import logging
 import warnings
 import traceback
@@ -25,7 +27,7 @@ codes = {
     #'WeightWatcher': 'ww'
 }
 
-def run_sex(pipeline, step_id, files, api_kwargs={}, frames=[]):
+def run_sex(pipeline, step_id, files, api_kwargs={}, frames=[], frame_workers=None):
     """
     Run SExtractor with a specified set of parameters.
     
@@ -47,6 +49,11 @@ def run_sex(pipeline, step_id, files, api_kwargs={}, frames=[]):
     frames: list of integers (optional)
         Only run sextractor on a specific set of frames. The default value is an empty list,
         which runs SExtractor without specifying any frames
+    frame_workers: int (optional)
+        Maximum number of frames to run at the same time (see
+        `Astromatic.run_frames`). The default is to run one frame at a time. Unless
+        ``NTHREADS`` is in the config, the CPUs are split between the frames (and
+        any other steps running at the same time, see `set_nthreads`).
     
     Returns
     -------
@@ -63,6 +70,8 @@ def run_sex(pipeline, step_id, files, api_kwargs={}, frames=[]):
             If the WRITE_XML parameter is ``True`` then a table of warnings detected
             in the code is returned
     """
+    # Copy the kwargs so that the step kwargs (and default value) are not modified
+    api_kwargs = copy.deepcopy(api_kwargs)
     if 'code' not in api_kwargs:
         api_kwargs['code'] = 'SExtractor'
     if 'cmd' not in api_kwargs and 'SExtractor' in pipeline.build_paths:
@@ -83,11 +92,17 @@ def run_sex(pipeline, step_id, files, api_kwargs={}, frames=[]):
         if 'XML_NAME' not in api_kwargs['config']:
             api_kwargs['config']['XML_NAME'] = os.path.join(pipeline.paths['log'], 
                 '{0}.sex.log.xml'.format(step_id))
+        if api_kwargs.get('store_output', False) and 'output_log' not in api_kwargs:
+            api_kwargs['output_log'] = os.path.join(pipeline.paths['log'],
+                '{0}.sex.log'.format(step_id))
+    set_nthreads(api_kwargs, getattr(pipeline, 'run_workers', 1), frames, frame_workers,
+        getattr(pipeline, 'step_cpus', None))
     sex = Astromatic(**api_kwargs)
     if len(frames)==0:
         result = sex.run(files['image'])
     else:
-        result = sex.run_frames(files['image'], 'SExtractor', frames, False)
+        result = sex.run_frames(files['image'], 'SExtractor', frames, False,
+            max_workers=frame_workers)
     return result
     
 def run_scamp(pipeline, step_id, catalogs, api_kwargs={}, save_catalog=None):
@@ -124,6 +139,8 @@ def run_scamp(pipeline, step_id, catalogs, api_kwargs={}, save_catalog=None):
             If the WRITE_XML parameter is ``True`` then a table of warnings detected
             in the code is returned
     """
+    # Copy the kwargs so that the step kwargs (and default value) are not modified
+    api_kwargs = copy.deepcopy(api_kwargs)
     if 'code' not in api_kwargs:
         api_kwargs['code'] = 'SCAMP'
     if 'cmd' not in api_kwargs and 'SCAMP' in pipeline.build_paths:
@@ -141,11 +158,16 @@ def run_scamp(pipeline, step_id, catalogs, api_kwargs={}, save_catalog=None):
         if 'XML_NAME' not in api_kwargs['config']:
             api_kwargs['config']['XML_NAME'] = os.path.join(pipeline.paths['log'], 
                 '{0}.scamp.log.xml'.format(step_id))
+        if api_kwargs.get('store_output', False) and 'output_log' not in api_kwargs:
+            api_kwargs['output_log'] = os.path.join(pipeline.paths['log'],
+                '{0}.scamp.log'.format(step_id))
+    set_nthreads(api_kwargs, getattr(pipeline, 'run_workers', 1),
+        cpus=getattr(pipeline, 'step_cpus', None))
     scamp = Astromatic(**api_kwargs)
     result = scamp.run(catalogs)
     return result
     
-def run_swarp(pipeline, step_id, filenames, api_kwargs, frames=[]):
+def run_swarp(pipeline, step_id, filenames, api_kwargs, frames=[], frame_workers=None):
     """
     Run SWARP with a specified set of parameters
     
@@ -163,6 +185,11 @@ def run_swarp(pipeline, step_id, filenames, api_kwargs, frames=[]):
     frames: list (optional)
         Subset of frames to stack. Default value is an empty list, which runs SWarp on
         without specifying any frames
+    frame_workers: int (optional)
+        Maximum number of frames to run at the same time (see
+        `Astromatic.run_frames`). The default is to run one frame at a time. Unless
+        ``NTHREADS`` is in the config, the CPUs are split between the frames (and
+        any other steps running at the same time, see `set_nthreads`).
     
     Returns
     -------
@@ -179,6 +206,8 @@ def run_swarp(pipeline, step_id, filenames, api_kwargs, frames=[]):
             If the WRITE_XML parameter is ``True`` then a table of warnings detected
             in the code is returned
     """
+    # Copy the kwargs so that the step kwargs (and default value) are not modified
+    api_kwargs = copy.deepcopy(api_kwargs)
     if 'code' not in api_kwargs:
         api_kwargs['code'] = 'SWarp'
     if 'cmd' not in api_kwargs and 'SWARP' in pipeline.build_paths:
@@ -197,11 +226,17 @@ def run_swarp(pipeline, step_id, filenames, api_kwargs, frames=[]):
         if 'XML_NAME' not in api_kwargs['config']:
             api_kwargs['config']['XML_NAME'] = os.path.join(pipeline.paths['log'], 
                 '{0}.swarp.log.xml'.format(step_id))
+        if api_kwargs.get('store_output', False) and 'output_log' not in api_kwargs:
+            api_kwargs['output_log'] = os.path.join(pipeline.paths['log'],
+                '{0}.swarp.log'.format(step_id))
+    set_nthreads(api_kwargs, getattr(pipeline, 'run_workers', 1), frames, frame_workers,
+        getattr(pipeline, 'step_cpus', None))
     swarp = Astromatic(**api_kwargs)
     if len(frames)==0:
         result = swarp.run(filenames)
     else:
-        result = swarp.run_frames(filenames, 'SWarp', frames, False)
+        result = swarp.run_frames(filenames, 'SWarp', frames, False,
+            max_workers=frame_workers)
     return result
     
 def run_psfex(pipeline, step_id, catalogs, api_kwargs={}):
@@ -235,6 +270,8 @@ def run_psfex(pipeline, step_id, catalogs, api_kwargs={}):
             If the WRITE_XML parameter is ``True`` then a table of warnings detected
             in the code is returned
     """
+    # Copy the kwargs so that the step kwargs (and default value) are not modified
+    api_kwargs = copy.deepcopy(api_kwargs)
     if 'code' not in api_kwargs:
         api_kwargs['code'] = 'PSFEx'
     if 'cmd' not in api_kwargs and 'PSFEx' in pipeline.build_paths:
@@ -251,10 +288,461 @@ def run_psfex(pipeline, step_id, catalogs, api_kwargs={}):
         if 'XML_NAME' not in api_kwargs['config']:
             api_kwargs['config']['XML_NAME'] = os.path.join(pipeline.paths['log'], 
                 '{0}.psfex.log.xml'.format(step_id))
+        if api_kwargs.get('store_output', False) and 'output_log' not in api_kwargs:
+            api_kwargs['output_log'] = os.path.join(pipeline.paths['log'],
+                '{0}.psfex.log'.format(step_id))
+    set_nthreads(api_kwargs, getattr(pipeline, 'run_workers', 1),
+        cpus=getattr(pipeline, 'step_cpus', None))
     psfex = Astromatic(**api_kwargs)
     result = psfex.run(catalogs)
     return result
 
+# Default number of threads (0 uses all of the CPUs) and the config parameters
+# (with their default values in MB) that set the memory used by each code
+code_resources = {
+    'PSFEx': (0, {}),
+    'SCAMP': (0, {}),
+    'SExtractor': (1, {}),
+    'SWarp': (0, {'MEM_MAX': 256, 'COMBINE_BUFSIZE': 256}),
+}
+
+def get_frame_concurrency(frames=[], frame_workers=None):
+    """
+    Number of frames that are run at the same time by `Astromatic.run_frames`
+    """
+    if frame_workers is None or frame_workers<=1 or len(frames)<=1:
+        return 1
+    return min(frame_workers, len(frames))
+
+def get_nthreads(concurrent=1, cpus=None):
+    """
+    Number of threads each code should use so that ``concurrent`` codes running at
+    the same time use all of the CPUs without running more threads than there
+    are CPUs.
+    
+    Parameters
+    ----------
+    concurrent: int (optional)
+        Number of codes running at the same time
+    cpus: int (optional)
+        Number of CPUs. The default is the number of CPUs on the current machine.
+    
+    Returns
+    -------
+    nthreads: int
+        Number of threads for each code (at least 1)
+    """
+    if cpus is None:
+        from astromatic_wrapper.utils.resources import get_cpu_count
+        cpus = get_cpu_count()
+    return max(1, cpus//max(concurrent, 1))
+
+def set_nthreads(api_kwargs, workers=1, frames=[], frame_workers=None, cpus=None):
+    """
+    Set ``NTHREADS`` in the config of a code that runs at the same time as other
+    codes (in a parallel pipeline or when running multiple frames at once) to
+    split the CPUs between them (see `get_nthreads`). Otherwise the codes default to
+    using all of the CPUs, which slows down all of the codes. If ``NTHREADS`` is
+    already in the config, or only one code is running on the whole machine, the
+    config is not changed.
+    
+    Parameters
+    ----------
+    api_kwargs: dict
+        Keyword arguments used to initialize the `Astromatic` object
+    workers: int (optional)
+        Number of pipeline steps running at the same time
+    frames: list (optional)
+        Frames that are run
+    frame_workers: int (optional)
+        Maximum number of frames run at the same time
+    cpus: int (optional)
+        Number of CPUs reserved for the step by the pipeline (see
+        `astromatic_wrapper.utils.pipeline.Pipeline.run`). If ``cpus`` is given they
+        are split between the frames run at the same time, otherwise all of the CPUs
+        on the machine are split between ``workers`` steps.
+    """
+    if 'NTHREADS' in api_kwargs['config']:
+        return
+    n_frames = get_frame_concurrency(frames, frame_workers)
+    if cpus is not None:
+        api_kwargs['config']['NTHREADS'] = get_nthreads(n_frames, cpus)
+        return
+    concurrent = max(workers, 1)*n_frames
+    if concurrent>1:
+        api_kwargs['config']['NTHREADS'] = get_nthreads(concurrent)
+
+def get_resources(code, func_kwargs, workers=1):
+    """
+    Infer the CPUs and memory used by a pipeline step that runs an astromatic code
+    (for example `run_swarp`) from the ``NTHREADS`` and memory parameters in its
+    config. This is used by `astromatic_wrapper.utils.pipeline.Pipeline` to decide
+    which steps can run at the same time.
+    
+    Parameters
+    ----------
+    code: str
+        Name of the code
+    func_kwargs: dict
+        Keyword arguments of the step
+    workers: int (optional)
+        Number of steps the pipeline runs at the same time, which is used to set
+        ``NTHREADS`` if it is not in the config (see `set_nthreads`)
+    
+    Returns
+    -------
+    resources: dict
+        Number of ``cpus`` and ``memory`` (in MB) used by the step
+    """
+    from astromatic_wrapper.utils.resources import get_cpu_count
+    default_threads, memory_params = code_resources[code]
+    config = func_kwargs.get('api_kwargs', {}).get('config', {})
+    # Multiple frames may run at the same time
+    frames = func_kwargs.get('frames', [])
+    n_frames = get_frame_concurrency(frames, func_kwargs.get('frame_workers', None))
+    if 'NTHREADS' in config:
+        threads = int(config['NTHREADS'])
+    elif max(workers, 1)*n_frames>1:
+        threads = get_nthreads(max(workers, 1)*n_frames)
+    else:
+        threads = default_threads
+    if threads<=0:
+        threads = get_cpu_count()
+    memory = sum([int(config.get(param, default))
+        for param, default in memory_params.items()])
+    return {'cpus': threads*n_frames, 'memory': memory*n_frames}
+
+run_sex.get_resources = functools.partial(get_resources, 'SExtractor')
+run_scamp.get_resources = functools.partial(get_resources, 'SCAMP')
+run_swarp.get_resources = functools.partial(get_resources, 'SWarp')
+run_psfex.get_resources = functools.partial(get_resources, 'PSFEx')
+
+def calibrate_threads(astromatic, filenames, frames, cpus=None, frame_workers=None,
+        **kwargs):
+    """
+    Time `Astromatic.run_frames` using different splits of the CPUs between the number
+    of frames run at the same time and the number of threads used to run each frame,
+    to find the fastest split on the current machine. For example, on a machine
+    with 16 CPUs this compares running 1 frame at a time with 16 threads, 2 frames with
+    8 threads each, and so on.
+    
+    Parameters
+    ----------
+    astromatic: `Astromatic`
+        Code to run (for example SExtractor or SWarp)
+    filenames: str or list
+        Name of a multi-extension image (or list of images) to run
+    frames: list
+        Frames to run in each trial
+    cpus: int (optional)
+        Number of CPUs to split. The default is the number of CPUs on the machine.
+    frame_workers: list (optional)
+        Number of frames to run at the same time in each trial. The default is
+        every power of 2 up to the number of CPUs (or frames).
+    **kwargs: keyword arguments
+        Keyword arguments passed to `Astromatic.run_frames`
+    
+    Returns
+    -------
+    best: dict
+        ``frame_workers`` and ``nthreads`` of the fastest trial
+    timings: `astropy.table.Table`
+        Table with the ``frame_workers``, ``nthreads`` and run ``time`` (in seconds)
+        of each trial, sorted by time
+    """
+    from timeit import default_timer
+    from astropy.table import Table
+    if cpus is None:
+        from astromatic_wrapper.utils.resources import get_cpu_count
+        cpus = get_cpu_count()
+    max_workers = max(1, min(cpus, len(frames)))
+    if frame_workers is None:
+        frame_workers = []
+        n = 1
+        while n<max_workers:
+            frame_workers.append(n)
+            n *= 2
+        frame_workers.append(max_workers)
+    config = kwargs.pop('config', astromatic.config)
+    rows = []
+    for workers in frame_workers:
+        nthreads = get_nthreads(workers, cpus)
+        trial_config = OrderedDict(config)
+        trial_config['NTHREADS'] = nthreads
+        start = default_timer()
+        astromatic.run_frames(filenames, frames=frames, max_workers=workers,
+            config=trial_config, **kwargs)
+        rows.append((workers, nthreads, default_timer()-start))
+        logger.info('{0} frames with {1} threads: {2:.2f}s'.format(*rows[-1]))
+    timings = Table(rows=rows, names=('frame_workers', 'nthreads', 'time'))
+    timings.sort('time')
+    best = {
+        'frame_workers': int(timings['frame_workers'][0]),
+        'nthreads': int(timings['nthreads'][0])
+    }
+    return best, timings
+
+def launch(cmd, **kwargs):
+    """
+    Start a subprocess. If ``cmd`` is a list of arguments the executable is run
+    directly (without starting a shell), which allows filenames to contain spaces and
+    other characters that have a special meaning in the shell. Since there is no
+    shell to expand them, ``~`` and environment variables (for example
+    ``~/astromatic/bin/sex`` or ``$ASTROMATIC_BIN/sex``) in the name of the
+    executable are expanded before it is run. On Python 3 file
+    descriptors are not inherited by default, so ``close_fds`` is turned off and the
+    full path of the executable is given, which allows ``subprocess`` to start the
+    process using ``posix_spawn`` where it is available.
+    
+    Parameters
+    ----------
+    cmd: list or str
+        List of command line arguments (starting with the executable) or a
+        command string to run in a shell
+    kwargs: dict
+        Keyword arguments passed to `subprocess.Popen`
+    
+    Returns
+    -------
+    p: `subprocess.Popen`
+        The running process
+    """
+    import sys
+    if not isinstance(cmd, list):
+        return subprocess.Popen(cmd, shell=True, universal_newlines=True, **kwargs)
+    args = list(cmd)
+    args[0] = find_executable(args[0])
+    if sys.version_info >= (3,4):
+        kwargs.setdefault('close_fds', False)
+    return subprocess.Popen(args, universal_newlines=True, **kwargs)
+
+def find_executable(executable):
+    """
+    Expand ``~`` and environment variables in the name of an executable and, on
+    Python 3, search the ``PATH`` for its full path.
+    
+    Parameters
+    ----------
+    executable: str
+        Name of the executable
+    
+    Returns
+    -------
+    executable: str
+        Expanded name (or full path, if it was found) of the executable
+    """
+    import sys
+    executable = os.path.expanduser(os.path.expandvars(executable))
+    if sys.version_info >= (3,4):
+        import shutil
+        full_path = shutil.which(executable)
+        if full_path is not None:
+            executable = full_path
+    return executable
+
+def get_process_io(pid):
+    """
+    Get the number of bytes read and written by a process from ``/proc/<pid>/io``
+    (only available on Linux).
+    
+    Parameters
+    ----------
+    pid: int
+        Process id
+    
+    Returns
+    -------
+    io: dict
+        ``read_chars`` and ``write_chars`` (all bytes read and written, including
+        reads from the page cache) and ``read_bytes`` and ``write_bytes`` (bytes
+        read from and written to storage). If the file can't be read an empty dict
+        is returned.
+    """
+    try:
+        f = open('/proc/{0}/io'.format(pid))
+        try:
+            lines = f.readlines()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return {}
+    counters = {}
+    for line in lines:
+        key, sep, value = line.partition(':')
+        if sep!='':
+            counters[key.strip()] = int(value)
+    io = {}
+    for key, name in [('rchar', 'read_chars'), ('wchar', 'write_chars'),
+            ('read_bytes', 'read_bytes'), ('write_bytes', 'write_bytes')]:
+        if key in counters:
+            io[name] = counters[key]
+    return io
+
+def wait_process(p, start=None):
+    """
+    Wait for a process to finish and measure the resources it used. Where
+    ``os.wait4`` is available the CPU time and maximum memory used by the process
+    are recorded, and on Linux the bytes it read and wrote (see `get_process_io`).
+    
+    Parameters
+    ----------
+    p: `subprocess.Popen`
+        The running process
+    start: float (optional)
+        Time the process was started (from `timeit.default_timer`), used to
+        calculate the wall time of the process
+    
+    Returns
+    -------
+    status: int
+        Return code of the process
+    usage: dict
+        Resources used by the process. Depending on the platform this contains
+        ``wall_time``, ``user_time`` and ``sys_time`` (in seconds), ``max_rss`` (the
+        maximum resident memory in MB) and the I/O counters from `get_process_io`.
+    """
+    import sys
+    from timeit import default_timer
+    usage = {}
+    if hasattr(os, 'wait4') and p.returncode is None:
+        if hasattr(os, 'waitid') and sys.platform.startswith('linux'):
+            # Wait for the process to exit without reaping it, so that its
+            # I/O counters can still be read
+            try:
+                os.waitid(os.P_PID, p.pid, os.WEXITED|os.WNOWAIT)
+                usage.update(get_process_io(p.pid))
+            except OSError:
+                pass
+        pid, status, rusage = os.wait4(p.pid, 0)
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
+        usage['user_time'] = rusage.ru_utime
+        usage['sys_time'] = rusage.ru_stime
+        # ru_maxrss is in bytes on OS X and kB on other platforms
+        if sys.platform=='darwin':
+            usage['max_rss'] = rusage.ru_maxrss/(1024.*1024)
+        else:
+            usage['max_rss'] = rusage.ru_maxrss/1024.
+    else:
+        p.wait()
+    if start is not None:
+        usage['wall_time'] = default_timer()-start
+    return p.returncode, usage
+
+def combine_usage(usages):
+    """
+    Combine the resources used by a set of processes (see `wait_process`). The
+    maximum of ``max_rss`` is used and all other values are added together.
+    """
+    combined = {}
+    for usage in usages:
+        for key, value in usage.items():
+            if key not in combined:
+                combined[key] = value
+            elif key=='max_rss':
+                combined[key] = max(combined[key], value)
+            else:
+                combined[key] += value
+    return combined
+
+def read_output(stream, output_log=None, max_lines=None):
+    """
+    Read the output of a code one line at a time while it runs. Only the most recent
+    ``max_lines`` lines are kept in memory, while the entire output can be written to
+    a log file. The first line that contains an error is logged as soon as it is read.
+    
+    Parameters
+    ----------
+    stream: file
+        Output stream of the process (for example ``Popen.stdout``)
+    output_log: str (optional)
+        Name of a file to write the output to
+    max_lines: int (optional)
+        Maximum number of lines to keep. The default is ``None``, which keeps
+        every line.
+    
+    Returns
+    -------
+    output: list
+        The last ``max_lines`` lines of output
+    error_msg: str
+        The first line of output that contained an error, or ``None`` if no errors
+        were found
+    """
+    from collections import deque
+    output = deque(maxlen=max_lines)
+    error_msg = None
+    if output_log is not None:
+        log = open(output_log, 'w')
+    try:
+        for line in iter(stream.readline, ''):
+            if output_log is not None:
+                log.write(line)
+            output.append(line)
+            if error_msg is None and 'error' in line.lower():
+                error_msg = line
+                logger.error(line.rstrip())
+    finally:
+        if output_log is not None:
+            log.close()
+    return list(output), error_msg
+
+def write_params_file(params, path):
+    """
+    Write a list of SExtractor output parameters to a file in ``path``. The file is
+    named using a hash of its contents, so runs with different parameters (for example
+    parallel pipelines sharing a temp directory) use different files and runs with the
+    same parameters reuse the same file. The file is written to a temporary file and
+    renamed, so a partially written file is never used.
+    
+    Parameters
+    ----------
+    params: list
+        List of SExtractor output parameters
+    path: str
+        Directory to save the file in
+    
+    Returns
+    -------
+    param_name: str
+        Name of the parameters file
+    """
+    import hashlib
+    import tempfile
+    text = ''.join([p+'\n' for p in params])
+    param_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    param_name = os.path.join(path, 'sex-{0}.param'.format(param_hash[:16]))
+    if os.path.isfile(param_name):
+        return param_name
+    fd, temp_name = tempfile.mkstemp(dir=path, suffix='.param.tmp')
+    f = os.fdopen(fd, 'w')
+    try:
+        f.write(text)
+    finally:
+        f.close()
+    try:
+        os.rename(temp_name, param_name)
+    except OSError:
+        # Another process created the file first (on Windows rename does not
+        # replace an existing file)
+        os.remove(temp_name)
+        if not os.path.isfile(param_name):
+            raise
+    return param_name
+
+def format_config_value(value):
+    """
+    Format the value of a config option for the command line (booleans are
+    converted to ``Y`` or ``N``).
+    """
+    if isinstance(value, bool):
+        if value:
+            return 'Y'
+        return 'N'
+    return str(value)
+
 class AstromaticError(Exception):
     pass
 
@@ -263,7 +751,7 @@ class Astromatic:
     Class to hold config options for an Astrometric code. 
     """
     def __init__(self, code, temp_path=None, config={}, config_file=None, store_output=False, 
-            **kwargs):
+            output_log=None, max_output_lines=1000, **kwargs):
         """
         Initialize a particular astromatic code with a given set of configurations.
         
@@ -283,6 +771,13 @@ class Astromatic:
             If ``store_output`` is ``False``, the output of the code is printed to 
             sys.stdout. If ``store_output`` is ``True`` the output is saved in a variable
             that is returned when the function is run.
+        output_log: str (optional)
+            If ``store_output==True`` the entire output of the code is written to
+            ``output_log`` as it runs (when running individual frames the frame number
+            is added to the filename, for example 'sex-1.log').
+        max_output_lines: int (optional)
+            If ``store_output==True`` only the last ``max_output_lines`` lines of output
+            are returned. The default is ``1000``.
         """
         self.code = code
         if code not in codes:
@@ -292,12 +787,14 @@ class Astromatic:
         self.config = config
         self.config_file = config_file
         self.store_output = store_output
+        self.output_log = output_log
+        self.max_output_lines = max_output_lines
         for k, v in kwargs.items():
             setattr(self, k, v)
     
-    def build_cmd(self, filenames, **kwargs):
+    def build_args(self, filenames, **kwargs):
         """
-        Build a command to run an astromatic code.
+        Build the list of command line arguments used to run an astromatic code.
         
         Parameters
         ----------
@@ -316,11 +813,13 @@ class Astromatic:
         
         Returns
         -------
-        cmd: str
-            Commandline statement to run the given code
+        args: list
+            Command line arguments used to run the given code (starting with the
+            executable)
         kwargs: dict
             Dictionary of keyword arguments used in the build
         """
+        import shlex
         # If a single catalog is passed, convert to an array
         if not isinstance(filenames, list):
             filenames = [filenames]
@@ -339,11 +838,7 @@ class Astromatic:
                     raise AstromaticError(
                         "You must either supply a 'PARAMETERS_NAME' in 'config' or "+
                         "a 'temp_path' to store the temporary parameters file")
-                param_name = os.path.join(kwargs['temp_path'], 'sex.param')
-                f = open(param_name, 'w')
-                for p in kwargs['params']:
-                    f.write(p+'\n')
-                f.close()
+                param_name = write_params_file(kwargs['params'], kwargs['temp_path'])
                 kwargs['config']['PARAMETERS_NAME'] = param_name
             elif 'PARAMETERS_NAME' not in kwargs['config']:
                 raise AstromaticError(
@@ -355,29 +850,45 @@ class Astromatic:
                 raise AstromaticError(
                     "You must either supply a valid astromatic 'code' name or "+
                     "a 'cmd' to run")
-            cmd = codes[kwargs['code']]
+            args = [codes[kwargs['code']]]
         else:
-            cmd = kwargs['cmd']
-        if cmd[-1]!=' ':
-            cmd += ' '
+            args = shlex.split(kwargs['cmd'])
         # Append the filename(s) that are run by the code
-        cmd += ' '.join(filenames)
+        args += filenames
         # If the user specified a config file, use it
         if kwargs['config_file'] is not None:
-            cmd += ' -c '+kwargs['config_file']
+            args += ['-c', kwargs['config_file']]
         # Add on any user specified parameters
         for param in kwargs['config']:
-            if isinstance(kwargs['config'][param], bool):
-                if kwargs['config'][param]:
-                    val='Y'
-                else:
-                    val='N'
-            else:
-                val = kwargs['config'][param]
-            cmd += ' -'+param+' '+val
-        return (cmd, kwargs)
+            args += ['-'+param, format_config_value(kwargs['config'][param])]
+        return (args, kwargs)
+    
+    def build_cmd(self, filenames, **kwargs):
+        """
+        Build a command to run an astromatic code. This is the command built by
+        `Astromatic.build_args` as a single string, which is used for logging and
+        to display the command to the user (the code is run from the list of
+        arguments, without using a shell).
+        
+        Parameters
+        ----------
+        filenames: str or list
+            Name of a file or list of filenames to run in the command line statement
+        **kwargs: keyword arguments
+            See `Astromatic.build_args`
+        
+        Returns
+        -------
+        cmd: str
+            Commandline statement to run the given code
+        kwargs: dict
+            Dictionary of keyword arguments used in the build
+        """
+        args, kwargs = self.build_args(filenames, **kwargs)
+        return (' '.join(args), kwargs)
     
-    def _run_cmd(self, this_cmd, store_output=False, xml_name=None, raise_error=True, frame=None):
+    def _run_cmd(self, this_cmd, store_output=False, xml_name=None, raise_error=True, frame=None,
+            output_log=None):
         """
         Execute a command to run an astromatic code. Since this allows a user to
         run any command on the host, it is recommended that no public
@@ -385,8 +896,10 @@ class Astromatic:
         
         Parameters
         ----------
-        this_cmd: str
-            The command to run from a subprocess. 
+        this_cmd: list or str
+            The command to run from a subprocess. If ``this_cmd`` is a list of
+            arguments (see `Astromatic.build_args`) the code is run directly,
+            otherwise the command string is run in a shell.
         store_output: bool (optional)
             Whether to store the output and return it to the user or print the output
             to the screen.
@@ -396,6 +909,11 @@ class Astromatic:
         raise_error: bool
             If ``raise_error==True``, python will raise an error if the 
             astromatic code fails due to an error
+        frame: str (optional)
+            Frame that is being run
+        output_log: str (optional)
+            Name of the file used to log the output if ``store_output==True``. The
+            default is ``Astromatic.output_log`` (with the frame number added).
         
         Returns
         -------
@@ -405,66 +923,85 @@ class Astromatic:
             - error_msg: str
                 If there is an error and the user is storing the output or exporting XML metadata,
                 ``error_msg`` will contain the error message generated by the code
-            - output: str
-                If ``store_output==True`` the output of the program execution is
-                stored in the ``output`` value.
+            - output: list
+                If ``store_output==True`` the last ``Astromatic.max_output_lines``
+                lines of output from the program execution are stored in the
+                ``output`` value.
             - warnings: str
                 If the WRITE_XML parameter is ``True`` then a table of warnings detected
                 in the code is returned
+            - usage: dict
+                CPU time, memory and I/O used by the code (see `wait_process`) and
+                the time taken to read the XML log (``xml_time``)
         """
+        from timeit import default_timer
+        from astromatic_wrapper.utils import trace
         result = {'status':'success'}
         # Run code
-        logger.info('cmd:\n{0}\n'.format(this_cmd))
-        if store_output:
-            p = subprocess.Popen(this_cmd, shell=True, stdout=subprocess.PIPE, 
-                stderr=subprocess.STDOUT)
-            output = p.stdout.readlines()
-            result['output'] = output
-            for line in output:
-                if 'error' in line.lower():
+        self._log_cmd(this_cmd)
+        start = default_timer()
+        with trace.span(self.code, 'subprocess', frame=frame):
+            if store_output:
+                if output_log is None:
+                    output_log = self._get_output_log(frame)
+                with trace.span('launch', 'subprocess'):
+                    p = launch(this_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                # Always close the pipe and reap the process, even if the output
+                # can't be read or written to the log
+                try:
+                    output, error_msg = read_output(p.stdout, output_log, 
+                        getattr(self, 'max_output_lines', None))
+                finally:
+                    p.stdout.close()
+                    status, result['usage'] = wait_process(p, start)
+                result['output'] = output
+                if error_msg is not None:
+                    result['status'] = 'error'
+                    result['error_msg'] = error_msg
+            else:
+                with trace.span('launch', 'subprocess'):
+                    p = launch(this_cmd)
+                status, result['usage'] = wait_process(p, start)
+                if status>0:
                     result['status'] = 'error'
-                    result['error_msg'] = line
-                    break
+        return self._finish_cmd(result, store_output, xml_name, raise_error, frame)
+    
+    def _log_cmd(self, this_cmd):
+        if isinstance(this_cmd, list):
+            logger.info('cmd:\n{0}\n'.format(' '.join(this_cmd)))
         else:
-            status = subprocess.call(this_cmd, shell=True)
-            if status>0:
-                result['status'] = 'error'
-                if xml_name is not None:
-                    from astropy.io.votable import parse
-                    votable = parse(xml_name)
-                    for param in votable.resources[0].resources[0].params:
-                        if param.name=='Error_Msg':
-                            result['error_msg'] = param.value
+            logger.info('cmd:\n{0}\n'.format(this_cmd))
+    
+    def _get_output_log(self, frame=None):
+        """
+        Name of the file used to log the output of the code (when running individual
+        frames the frame number is added to the filename)
+        """
+        output_log = getattr(self, 'output_log', None)
+        if output_log is not None and frame is not None:
+            root, ext = os.path.splitext(output_log)
+            output_log = '{0}-{1}{2}'.format(root, frame, ext)
+        return output_log
+    
+    def _finish_cmd(self, result, store_output=False, xml_name=None, raise_error=True,
+            frame=None):
+        """
+        Read the XML log (if there is one) after a code has finished running and raise
+        an `AstromaticError` if the code failed and ``raise_error==True``. See
+        `Astromatic._run_cmd` for a description of the parameters and result.
+        """
         # Log any warnings generated by the astromatic code
         if xml_name is not None:
-            # SExtractor logs have a '-1' added to the filename and also
-            # stream the output catalog to the votable. Since the output may
-            # be a FITS_LDAC file, astropy does not rad this properly and it
-            # causes the read to crash. This code removes the link to the FITS_LDAC file
             if frame is not None:
                 xml_name = xml_name.replace('.xml','-{0}.xml'.format(frame))
-            if self.code == 'SExtractor':
-                f = open(xml_name, 'r')
-                all_lines = f.readlines()
-                f.close()
-                f = open(xml_name, 'w')
-                for line in all_lines:
-                    if '<fits' not in line.lower():
-                        f.write(line)
-                    elif '</DATA>' in line.upper():
-                        f.write('</DATA>\n')
-                f.close()
-            
-            from astropy.table import Table
-            from astropy.io.votable import parse
-            # Sometimes the xml file does not fit the VOTABLE standard,
-            # so we mask the invalid parameters
-            votable = parse(xml_name, invalid='mask', pedantic=False)
-            result['warnings'] = Table.read(votable, table_id='Warnings', format='votable')
-            # Fill in the masked values (otherwise there are problems with 
-            # pipeline pickling)
-            result['warnings'] = result['warnings'].filled(0)
-            result['warnings'].meta['filename'] = xml_name
+            from timeit import default_timer
+            from astromatic_wrapper.utils import trace
+            start = default_timer()
+            with trace.span('read XML log', 'xml', filename=xml_name):
+                result['warnings'], error_msg = self._read_xml_log(xml_name)
+            result.setdefault('usage', {})['xml_time'] = default_timer()-start
+            if not store_output and result['status']=='error' and error_msg is not None:
+                result['error_msg'] = error_msg
         # Raise an Exception if appropriate
         if result['status'] == 'error' and raise_error:
             error_msg = "Error in '{0}' execution".format(self.code)
@@ -473,7 +1010,63 @@ class Astromatic:
             raise AstromaticError(error_msg)
         return result
     
-    def run(self, filenames, store_output=False, raise_error=True, **kwargs):
+    def _read_xml_log(self, xml_name):
+        """
+        Read the warnings and error message from an XML log file generated by the
+        code. The log is read using `astromatic_wrapper.utils.xmllog.parse_xml_log`,
+        which only loads the ``Warnings`` table and ``Error_Msg`` parameter. If that
+        fails, the entire file is parsed using `astropy.io.votable`.
+        
+        Parameters
+        ----------
+        xml_name: str
+            Name of the XML file
+        
+        Returns
+        -------
+        warnings: `astropy.table.Table`
+            Table of warnings generated by the code
+        error_msg: str
+            Error message generated by the code (``None`` if there was no error message)
+        """
+        from astromatic_wrapper.utils import xmllog
+        try:
+            return xmllog.parse_xml_log(xml_name)
+        except xmllog.XMLLogError as error:
+            logger.debug('{0}, using astropy to read the log'.format(error))
+        # SExtractor logs have a '-1' added to the filename and also
+        # stream the output catalog to the votable. Since the output may
+        # be a FITS_LDAC file, astropy does not rad this properly and it
+        # causes the read to crash. This code removes the link to the FITS_LDAC file
+        if self.code == 'SExtractor':
+            f = open(xml_name, 'r')
+            all_lines = f.readlines()
+            f.close()
+            f = open(xml_name, 'w')
+            for line in all_lines:
+                if '<fits' not in line.lower():
+                    f.write(line)
+                elif '</DATA>' in line.upper():
+                    f.write('</DATA>\n')
+            f.close()
+        
+        from astropy.table import Table
+        from astropy.io.votable import parse
+        # Sometimes the xml file does not fit the VOTABLE standard,
+        # so we mask the invalid parameters
+        votable = parse(xml_name, invalid='mask', pedantic=False)
+        error_msg = None
+        for param in votable.resources[0].resources[0].params:
+            if param.name=='Error_Msg':
+                error_msg = param.value
+        warnings = Table.read(votable, table_id='Warnings', format='votable')
+        # Fill in the masked values (otherwise there are problems with 
+        # pipeline pickling)
+        warnings = warnings.filled(0)
+        warnings.meta['filename'] = xml_name
+        return warnings, error_msg
+    
+    def run(self, filenames, store_output=None, raise_error=True, **kwargs):
         """
         Build the command and run the code with a given set of options. If one of the
         keyword arguments is ``store_output=True`` the output of the code is returned,
@@ -485,7 +1078,7 @@ class Astromatic:
             Name of a file or list of filenames to run in the command line statement
         store_output: bool (optional)
             Whether to store the output and return it to the user or print the output
-            to the screen.
+            to the screen. The default is ``Astromatic.store_output``.
         raise_error: bool (optional)
             If ``raise_error==True``, python will raise an error if the 
             astromatic code fails due to an error
@@ -515,17 +1108,36 @@ class Astromatic:
                 If the WRITE_XML parameter is ``True`` then a table of warnings detected
                 in the code is returned
         """
-        this_cmd, kwargs = self.build_cmd(filenames, **kwargs)
+        this_cmd, store_output, xml_name = self._prepare_run(filenames, store_output,
+            **kwargs)
+        return self._run_cmd(this_cmd, store_output, xml_name, raise_error)
+    
+    def _prepare_run(self, filenames, store_output=None, **kwargs):
+        """
+        Build the arguments used by `Astromatic.run`.
+        
+        Returns
+        -------
+        this_cmd: list
+            Command line arguments used to run the code
+        store_output: bool
+            Whether or not to store the output
+        xml_name: str
+            Name of the XML log file (``None`` if the code does not write one)
+        """
+        this_cmd, kwargs = self.build_args(filenames, **kwargs)
         if ('WRITE_XML' in kwargs['config'] and 'XML_NAME' in kwargs['config']
                         and kwargs['config']['WRITE_XML'] == 'Y'):
             xml_name = kwargs['config']['XML_NAME']
         else:
             xml_name = None
         
-        return self._run_cmd(this_cmd, store_output, xml_name, raise_error)
+        if store_output is None:
+            store_output = self.store_output
+        return this_cmd, store_output, xml_name
     
     def run_frames(self, filenames, code=None, frames=[1], raise_error=True,
-            **kwargs):
+            max_workers=None, **kwargs):
         """
         If the user is running sextractor on an individual frame, this command will
         correctly add the frame to the image filename, flag filename, and weightmap filename
@@ -543,6 +1155,10 @@ class Astromatic:
         raise_error: bool (optional)
             If ``raise_error==True``, python will raise an error if the 
             astromatic code fails due to an error
+        max_workers: int (optional)
+            Maximum number of frames to run at the same time. The default is ``None``,
+            which runs each frame one after the other. The warnings from each frame
+            are always combined in the same order as ``frames``.
         **kwargs: keyword arguments
             The following are optional keyword arguments that may be used:
                 - config: dict (optional)
@@ -566,6 +1182,39 @@ class Astromatic:
                 If the WRITE_XML parameter is ``True`` then a table of warnings detected
                 in the code is returned
         """
+        from timeit import default_timer
+        from astromatic_wrapper.utils import trace
+        frame_cmds, xml_name = self._prepare_frames(filenames, code, frames, **kwargs)
+        start = default_timer()
+        # Run the code
+        def run_frame(frame_cmd, frame):
+            with trace.span('frame {0}'.format(frame), 'frame', code=self.code):
+                return self._run_cmd(frame_cmd, self.store_output, xml_name, raise_error, 
+                    frame=str(frame))
+        if max_workers is None or max_workers<=1 or len(frames)<=1:
+            frame_results = [run_frame(frame_cmd, frame) 
+                for frame_cmd, frame in zip(frame_cmds, frames)]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                frame_results = list(executor.map(run_frame, frame_cmds, frames))
+            finally:
+                executor.shutdown(wait=True)
+        return self._combine_frames(frames, frame_results, default_timer()-start)
+    
+    def _prepare_frames(self, filenames, code=None, frames=[1], **kwargs):
+        """
+        Build the arguments used to run each frame in `Astromatic.run_frames`.
+        
+        Returns
+        -------
+        frame_cmds: list
+            Command line arguments used to run each frame
+        xml_name: str
+            Name of the XML log file (before the frame number is added), or ``None``
+            if the code does not write one
+        """
         # Set the code to run
         if code is None:
             code = self.code
@@ -588,44 +1237,228 @@ class Astromatic:
         else:
             xml_name = None
         # Build the command
-        this_cmd, kwargs = self.build_cmd(filenames, code=code, **kwargs)
+        this_cmd, kwargs = self.build_args(filenames, code=code, **kwargs)
         
-        # For each frame, modify the command to include the frames and run the code
-        all_warnings = None
-        result = {'status': 'success'}
+        # For each frame, modify the command to include the frames
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        frame_cmds = []
         for frame in frames:
-            new_cmd = this_cmd
             frame_str = '['+str(frame)+']'
-            
             # Convert all multi-extension files to filenames with the same frame specified
-            if not isinstance(filenames, list):
-                filenames = [filenames]
-            for filename in filenames:
-                new_cmd = new_cmd.replace(filename, filename+frame_str)
-            if flag_img is not None:
-                new_cmd = new_cmd.replace(flag_img, flag_img+frame_str)
-            if weight_img is not None:
-                new_cmd = new_cmd.replace(weight_img, weight_img+frame_str)
-            if xml_name is not None:
-                new_cmd = new_cmd.replace(xml_name, xml_name.replace(
-                    '.xml', '-'+str(frame)+'.xml'))
-            # Run the code
-            frame_result = self._run_cmd(new_cmd, False, xml_name, raise_error, frame=str(frame))
-            
-            # Combine all warnings into a single table
+            frame_files = filenames+[f for f in [flag_img, weight_img] if f is not None]
+            new_cmd = []
+            for arg in this_cmd:
+                if arg in frame_files:
+                    arg = arg+frame_str
+                elif xml_name is not None and arg==xml_name:
+                    arg = xml_name.replace('.xml', '-'+str(frame)+'.xml')
+                new_cmd.append(arg)
+            frame_cmds.append(new_cmd)
+        return frame_cmds, xml_name
+    
+    def _combine_frames(self, frames, frame_results, wall_time=None):
+        """
+        Combine the results from each frame run by `Astromatic.run_frames`. The
+        resources used by each frame are added together, and ``wall_time`` is the
+        total time taken to run all of the frames.
+        """
+        # Combine all warnings into a single table (in the same order as frames)
+        all_warnings = []
+        result = {'status': 'success'}
+        for frame, frame_result in zip(frames, frame_results):
             if 'warnings' in frame_result and len(frame_result['warnings'])>0:
-                from astropy.table import vstack
                 warnings = frame_result['warnings']
                 warnings['frame'] = frame
-                if all_warnings is None:
-                    all_warnings = warnings
-                else:
-                    all_warnings = vstack([all_warnings, warnings])
+                all_warnings.append(warnings)
             if frame_result['status'] != 'success':
                 result.update(frame_result)
-        result['warnings'] = all_warnings
+        usages = [frame_result['usage'] for frame_result in frame_results
+            if 'usage' in frame_result]
+        if len(usages)>0:
+            result['usage'] = combine_usage(usages)
+            if wall_time is not None:
+                result['usage']['wall_time'] = wall_time
+        if len(all_warnings)==0:
+            result['warnings'] = None
+        elif len(all_warnings)==1:
+            result['warnings'] = all_warnings[0]
+        else:
+            from astropy.table import vstack
+            result['warnings'] = vstack(all_warnings)
         return result
     
+    def run_async(self, filenames, store_output=None, raise_error=True, **kwargs):
+        """
+        Coroutine version of `Astromatic.run`, which runs the code using
+        `asyncio.create_subprocess_exec` so that many codes can be run from a single
+        event loop (requires Python 3.5 or later). For example::
+
+            result = await sextractor.run_async('image.fits')
+
+        Parameters
+        ----------
+        See `Astromatic.run`
+
+        Returns
+        -------
+        result: coroutine
+            Coroutine that returns the same result as `Astromatic.run`
+        """
+        from astromatic_wrapper import async_api
+        return async_api.run(self, filenames, store_output, raise_error, **kwargs)
+
+    def run_frames_async(self, filenames, code=None, frames=[1], raise_error=True,
+            max_workers=None, **kwargs):
+        """
+        Coroutine version of `Astromatic.run_frames` (requires Python 3.5 or later).
+        At most ``max_workers`` frames are run at the same time (one at a time if
+        ``max_workers`` is ``None``).
+
+        Parameters
+        ----------
+        See `Astromatic.run_frames`
+
+        Returns
+        -------
+        result: coroutine
+            Coroutine that returns the same result as `Astromatic.run_frames`
+        """
+        from astromatic_wrapper import async_api
+        return async_api.run_frames(self, filenames, code, frames, raise_error,
+            max_workers, **kwargs)
+
+    def build_template(self, **kwargs):
+        """
+        Build the command line arguments once so that the same configuration can be
+        run on many inputs (see `Astromatic.submit` and `Astromatic.map`).
+        
+        Parameters
+        ----------
+        **kwargs: keyword arguments
+            See `Astromatic.build_args`
+        
+        Returns
+        -------
+        template: `CommandTemplate`
+            Template used to build the command for each input
+        """
+        return CommandTemplate(self, **kwargs)
+    
+    def submit(self, executor, filenames, config={}, template=None, raise_error=True,
+            store_output=None, output_log=None):
+        """
+        Run the code in a `concurrent.futures.Executor`.
+        
+        Parameters
+        ----------
+        executor: `concurrent.futures.Executor`
+            Executor used to run the code
+        filenames: str or list
+            Name of a file or list of filenames to run
+        config: dict (optional)
+            Config options used for this input only (for example ``CATALOG_NAME``),
+            which override the options in the template
+        template: `CommandTemplate` (optional)
+            Template used to build the command. If no template is given one is built
+            using the current configuration (see `Astromatic.build_template`)
+        raise_error: bool (optional)
+            If ``raise_error==True``, the future raises an `AstromaticError` if the 
+            astromatic code fails due to an error
+        store_output: bool (optional)
+            Whether to store the output. The default is ``Astromatic.store_output``.
+        output_log: str (optional)
+            Name of the file used to log the output if ``store_output==True``
+        
+        Returns
+        -------
+        future: `concurrent.futures.Future`
+            Future with the result of the code execution (see `Astromatic.run`)
+        """
+        if template is None:
+            template = self.build_template()
+        this_cmd, xml_name = template.get_args(filenames, config)
+        if store_output is None:
+            store_output = self.store_output
+        return executor.submit(self._run_cmd, this_cmd, store_output, xml_name, raise_error,
+            output_log=output_log)
+    
+    def map(self, filenames, config=None, executor=None, max_workers=None, raise_error=True,
+            store_output=None, **kwargs):
+        """
+        Run the same configuration on a list of inputs. The command is only built once,
+        and the results are returned as each input finishes (not necessarily in the
+        same order as ``filenames``). This is a generator, so the codes are only run
+        while iterating over the results::
+        
+            for idx, result in sextractor.map(images, config=[
+                    {'CATALOG_NAME': image.replace('.fits', '.cat')} for image in images]):
+                print(images[idx], result['status'])
+        
+        Parameters
+        ----------
+        filenames: list
+            Inputs to run. Each item is a filename or list of filenames.
+        config: list of dict (optional)
+            Config options for each input (for example ``CATALOG_NAME`` or ``XML_NAME``)
+            that override the options in ``kwargs`` or ``Astromatic.config``
+        executor: `concurrent.futures.Executor` (optional)
+            Executor used to run the codes. The default is a
+            `concurrent.futures.ThreadPoolExecutor` that is shut down when all of the
+            inputs have been run.
+        max_workers: int (optional)
+            Maximum number of codes to run at the same time if no ``executor`` is given.
+            The default is the number of CPUs.
+        raise_error: bool (optional)
+            If ``raise_error==True``, python will raise an error if the 
+            astromatic code fails on any of the inputs. Any inputs that have not
+            started are cancelled.
+        store_output: bool (optional)
+            Whether to store the output. The default is ``Astromatic.store_output``.
+            If ``Astromatic.output_log`` is set, the index of each input is added
+            to the name of its log file.
+        **kwargs: keyword arguments
+            Keyword arguments used to build the command template
+            (see `Astromatic.build_args`)
+        
+        Returns
+        -------
+        results: generator
+            ``(idx, result)`` for each input, where ``idx`` is the index of the input
+            in ``filenames`` and ``result`` is the result of the code execution
+            (see `Astromatic.run`)
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        if config is None:
+            config = [{}]*len(filenames)
+        elif len(config)!=len(filenames):
+            raise AstromaticError("'config' must have the same length as 'filenames'")
+        if store_output is None:
+            store_output = self.store_output
+        template = self.build_template(**kwargs)
+        shutdown = executor is None
+        if executor is None:
+            if max_workers is None:
+                import multiprocessing
+                max_workers = multiprocessing.cpu_count()
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {}
+        try:
+            for idx, (input_files, input_config) in enumerate(zip(filenames, config)):
+                output_log = None
+                if store_output:
+                    output_log = self._get_output_log(idx)
+                future = self.submit(executor, input_files, input_config, template,
+                    raise_error, store_output, output_log)
+                futures[future] = idx
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            if shutdown:
+                executor.shutdown(wait=True)
+    
     def get_version(self, cmd=None):
         """
         Get the version of the currently loaded astromatic code
@@ -645,28 +1478,97 @@ class Astromatic:
         date: str
             Date associated with the specified astromatic code
         """
+        import shlex
         # Get the correct command for the given code (if one is not specified)
         if cmd is None:
             if self.code not in codes:
                 raise AstromaticError(
                     "You must either supply a valid astromatic 'code' name or a 'cmd'")
             cmd = codes[self.code]
-        if cmd[-1]!=' ':
-            cmd += ' '
-        cmd += '-v'
+        args = shlex.split(cmd)+['-v']
         try:
-            p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, 
-                stderr=subprocess.STDOUT)
+            p = launch(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         except:
             raise AstromaticError("Unable to run '{0}'. "
                 "Please check that it is installed correctly".format(cmd))
-        for line in p.stdout.readlines():
-            line_split = line.split()
-            line_split = map(lambda x: x.lower(), line_split)
+        try:
+            lines = p.stdout.readlines()
+        finally:
+            p.stdout.close()
+            p.wait()
+        for line in lines:
+            line_split = [x.lower() for x in line.split()]
             if 'version' in line_split:
                 version_idx = line_split.index('version')
                 version = line_split[version_idx+1]
                 date = line_split[version_idx+2]
                 date = date.lstrip('(').rstrip(')')
                 break
-        return version, date
\ No newline at end of file
+        return version, date
+
+class CommandTemplate(object):
+    """
+    Command line arguments for an astromatic code that are built once and reused
+    to run the same configuration on different inputs (see `Astromatic.map`).
+    """
+    def __init__(self, astromatic, **kwargs):
+        """
+        Parameters
+        ----------
+        astromatic: `Astromatic`
+            Code that is run
+        **kwargs: keyword arguments
+            Keyword arguments used to build the command (see `Astromatic.build_args`)
+        """
+        placeholder = '{filenames}'
+        args, kwargs = astromatic.build_args([placeholder], **kwargs)
+        self.file_idx = args.index(placeholder)
+        self.args = args[:self.file_idx]+args[self.file_idx+1:]
+        self.config = kwargs['config']
+        # Location of the value of each config option in the arguments
+        self.config_idx = {}
+        for idx in range(self.file_idx, len(self.args)-1):
+            param = self.args[idx][1:]
+            if param in self.config and param not in self.config_idx:
+                self.config_idx[param] = idx+1
+        self.xml_name = self._get_xml_name(self.config)
+    
+    def _get_xml_name(self, config):
+        if config.get('WRITE_XML')=='Y' and 'XML_NAME' in config:
+            return config['XML_NAME']
+        return None
+    
+    def get_args(self, filenames, config={}):
+        """
+        Build the arguments to run the code on a given input.
+        
+        Parameters
+        ----------
+        filenames: str or list
+            Name of a file or list of filenames to run
+        config: dict (optional)
+            Config options that override the options in the template
+        
+        Returns
+        -------
+        args: list
+            Command line arguments used to run the code
+        xml_name: str
+            Name of the XML log file written by the code (``None`` if the code does
+            not write an XML log)
+        """
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        args = self.args[:self.file_idx]+filenames+self.args[self.file_idx:]
+        for param, value in config.items():
+            value = format_config_value(value)
+            if param in self.config_idx:
+                args[self.config_idx[param]+len(filenames)] = value
+            else:
+                args += ['-'+param, value]
+        xml_name = self.xml_name
+        if 'XML_NAME' in config or 'WRITE_XML' in config:
+            all_config = dict(self.config)
+            all_config.update(config)
+            xml_name = self._get_xml_name(all_config)
+        return args, xml_name
@@ -0,0 +1,204 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Coroutines to run astromatic codes from an asyncio event loop.
+
+This module uses ``async``/``await`` (Python 3.5 or later), so it is not imported
+by `astromatic_wrapper.api`. Use `astromatic_wrapper.api.Astromatic.run_async` and
+`astromatic_wrapper.api.Astromatic.run_frames_async` to run a code.
+"""
+import asyncio
+import functools
+import logging
+from collections import deque
+
+from astromatic_wrapper.api import find_executable
+
+logger = logging.getLogger('astromatic.api')
+
+async def launch(cmd, **kwargs):
+    """
+    Start a subprocess from a coroutine. This is the asyncio version of
+    `astromatic_wrapper.api.launch`, and the executable is found in the same way.
+
+    Parameters
+    ----------
+    cmd: list or str
+        List of command line arguments (starting with the executable) or a
+        command string to run in a shell
+    kwargs: dict
+        Keyword arguments passed to `asyncio.create_subprocess_exec`
+
+    Returns
+    -------
+    p: `asyncio.subprocess.Process`
+        The running process
+    """
+    if not isinstance(cmd, list):
+        return await asyncio.create_subprocess_shell(cmd, **kwargs)
+    args = list(cmd)
+    args[0] = find_executable(args[0])
+    return await asyncio.create_subprocess_exec(*args, **kwargs)
+
+async def read_output(stream, output_log=None, max_lines=None):
+    """
+    Read the output of a code while it runs. This is the asyncio version of
+    `astromatic_wrapper.api.read_output`, and newlines are translated in the same
+    way as the synchronous version (so progress lines ending with ``'\\r'`` are
+    split into separate lines).
+
+    Parameters
+    ----------
+    stream: `asyncio.StreamReader`
+        Output stream of the process
+    output_log: str (optional)
+        Name of a file to write the output to
+    max_lines: int (optional)
+        Maximum number of lines to keep. The default is ``None``, which keeps
+        every line.
+
+    Returns
+    -------
+    output: list
+        The last ``max_lines`` lines of output
+    error_msg: str
+        The first line of output that contained an error, or ``None`` if no errors
+        were found
+    """
+    import codecs
+    import io
+    import locale
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(
+        errors='replace')
+    decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+    output = deque(maxlen=max_lines)
+    error_msg = None
+    partial = ''
+    if output_log is not None:
+        log = open(output_log, 'w')
+    try:
+        while True:
+            chunk = await stream.read(1<<16)
+            final = len(chunk)==0
+            lines = (partial+decoder.decode(chunk, final=final)).split('\n')
+            partial = lines.pop()
+            lines = [line+'\n' for line in lines]
+            if final and partial!='':
+                lines.append(partial)
+            for line in lines:
+                if output_log is not None:
+                    log.write(line)
+                output.append(line)
+                if error_msg is None and 'error' in line.lower():
+                    error_msg = line
+                    logger.error(line.rstrip())
+            if final:
+                break
+    finally:
+        if output_log is not None:
+            log.close()
+    return list(output), error_msg
+
+async def run_cmd(astromatic, this_cmd, store_output=False, xml_name=None,
+        raise_error=True, frame=None):
+    """
+    Execute a command to run an astromatic code. This is the asyncio version of
+    `astromatic_wrapper.api.Astromatic._run_cmd` and returns the same result, except
+    that ``usage`` only contains the ``wall_time`` of the code (since the process is
+    reaped by asyncio). If the coroutine is cancelled or fails the code is killed.
+
+    Parameters
+    ----------
+    astromatic: `astromatic_wrapper.api.Astromatic`
+        Astromatic code that is being run
+    this_cmd: list or str
+        The command to run
+    store_output: bool (optional)
+        Whether to store the output and return it to the user or print the output
+        to the screen.
+    xml_name: str (optional)
+        Name of the XML log file generated by the code
+    raise_error: bool
+        If ``raise_error==True``, python will raise an error if the
+        astromatic code fails due to an error
+    frame: str (optional)
+        Frame that is being run
+
+    Returns
+    -------
+    result: dict
+        Result of the astromatic code execution
+    """
+    from timeit import default_timer
+    result = {'status':'success'}
+    astromatic._log_cmd(this_cmd)
+    start = default_timer()
+    p = None
+    try:
+        if store_output:
+            p = await launch(this_cmd, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT)
+            output, error_msg = await read_output(p.stdout,
+                astromatic._get_output_log(frame),
+                getattr(astromatic, 'max_output_lines', None))
+            await p.wait()
+            result['output'] = output
+            if error_msg is not None:
+                result['status'] = 'error'
+                result['error_msg'] = error_msg
+        else:
+            p = await launch(this_cmd)
+            status = await p.wait()
+            if status>0:
+                result['status'] = 'error'
+        result['usage'] = {'wall_time': default_timer()-start}
+    finally:
+        # Kill and reap the code if the coroutine is cancelled or the output
+        # can't be read or written to the log
+        if p is not None and p.returncode is None:
+            p.kill()
+            await p.wait()
+    if xml_name is None:
+        return astromatic._finish_cmd(result, store_output, xml_name, raise_error, frame)
+    # Read the XML log in a thread so that the event loop is not blocked
+    if hasattr(asyncio, 'get_running_loop'):
+        loop = asyncio.get_running_loop()
+    else:
+        loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(astromatic._finish_cmd,
+        result, store_output, xml_name, raise_error, frame))
+
+async def run(astromatic, filenames, store_output=None, raise_error=True, **kwargs):
+    """
+    Build the command and run the code. See `astromatic_wrapper.api.Astromatic.run`.
+    """
+    this_cmd, store_output, xml_name = astromatic._prepare_run(filenames, store_output,
+        **kwargs)
+    return await run_cmd(astromatic, this_cmd, store_output, xml_name, raise_error)
+
+async def run_frames(astromatic, filenames, code=None, frames=[1], raise_error=True,
+        max_workers=None, **kwargs):
+    """
+    Run the code on individual frames. See
+    `astromatic_wrapper.api.Astromatic.run_frames`. At most ``max_workers`` frames
+    (one frame if ``max_workers`` is ``None``) are run at the same time, and if a
+    frame raises an exception the frames that are still running are cancelled.
+    """
+    from timeit import default_timer
+    frame_cmds, xml_name = astromatic._prepare_frames(filenames, code, frames, **kwargs)
+    semaphore = asyncio.Semaphore(max(max_workers or 1, 1))
+    async def run_frame(frame_cmd, frame):
+        async with semaphore:
+            return await run_cmd(astromatic, frame_cmd, astromatic.store_output, xml_name,
+                raise_error, frame=str(frame))
+    start = default_timer()
+    tasks = [asyncio.ensure_future(run_frame(frame_cmd, frame))
+        for frame_cmd, frame in zip(frame_cmds, frames)]
+    try:
+        frame_results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return astromatic._combine_frames(frames, frame_results, default_timer()-start)
@@ -13,6 +13,10 @@ from collections import OrderedDict
 from astromatic_wrapper import api
 from astromatic_wrapper.utils import ldac, pipeline
 
+# Keep the original _run_cmd method and Popen class since they are mocked below
+run_cmd = api.Astromatic._run_cmd
+Popen = subprocess.Popen
+
 def setup_module(module):
     module.data_path = os.path.join(os.path.relpath(__file__), 'data')
 
@@ -81,10 +85,60 @@ class TestAstromatic:
         kwargs['params'] = ['X_WORLD', 'Y_WORLD', 'MAG_AUTO']
         cmd_result = 'path/to/sex test.fits -CATALOG_NAME {0} '.format(
             sex_kwargs['config']['CATALOG_NAME'])
+        param_name = api.write_params_file(kwargs['params'], str(tmpdir))
         cmd_result += '-CATALOG_TYPE FITS_LDAC -PARAMETERS_NAME {0} -FILTER N'.format(
-            os.path.join(str(tmpdir), 'sex.param'))
+            param_name)
         assert sextractor.build_cmd('test.fits', **kwargs)[0]==cmd_result
     
+    def test_write_params_file(self, tmpdir):
+        param_name = api.write_params_file(['X_WORLD', 'Y_WORLD'], str(tmpdir))
+        assert open(param_name).read()=='X_WORLD\nY_WORLD\n'
+        # The same parameters use the same file, and different parameters a new file
+        mtime = os.stat(param_name).st_mtime
+        assert api.write_params_file(['X_WORLD', 'Y_WORLD'], str(tmpdir))==param_name
+        assert os.stat(param_name).st_mtime==mtime
+        new_name = api.write_params_file(['X_WORLD', 'Y_WORLD', 'MAG_AUTO'], str(tmpdir))
+        assert new_name!=param_name
+        assert open(new_name).read()=='X_WORLD\nY_WORLD\nMAG_AUTO\n'
+        assert sorted(os.listdir(str(tmpdir)))==sorted([os.path.basename(param_name),
+            os.path.basename(new_name)])
+    
+    def test_build_args(self, tmpdir):
+        sextractor = api.Astromatic('SExtractor', temp_path=str(tmpdir), config=OrderedDict([
+            ('CATALOG_NAME', 'my images/test.cat'),
+            ('PARAMETERS_NAME', 'default.param'),
+            ('DETECT_MINAREA', 5),
+        ]))
+        args, kwargs = sextractor.build_args('my images/test [1].fits', 
+            cmd='/path/to/sex -d')
+        assert args==['/path/to/sex', '-d', 'my images/test [1].fits', 
+            '-CATALOG_NAME', 'my images/test.cat', '-PARAMETERS_NAME', 'default.param',
+            '-DETECT_MINAREA', '5']
+        assert sextractor.build_cmd('test.fits')[0]==(
+            'sex test.fits -CATALOG_NAME my images/test.cat '
+            '-PARAMETERS_NAME default.param -DETECT_MINAREA 5')
+    
+    def test_launch(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(subprocess, 'Popen', Popen)
+        path = os.path.join(str(tmpdir), 'my files')
+        os.makedirs(path)
+        filename = os.path.join(path, 'test [1].txt')
+        cmd = [sys.executable, '-c', 
+            'import sys; f=open(sys.argv[1], "w"); f.write("test"); f.close()', filename]
+        p = api.launch(cmd)
+        assert p.wait()==0
+        assert open(filename).read()=='test'
+        # The executable can be given relative to the home directory or an
+        # environment variable
+        bin_path = os.path.join(str(tmpdir), 'bin')
+        os.makedirs(bin_path)
+        os.symlink(sys.executable, os.path.join(bin_path, 'python'))
+        monkeypatch.setenv('HOME', str(tmpdir))
+        monkeypatch.setenv('AW_TEST_BIN', bin_path)
+        for executable in ['~/bin/python', '$AW_TEST_BIN/python']:
+            p = api.launch([executable, '-c', 'import sys; sys.exit(3)'])
+            assert p.wait()==3
+    
     def test_run_frames(self, tmpdir):
         import subprocess
         import types
@@ -109,7 +163,7 @@ class TestAstromatic:
             #        '-FLAG_IMAGE test.dqmask.fits[2]',
             'args': (
                 'sex test.fits[2] -CATALOG_NAME test.fits[2] -PARAMETERS_NAME default.path '
-                    '-WEIGHT_IMAGE test.wtmap.fits[2] -FLAG_IMAGE test.dqmask.fits[2]',
+                    '-WEIGHT_IMAGE test.wtmap.fits[2] -FLAG_IMAGE test.dqmask.fits[2]'.split(),
                 False,
                 None,
                 True),
@@ -119,15 +173,96 @@ class TestAstromatic:
         }
         assert frame_result==result
     
+    def test_run_frames_parallel(self, tmpdir):
+        import time
+        import types
+        from astropy.table import Table
+        
+        def mock_frame_cmd(self, this_cmd, store_output=False, xml_name=None, 
+                raise_error=True, frame=None):
+            # Make the first frames finish last
+            time.sleep(.05*(4-int(frame)))
+            warnings = Table([[int(frame)], ['cmd']], names=('Frame', 'Cmd'))
+            return {'status': 'success', 'warnings': warnings}
+        
+        sex_kwargs = {
+            'code': 'SExtractor',
+            'temp_path': str(tmpdir),
+            'config': OrderedDict([
+                ('CATALOG_NAME', 'test.fits'),
+                ('PARAMETERS_NAME', 'default.path'),
+                ('WRITE_XML', 'Y'),
+                ('XML_NAME', 'test.xml')
+            ]),
+        }
+        sextractor = api.Astromatic(**sex_kwargs)
+        sextractor._run_cmd = types.MethodType(mock_frame_cmd, sextractor)
+        result = sextractor.run_frames('test.fits', frames=[1,2,3], max_workers=3)
+        assert result['status']=='success'
+        assert list(result['warnings']['frame'])==[1,2,3]
+        assert list(result['warnings']['Frame'])==[1,2,3]
+    
+    def test_build_template(self, tmpdir):
+        sextractor = api.Astromatic('SExtractor', config=OrderedDict([
+            ('PARAMETERS_NAME', 'default.param'),
+            ('CATALOG_NAME', 'test.cat'),
+            ('WRITE_XML', 'Y'),
+            ('XML_NAME', 'test.xml'),
+        ]))
+        template = sextractor.build_template(config_file='default.sex')
+        args, xml_name = template.get_args(['img1.fits', 'img2.fits'],
+            {'CATALOG_NAME': 'img.cat', 'FILTER': False})
+        assert args==['sex', 'img1.fits', 'img2.fits', '-c', 'default.sex',
+            '-PARAMETERS_NAME', 'default.param', '-CATALOG_NAME', 'img.cat',
+            '-WRITE_XML', 'Y', '-XML_NAME', 'test.xml', '-FILTER', 'N']
+        assert xml_name=='test.xml'
+        args, xml_name = template.get_args('img.fits', {'XML_NAME': 'img.xml'})
+        assert args==sextractor.build_args('img.fits', config_file='default.sex',
+            config=OrderedDict([
+                ('PARAMETERS_NAME', 'default.param'),
+                ('CATALOG_NAME', 'test.cat'),
+                ('WRITE_XML', 'Y'),
+                ('XML_NAME', 'img.xml'),
+            ]))[0]
+        assert xml_name=='img.xml'
+        # The template is not modified
+        assert template.get_args('img.fits')[1]=='test.xml'
+
+    def test_map(self):
+        from concurrent.futures import ThreadPoolExecutor
+        sextractor = api.Astromatic('SExtractor', config=OrderedDict([
+            ('PARAMETERS_NAME', 'default.param'),
+        ]))
+        images = ['img{0}.fits'.format(n) for n in range(10)]
+        config = [{'CATALOG_NAME': image.replace('.fits', '.cat')} for image in images]
+        results = dict(sextractor.map(images, config, max_workers=4))
+        assert sorted(results.keys())==list(range(10))
+        for idx, image in enumerate(images):
+            # _run_cmd is mocked to return its arguments
+            assert results[idx]['args']==(['sex', image, '-PARAMETERS_NAME', 'default.param',
+                '-CATALOG_NAME', config[idx]['CATALOG_NAME']], False, None, True)
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        future = sextractor.submit(executor, 'img.fits')
+        assert future.result()['args'][0]==['sex', 'img.fits',
+            '-PARAMETERS_NAME', 'default.param']
+        executor.shutdown()
+        with pytest.raises(api.AstromaticError):
+            list(sextractor.map(images, config[:2]))
+
     def test_version(self):
         import subprocess
         def mock_subprocess_popen(*args, **kwargs):
             class stdout:
                 def readlines(self):
                     return ['SExtractor version 2.19.5 (2015-04-30)\n']
+                def close(self):
+                    pass
             class popen:
                 def __init__(self):
                     self.stdout = stdout()
+                def wait(self):
+                    return 0
             return popen()
         subprocess.Popen = mock_subprocess_popen
         sextractor = api.Astromatic('SExtractor')
@@ -159,7 +294,7 @@ def test_run_sex(tmpdir):
     cmd += '-WRITE_XML Y -XML_NAME {0}/0.sex.log.xml'.format(paths['log'])
     cmd_result = {
         'args': (
-            cmd,
+            cmd.split(),
             False,
             '{0}/0.sex.log.xml'.format(paths['log']),
             True),
@@ -174,7 +309,7 @@ def test_run_sex(tmpdir):
     cmd += '-WRITE_XML Y -XML_NAME {0}/0.sex.log-1.xml'.format(paths['log'])
     cmd_result = {
         'args': (
-            cmd,
+            cmd.split(),
             False,
             '{0}/0.sex.log.xml'.format(paths['log']),
             False),
@@ -197,7 +332,7 @@ def test_run_scamp(tmpdir):
     cmd += '-WRITE_XML Y -XML_NAME {0}/0.scamp.log.xml'.format(paths['log'])
     cmd_result = {
         'args': (
-            cmd,
+            cmd.split(),
             False,
             '{0}/0.scamp.log.xml'.format(paths['log']),
             True),
@@ -219,7 +354,7 @@ def test_run_swarp(tmpdir):
     cmd += '-WRITE_XML Y -XML_NAME {0}/0.swarp.log.xml'.format(paths['log'])
     cmd_result = {
         'args': (
-            cmd,
+            cmd.split(),
             False,
             '{0}/0.swarp.log.xml'.format(paths['log']),
             True),
@@ -233,7 +368,7 @@ def test_run_swarp(tmpdir):
     cmd += '-WRITE_XML Y -XML_NAME {0}/0.swarp.log-1.xml'.format(paths['log'])
     cmd_result = {
         'args': (
-            cmd,
+            cmd.split(),
             False,
             '{0}/0.swarp.log.xml'.format(paths['log']),
             False),
@@ -256,11 +391,170 @@ def test_run_psfex(tmpdir):
     cmd += '-WRITE_XML Y -XML_NAME {0}/0.psfex.log.xml'.format(paths['log'])
     cmd_result = {
         'args': (
-            cmd,
+            cmd.split(),
             False,
             '{0}/0.psfex.log.xml'.format(paths['log']),
             True),
         'kwargs': {},
         'status': 'error'
     }
-    assert result==cmd_result
\ No newline at end of file
+    assert result==cmd_result
+
+def test_get_resources():
+    from astromatic_wrapper.utils.resources import get_cpu_count
+    resources = api.run_swarp.get_resources({'api_kwargs': {
+        'config': {'NTHREADS': 4, 'MEM_MAX': 1024}}, 'frames': [1,2,3], 'frame_workers': 2})
+    assert resources=={'cpus': 8, 'memory': 2*(1024+256)}
+    assert api.run_sex.get_resources({'files': {}})=={'cpus': 1, 'memory': 0}
+    assert api.run_scamp.get_resources({})=={'cpus': get_cpu_count(), 'memory': 0}
+    pipe = pipeline.Pipeline()
+    pipe.add_step(api.run_swarp, api_kwargs={'config': {'NTHREADS': 2, 'MEM_MAX': '512'}})
+    pipe.add_step(api.run_swarp, api_kwargs={}, resources={'cpus': 1})
+    assert pipe._get_step_resources(pipe.steps[0])=={'cpus': 2, 'memory': 768}
+    assert pipe._get_step_resources(pipe.steps[1])=={'cpus': 1}
+
+def test_nthreads(tmpdir):
+    assert api.get_nthreads(4, cpus=16)==4
+    assert api.get_nthreads(3, cpus=16)==5
+    assert api.get_nthreads(32, cpus=16)==1
+    paths = {
+        'temp': os.path.join(str(tmpdir), 'temp'),
+        'log': os.path.join(str(tmpdir), 'log')
+    }
+    pipe = pipeline.Pipeline(paths=paths, build_paths = {}, create_paths=True)
+    # The config is only changed if more than one code runs at the same time
+    result = api.run_swarp(pipe, 0, ['img.fits'], {})
+    assert '-NTHREADS' not in result['args'][0]
+    pipe.run_workers = 2
+    result = api.run_swarp(pipe, 0, ['img.fits'], {}, frames=[1,2,3], frame_workers=2)
+    nthreads = api.get_nthreads(4)
+    assert result['args'][0][-2:]==['-NTHREADS', str(nthreads)]
+    assert api.run_swarp.get_resources({'api_kwargs': {}, 'frames': [1,2,3], 
+        'frame_workers': 2}, workers=2)=={'cpus': 2*nthreads, 'memory': 1024}
+    # Users can set NTHREADS
+    result = api.run_scamp(pipe, 0, ['cat.fits'], {'config': {'NTHREADS': 3}})
+    assert result['args'][0][result['args'][0].index('-NTHREADS')+1]=='3'
+    # Steps use the CPUs reserved for them by the pipeline
+    worker_pipe = pipe.get_worker_copy(cpus=4)
+    result = api.run_swarp(worker_pipe, 0, ['img.fits'], {}, frames=[1,2,3], frame_workers=2)
+    assert result['args'][0][-2:]==['-NTHREADS', '2']
+    pipe.run_workers = 1
+    result = api.run_scamp(pipe.get_worker_copy(cpus=2), 0, ['cat.fits'], {})
+    assert result['args'][0][-2:]==['-NTHREADS', '2']
+    pipe.add_step(api.run_scamp, catalogs=['cat.fits'], resources={'cpus': 3})
+    # The mock run returns an error status
+    pipe.run(workers=2, resources={'cpus': 8}, ignore_errors=True)
+    args = pipe.steps[0].results['args'][0]
+    assert args[-2:]==['-NTHREADS', '3']
+
+def test_calibrate_threads():
+    import types
+    calls = []
+    def mock_frames(self, filenames, frames=[1], max_workers=None, **kwargs):
+        calls.append((max_workers, kwargs['config']['NTHREADS']))
+        return {'status': 'success'}
+    sextractor = api.Astromatic('SExtractor', config={'PARAMETERS_NAME': 'default.param'})
+    sextractor.run_frames = types.MethodType(mock_frames, sextractor)
+    best, timings = api.calibrate_threads(sextractor, 'img.fits', list(range(1,11)), cpus=16)
+    assert calls==[(1,16), (2,8), (4,4), (8,2), (10,1)]
+    assert sorted(timings['frame_workers'])==[1,2,4,8,10]
+    assert best['frame_workers']==timings['frame_workers'][0]
+    assert best['nthreads']==api.get_nthreads(best['frame_workers'], 16)
+    assert 'NTHREADS' not in sextractor.config
+
+def test_store_output(tmpdir, monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', Popen)
+    output_log = os.path.join(str(tmpdir), 'test.log')
+    sextractor = api.Astromatic('SExtractor', store_output=True, output_log=output_log,
+        max_output_lines=10)
+    script = 'for n in range(1000): print("line {0}".format(n))\n'
+    script += 'print("ERROR: test")\nprint("done")'
+    result = run_cmd(sextractor, [sys.executable, '-c', script], True, raise_error=False)
+    assert result['status']=='error'
+    assert result['error_msg']=='ERROR: test\n'
+    assert len(result['output'])==10
+    assert result['output'][-1]=='done\n'
+    assert len(open(output_log).readlines())==1002
+    
+    result = run_cmd(sextractor, [sys.executable, '-c', 'print("test")'], True, frame='2')
+    usage = result.pop('usage')
+    assert usage['wall_time']>0
+    assert result=={'status': 'success', 'output': ['test\n']}
+    assert open(os.path.join(str(tmpdir), 'test-2.log')).read()=='test\n'
+
+def test_store_output_error(tmpdir, monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', Popen)
+    processes = []
+    launch = api.launch
+    def mock_launch(cmd, **kwargs):
+        processes.append(launch(cmd, **kwargs))
+        return processes[-1]
+    def mock_read_output(stream, output_log=None, max_lines=None):
+        stream.readline()
+        raise IOError('Unable to write log')
+    monkeypatch.setattr(api, 'launch', mock_launch)
+    monkeypatch.setattr(api, 'read_output', mock_read_output)
+    sextractor = api.Astromatic('SExtractor', store_output=True,
+        output_log=os.path.join(str(tmpdir), 'test.log'))
+    script = 'for n in range(100000): print("line {0}".format(n))'
+    with pytest.raises(IOError):
+        run_cmd(sextractor, [sys.executable, '-c', script], True)
+    # The pipe is closed and the process is reaped
+    assert processes[0].stdout.closed
+    assert processes[0].returncode is not None
+
+def test_usage(tmpdir, monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', Popen)
+    filename = os.path.join(str(tmpdir), 'test.bin')
+    sextractor = api.Astromatic('SExtractor')
+    script = 'import sys; x = bytearray(50*1024*1024); f=open(sys.argv[1], "wb")\n'
+    script += 'f.write(bytes(x[:1000000])); f.close()'
+    result = run_cmd(sextractor, [sys.executable, '-c', script, filename])
+    usage = result['usage']
+    assert usage['wall_time']>0
+    if hasattr(os, 'wait4'):
+        assert usage['user_time']+usage['sys_time']>0
+        assert usage['max_rss']>=50
+    if sys.platform.startswith('linux'):
+        assert usage['write_chars']>=1000000
+    
+    # Exit codes are still returned
+    result = run_cmd(sextractor, [sys.executable, '-c', 'import sys; sys.exit(3)'],
+        raise_error=False)
+    assert result['status']=='error'
+    
+    combined = api.combine_usage([{'user_time': 1, 'max_rss': 10},
+        {'user_time': 2, 'max_rss': 5, 'read_bytes': 3}])
+    assert combined=={'user_time': 3, 'max_rss': 10, 'read_bytes': 3}
+
+def test_mock_codes(tmpdir, monkeypatch):
+    from astromatic_wrapper.utils import mock_codes
+    monkeypatch.setattr(subprocess, 'Popen', Popen)
+    monkeypatch.setattr(api.Astromatic, '_run_cmd', run_cmd)
+    paths = {
+        'temp': os.path.join(str(tmpdir), 'temp'),
+        'log': os.path.join(str(tmpdir), 'log')
+    }
+    scripts = mock_codes.write_mock_codes(os.path.join(str(tmpdir), 'bin'), rows=20,
+        memory=20)
+    pipe = pipeline.Pipeline(paths=paths, build_paths=scripts, create_paths=True)
+    image = os.path.join(str(tmpdir), 'img.fits')
+    catalog = os.path.join(str(tmpdir), 'img.cat')
+    config = OrderedDict([('PARAMETERS_NAME', 'default.param')])
+    pipe.add_step(api.run_sex, files={'image': image}, api_kwargs={'config': config})
+    pipe.add_step(api.run_scamp, catalogs=[catalog])
+    pipe.add_step(api.run_psfex, catalogs=catalog)
+    pipe.run()
+    assert len(ldac.get_table_from_ldac(catalog))==20
+    assert os.path.isfile(os.path.join(str(tmpdir), 'img.head'))
+    assert os.path.isfile(os.path.join(paths['temp'], 'img.psf'))
+    warnings = pipe.get_result_table('warnings')
+    assert list(warnings['Msg'])==['mock warning 1 for '+image,
+        'mock warning 1 for '+catalog, 'mock warning 1 for '+catalog]
+    assert pipe.get_metrics_table()['max_rss'][0]>=20
+    
+    # Failed frames return the error message from the XML log
+    monkeypatch.setenv('MOCK_ASTROMATIC_FAIL', '[2]')
+    result = api.run_sex(pipe, 'frames', {'image': image}, {'config': config}, [1,2])
+    assert result['status']=='error'
+    assert result['error_msg']=='*Error*: mock failure for {0}[2]'.format(image)
@@ -0,0 +1,108 @@
+import sys
+import os
+import subprocess
+from collections import OrderedDict
+from astropy.tests.helper import pytest
+
+from astromatic_wrapper import api
+
+pytestmark = pytest.mark.skipif('sys.version_info < (3,5)')
+
+# subprocess.Popen is mocked in test_api
+Popen = subprocess.Popen
+
+# Mock astromatic code that writes a warning for the first input file to the XML log,
+# and fails when it is run on frame 3
+mock_code = '''import sys
+import time
+xml_name = sys.argv[sys.argv.index('-XML_NAME')+1]
+time.sleep(.1)
+f = open(xml_name, 'w')
+f.write('<VOTABLE><RESOURCE><TABLE ID="Warnings"><FIELD name="Msg" datatype="char"/>'
+    '<DATA><TABLEDATA><TR><TD>'+sys.argv[1]+'</TD></TR></TABLEDATA></DATA></TABLE>'
+    '<PARAM name="Error_Msg" value="failed"/></RESOURCE></VOTABLE>')
+f.close()
+print('processed '+sys.argv[1])
+if '[3]' in sys.argv[1]:
+    sys.exit(1)
+'''
+
+def run(coroutine):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    # On Python<3.8 the child watcher is only attached to the current event loop
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def get_sextractor(tmpdir, monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', Popen)
+    script = os.path.join(str(tmpdir), 'mock_sex.py')
+    f = open(script, 'w')
+    f.write(mock_code)
+    f.close()
+    return api.Astromatic('SExtractor', cmd='{0} {1}'.format(sys.executable, script),
+        store_output=True, config=OrderedDict([
+            ('PARAMETERS_NAME', 'default.param'),
+            ('WRITE_XML', 'Y'),
+            ('XML_NAME', os.path.join(str(tmpdir), 'test.xml'))
+        ]))
+
+def test_run_async(tmpdir, monkeypatch):
+    sextractor = get_sextractor(tmpdir, monkeypatch)
+    result = run(sextractor.run_async('test.fits'))
+    assert result['status']=='success'
+    assert result['output']==['processed test.fits\n']
+    assert list(result['warnings']['Msg'])==['test.fits']
+
+    result = run(sextractor.run_async('test.fits[3]', store_output=False, raise_error=False))
+    assert result['status']=='error'
+    assert result['error_msg']=='failed'
+    with pytest.raises(api.AstromaticError):
+        run(sextractor.run_async('test.fits[3]', store_output=False))
+
+def test_run_frames_async(tmpdir, monkeypatch):
+    sextractor = get_sextractor(tmpdir, monkeypatch)
+    result = run(sextractor.run_frames_async('test.fits', frames=[1,2], max_workers=2))
+    assert result['status']=='success'
+    assert list(result['warnings']['frame'])==[1,2]
+    assert list(result['warnings']['Msg'])==['test.fits[1]', 'test.fits[2]']
+
+    sextractor.store_output = False
+    with pytest.raises(api.AstromaticError):
+        run(sextractor.run_frames_async('test.fits', frames=[1,2,3], max_workers=3))
+
+def test_run_async_expands_cmd(tmpdir, monkeypatch):
+    # The executable is expanded in the same way as `api.launch`
+    bin_path = os.path.join(str(tmpdir), 'bin')
+    os.makedirs(bin_path)
+    os.symlink(sys.executable, os.path.join(bin_path, 'python'))
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.setenv('AW_TEST_BIN', bin_path)
+    for executable in ['~/bin/python', '$AW_TEST_BIN/python']:
+        sextractor = get_sextractor(tmpdir, monkeypatch)
+        sextractor.cmd = sextractor.cmd.replace(sys.executable, executable)
+        result = run(sextractor.run_async('test.fits'))
+        assert result['output']==['processed test.fits\n']
+
+def test_run_async_output_error(tmpdir, monkeypatch):
+    import asyncio
+    from astromatic_wrapper import async_api
+    monkeypatch.setattr(subprocess, 'Popen', Popen)
+    processes = []
+    launch = async_api.launch
+    def mock_launch(cmd, **kwargs):
+        processes.append(asyncio.ensure_future(launch(cmd, **kwargs)))
+        return processes[-1]
+    monkeypatch.setattr(async_api, 'launch', mock_launch)
+    # The output log can't be opened
+    sextractor = api.Astromatic('SExtractor', store_output=True,
+        output_log=os.path.join(str(tmpdir), 'missing', 'test.log'))
+    script = 'import time; print("test"); time.sleep(60)'
+    with pytest.raises(IOError):
+        run(async_api.run_cmd(sextractor, [sys.executable, '-c', script], True))
+    # The process is killed and reaped
+    assert processes[0].result().returncode is not None
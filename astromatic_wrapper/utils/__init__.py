@@ -3,5 +3,12 @@
 # This sub-module is destined for common non-package specific utility
 # functions that will ultimately be merged into `astropy.utils`
 
+import astromatic_wrapper.utils.cache
+import astromatic_wrapper.utils.job_array
+import astromatic_wrapper.utils.journal
 import astromatic_wrapper.utils.ldac
-import astromatic_wrapper.utils.pipeline
\ No newline at end of file
+import astromatic_wrapper.utils.pipeline
+import astromatic_wrapper.utils.resources
+import astromatic_wrapper.utils.trace
+import astromatic_wrapper.utils.work_queue
+import astromatic_wrapper.utils.xmllog
\ No newline at end of file
@@ -0,0 +1,229 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Cache of pipeline step results, used to skip steps whose inputs have not changed
+since they were last run
+"""
+import os
+import hashlib
+import logging
+import numbers
+import numpy as np
+
+logger = logging.getLogger('astromatic.cache')
+
+class CacheKeyError(Exception):
+    """
+    Raised when a step has a kwarg that can't be used to build a cache key
+    """
+    pass
+
+def normalize(value):
+    """
+    Convert a (possibly nested) set of kwargs into a representation that does not
+    depend on the order of dictionary keys, so that it can be hashed. Numpy arrays
+    are represented by their dtype, shape and a hash of their data.
+
+    Parameters
+    ----------
+    value: object
+        Value to normalize
+
+    Returns
+    -------
+    normalized: str or tuple
+        Normalized representation of ``value``
+
+    Raises
+    ------
+    CacheKeyError
+        If ``value`` contains an object whose representation might not identify
+        its value (for example objects whose ``repr`` contains their memory address)
+    """
+    if isinstance(value, dict):
+        return tuple(sorted([(str(k), normalize(v)) for k, v in value.items()]))
+    elif isinstance(value, (list, tuple, type(range(0)))):
+        return tuple([normalize(v) for v in value])
+    elif isinstance(value, (set, frozenset)):
+        return tuple(sorted([normalize(v) for v in value]))
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return ('ndarray', str(value.dtype), value.shape, normalize(value.tolist()))
+        data_hash = hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return ('ndarray', str(value.dtype), value.shape, data_hash)
+    from astropy.extern.six import string_types
+    if value is None or isinstance(value, string_types+(bytes, numbers.Number, np.generic)):
+        return repr(value)
+    raise CacheKeyError("Unable to build a cache key for an object of type '{0}'".format(
+        type(value).__name__))
+
+def get_fingerprint(filename, hash_files=False):
+    """
+    Get a fingerprint of a file, used to check whether or not the file has changed.
+
+    Parameters
+    ----------
+    filename: str
+        Name of the file
+    hash_files: bool (optional)
+        If ``hash_files==True`` the fingerprint is a hash of the file contents,
+        otherwise (the default) the fingerprint is the size and modification time
+        of the file.
+
+    Returns
+    -------
+    fingerprint: tuple or str
+        Fingerprint of the file or ``None`` if the file does not exist
+    """
+    if not os.path.isfile(filename):
+        return None
+    if hash_files:
+        file_hash = hashlib.sha1()
+        f = open(filename, 'rb')
+        chunk = f.read(1<<20)
+        while len(chunk)>0:
+            file_hash.update(chunk)
+            chunk = f.read(1<<20)
+        f.close()
+        return file_hash.hexdigest()
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime)
+
+class StepCache(object):
+    """
+    Cache of the results of pipeline steps. Each result is saved in ``path`` using a
+    key built from the function run in the step, the step kwargs (including the
+    ``step_id`` if the function uses it) and a fingerprint of each of the step's
+    ``input_files``. A cached result is only used if all of the step's
+    ``output_files`` are unchanged since the result was saved.
+    """
+    def __init__(self, path, hash_files=False):
+        """
+        Parameters
+        ----------
+        path: str
+            Directory used to store the cached results
+        hash_files: bool (optional)
+            If ``hash_files==True`` files are compared using a hash of their contents,
+            otherwise (the default) files are compared using their size and
+            modification time.
+        """
+        self.path = path
+        self.hash_files = hash_files
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def get_key(self, step):
+        """
+        Get the key used to store the result of a step
+
+        Parameters
+        ----------
+        step: `astromatic_wrapper.utils.pipeline.PipelineStep`
+            Step to get the key for
+
+        Returns
+        -------
+        key: str
+            Key for the step
+
+        Raises
+        ------
+        CacheKeyError
+            If one of the step kwargs can't be used to build a key (see `normalize`)
+        """
+        func = step.func
+        func_name = '{0}.{1}'.format(getattr(func, '__module__', ''),
+            getattr(func, '__name__', repr(func)))
+        input_files = getattr(step, 'input_files', [])
+        fingerprints = [(filename, get_fingerprint(filename, self.hash_files))
+            for filename in input_files]
+        # Functions that take a ``step_id`` use it to name their output (for example
+        # their XML logs), so steps with the same kwargs have different keys
+        if getattr(step, 'compiled_func', None) is not func:
+            step.compile()
+        key = repr((func_name, normalize(step.func_kwargs),
+            normalize(step.kwargs_template), fingerprints))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _get_filename(self, key):
+        return os.path.join(self.path, '{0}.p'.format(key))
+
+    def load(self, key):
+        """
+        Load a cached result
+
+        Parameters
+        ----------
+        key: str
+            Key of the step (see `StepCache.get_key`)
+
+        Returns
+        -------
+        result: dict
+            The cached result, or ``None`` if the result has not been cached or
+            one of the output files has changed since it was cached
+        """
+        import pickle
+        filename = self._get_filename(key)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            f = open(filename, 'rb')
+            entry = pickle.load(f)
+            f.close()
+        except Exception:
+            logger.warning("Unable to load cached result '{0}'".format(filename))
+            return None
+        for output_file, fingerprint in entry['outputs'].items():
+            # Output files that were missing when the result was saved are never
+            # treated as unchanged
+            if (fingerprint is None or
+                    get_fingerprint(output_file, self.hash_files)!=fingerprint):
+                logger.info("'{0}' changed, cached result will not be used".format(
+                    output_file))
+                return None
+        return entry['result']
+
+    def save(self, key, step, result):
+        """
+        Save the result of a step. The file is written to a temporary file and moved
+        into place so that a partially written result is never loaded. Results of
+        steps that did not create all of their ``output_files`` are not cached. If the
+        result can't be saved (for example if it can't be pickled) a warning is logged
+        and the result is not cached.
+
+        Parameters
+        ----------
+        key: str
+            Key of the step (see `StepCache.get_key`)
+        step: `astromatic_wrapper.utils.pipeline.PipelineStep`
+            Step that created the result
+        result: dict
+            Result of the step
+        """
+        import pickle
+        import tempfile
+        entry = {
+            'result': result,
+            'outputs': dict([(filename, get_fingerprint(filename, self.hash_files))
+                for filename in getattr(step, 'output_files', [])])
+        }
+        for filename, fingerprint in entry['outputs'].items():
+            if fingerprint is None:
+                logger.info("'{0}' was not created, result will not be cached".format(
+                    filename))
+                return
+        fd, temp_name = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(entry, f, protocol=2)
+            finally:
+                f.close()
+            os.rename(temp_name, self._get_filename(key))
+        except Exception:
+            # The pipeline can still run if the result can't be cached
+            os.remove(temp_name)
+            logger.warning("Unable to cache the result of step {0}".format(
+                getattr(step, 'step_id', key)), exc_info=True)
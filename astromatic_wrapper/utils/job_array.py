@@ -0,0 +1,212 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Run the steps of a pipeline as a job array on a batch cluster (for example using
+SLURM, PBS or SGE) without depending on the scheduler itself.
+
+`Pipeline.export_job_array` saves the steps of a pipeline in chunk files, each of
+which contains everything needed to run its steps. Each array task runs one chunk
+using the ``astromatic-job-array run`` command (see `run_chunk`), which saves the
+result of each step to a journal for the chunk. Once all of the tasks have finished
+the chunk journals are merged back into the pipeline using
+`Pipeline.merge_job_array` or ``astromatic-job-array merge``.
+"""
+import os
+import logging
+import warnings
+
+logger = logging.getLogger('astromatic.job_array')
+
+def get_manifest_name(path):
+    return os.path.join(path, 'manifest.json')
+
+def get_pipeline_name(path):
+    return os.path.join(path, 'pipeline.p')
+
+def get_chunk_name(path, index):
+    return os.path.join(path, 'chunk-{0:05d}.p'.format(index))
+
+def get_journal_name(path, index):
+    return os.path.join(path, 'chunk-{0:05d}.journal'.format(index))
+
+def write_manifest(path, manifest):
+    import json
+    f = open(get_manifest_name(path), 'w')
+    try:
+        json.dump(manifest, f, indent=2)
+    finally:
+        f.close()
+
+def read_manifest(path):
+    """
+    Read the manifest of an exported job array
+
+    Parameters
+    ----------
+    path: str
+        Directory of the job array
+
+    Returns
+    -------
+    manifest: dict
+        ``run_id`` of the job array, number of ``steps`` and ``chunks`` and
+        the ``stages`` of the job array. Each stage is a list with the index of the
+        first and last chunk in the stage, and a stage can only be run once all of
+        the chunks in the previous stages have finished.
+    """
+    import json
+    f = open(get_manifest_name(path))
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def save_object(filename, obj):
+    from astromatic_wrapper.utils.journal import get_serializer
+    f = open(filename, 'wb')
+    try:
+        get_serializer().dump(obj, f, protocol=2)
+    finally:
+        f.close()
+
+def load_object(filename):
+    from astromatic_wrapper.utils.journal import get_serializer
+    f = open(filename, 'rb')
+    try:
+        return get_serializer().load(f)
+    finally:
+        f.close()
+
+def run_chunk(path, index):
+    """
+    Run all of the steps in a chunk of an exported job array, saving the result of
+    each step in the chunk journal. If the chunk was already (partially) run, only
+    the steps that didn't finish (or raised an exception) are run.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the job array
+    index: int
+        Index of the chunk (starting at 0)
+
+    Returns
+    -------
+    success: bool
+        ``False`` if a step raised an exception, or returned an error that isn't
+        ignored by the step, otherwise ``True``
+    """
+    import traceback
+    from astromatic_wrapper.utils.journal import RunJournal
+    from astromatic_wrapper.utils.pipeline import execute_timed_step
+    chunk = load_object(get_chunk_name(path, index))
+    journal = RunJournal(get_journal_name(path, index), chunk['run_id'])
+    finished = set([record['step_id'] for record in journal.read()
+        if 'exception' not in record])
+    if len(finished)==0:
+        journal.start()
+    success = True
+    for task in chunk['tasks']:
+        if task['step_id'] in finished:
+            logger.info('skipping finished step {0}'.format(task['step_id']))
+            continue
+        logger.info('running step {0}'.format(task['step_id']))
+        record = {
+            'step_id': task['step_id'],
+            'run_step_idx': task['run_step_idx']
+        }
+        try:
+            record['results'], record['timing'] = execute_timed_step(task['func'],
+                task['func_kwargs'], task['catch_exceptions'], task['step_id'],
+                task['run_step_idx'])
+        except Exception:
+            record['exception'] = traceback.format_exc()
+            logger.error('Exception in step {0}:\n{1}'.format(
+                task['step_id'], record['exception']))
+            success = False
+        else:
+            result = record['results']
+            if (not task['ignore_errors'] and isinstance(result, dict) and
+                    str(result.get('status')).lower()=='error'):
+                logger.error('Error returned in step {0}'.format(task['step_id']))
+                success = False
+        journal.append(record)
+    return success
+
+def merge_chunks(path):
+    """
+    Read the records saved in the journals of every chunk in a job array
+
+    Parameters
+    ----------
+    path: str
+        Directory of the job array
+
+    Returns
+    -------
+    records: list
+        Records of all of the steps that were run, sorted by their index in
+        ``Pipeline.run_steps``. If a step was run more than once (because the chunk
+        was run again after the step raised an exception) only its last record is
+        returned.
+    """
+    from astromatic_wrapper.utils.journal import RunJournal
+    manifest = read_manifest(path)
+    records = {}
+    for index in range(manifest['chunks']):
+        journal = RunJournal(get_journal_name(path, index), manifest['run_id'])
+        chunk_records = list(journal.read())
+        if len(chunk_records)==0:
+            warnings.warn('No results found for chunk {0}'.format(index))
+        for record in chunk_records:
+            records[record['step_id']] = record
+    return sorted(records.values(), key=lambda record: record['run_step_idx'])
+
+def main(argv=None):
+    """
+    Entry point of the ``astromatic-job-array`` command, used to run one chunk of
+    an exported job array (for example
+    ``astromatic-job-array run /scratch/survey/jobs $SLURM_ARRAY_TASK_ID``) or to
+    merge the results of all of the chunks back into the exported pipeline
+    (``astromatic-job-array merge /scratch/survey/jobs``).
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run or merge the chunks of a pipeline exported as a job array')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Run the steps in one chunk')
+    run_parser.add_argument('path', help='Directory of the job array')
+    run_parser.add_argument('index', type=int, help='Index of the chunk to run')
+    run_parser.add_argument('--offset', type=int, default=0,
+        help='Value subtracted from the index (for example 1 for schedulers whose '
+            'array task ids start at 1)')
+    merge_parser = subparsers.add_parser('merge',
+        help='Merge the results of every chunk into the exported pipeline')
+    merge_parser.add_argument('path', help='Directory of the job array')
+    merge_parser.add_argument('--ignore-errors', action='store_true',
+        help="Don't stop at steps that returned an error")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    if args.command=='run':
+        if run_chunk(args.path, args.index-args.offset):
+            return 0
+        return 1
+    elif args.command=='merge':
+        pipeline = load_object(get_pipeline_name(args.path))
+        ignore_errors = None
+        if args.ignore_errors:
+            ignore_errors = True
+        try:
+            pipeline.merge_job_array(args.path, ignore_errors)
+        finally:
+            save_object(get_pipeline_name(args.path), pipeline)
+        logger.info('Merged {0} of {1} steps into {2}'.format(len(pipeline.run_completed),
+            len(pipeline.run_steps), get_pipeline_name(args.path)))
+        return 0
+    parser.print_usage()
+    return 2
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Append-only journal used to record the results of each step in a pipeline run
+"""
+import os
+import warnings
+
+def get_serializer():
+    """
+    Get the module used to serialize journal records. ``dill`` is used if it is
+    installed, otherwise ``pickle`` is used.
+    """
+    try:
+        import dill as serializer
+    except ImportError:
+        import pickle as serializer
+    return serializer
+
+class RunJournal(object):
+    """
+    An append-only file of records. The first record in the file is a header
+    that identifies the run that the journal belongs to, and each subsequent record
+    is appended to the end of the file so the cost of saving a record does not
+    depend on how many records were saved before it.
+
+    Records are pickled (using ``dill`` if it is installed) since step results
+    commonly contain astropy Tables.
+    """
+    def __init__(self, filename, run_id=None):
+        """
+        Parameters
+        ----------
+        filename: str
+            Name of the journal file
+        run_id: str (optional)
+            Unique identifier for the run. If ``run_id`` is ``None`` a new
+            identifier is created.
+        """
+        if run_id is None:
+            import uuid
+            run_id = uuid.uuid4().hex
+        self.filename = filename
+        self.run_id = run_id
+
+    def start(self):
+        """
+        Create a new (empty) journal, overwriting any previous journal with the
+        same filename
+        """
+        serializer = get_serializer()
+        f = open(self.filename, 'wb')
+        serializer.dump({'run_id': self.run_id}, f, protocol=2)
+        f.close()
+
+    def append(self, record):
+        """
+        Add a record to the end of the journal. The record is serialized before
+        the journal is opened, so a record that can't be serialized is skipped
+        with a warning and never leaves a partial record in the journal.
+
+        Parameters
+        ----------
+        record: dict
+            Record to save
+        """
+        serializer = get_serializer()
+        try:
+            data = serializer.dumps(record, protocol=2)
+        except Exception:
+            warnings.warn("Unable to dump record, it will not be saved in '{0}'".format(
+                self.filename))
+            return
+        f = open(self.filename, 'ab')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def read(self):
+        """
+        Iterate over the records in the journal. If the journal belongs to a
+        different run (or doesn't exist) no records are returned. If the last record
+        was only partially written (for example if the process was killed) it is
+        skipped with a warning.
+
+        Returns
+        -------
+        records: generator
+            Each record saved in the journal, in the order they were appended
+        """
+        if not os.path.isfile(self.filename):
+            return
+        serializer = get_serializer()
+        f = open(self.filename, 'rb')
+        try:
+            try:
+                header = serializer.load(f)
+            except EOFError:
+                return
+            if not isinstance(header, dict) or header.get('run_id')!=self.run_id:
+                warnings.warn("'{0}' does not belong to run {1}".format(
+                    self.filename, self.run_id))
+                return
+            while True:
+                try:
+                    record = serializer.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    warnings.warn("Incomplete record found at the end of '{0}'".format(
+                        self.filename))
+                    break
+                yield record
+        finally:
+            f.close()
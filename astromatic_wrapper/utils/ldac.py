@@ -39,21 +39,26 @@ def convert_table_to_ldac(tbl):
     
     Parameters
     ----------
-    tbl: `astropy.table.Table`
-        Table to convert to ldac format
+    tbl: `astropy.table.Table` or `numpy.ndarray`
+        Table (or numpy structured array) to convert to ldac format
     Returns
     -------
     hdulist: `astropy.io.fits.HDUList`
         FITS_LDAC hdulist that can be read by astromatic software
     """
     from astropy.io import fits
-    import tempfile
-    f = tempfile.NamedTemporaryFile(suffix='.fits', mode='rb+')
-    tbl.write(f, format='fits')
-    f.seek(0)
-    hdulist = fits.open(f, mode='update')
-    tbl1, tbl2 = convert_hdu_to_ldac(hdulist[1])
-    new_hdulist = [hdulist[0], tbl1, tbl2]
+    import numpy as np
+    if isinstance(tbl, np.ndarray):
+        hdu = fits.BinTableHDU(tbl)
+    else:
+        # Build the table HDU in memory (astropy<1.3 does not have table_to_hdu)
+        try:
+            from astropy.io.fits import table_to_hdu
+            hdu = table_to_hdu(tbl)
+        except ImportError:
+            hdu = fits.BinTableHDU(tbl.as_array())
+    tbl1, tbl2 = convert_hdu_to_ldac(hdu)
+    new_hdulist = [fits.PrimaryHDU(), tbl1, tbl2]
     new_hdulist = fits.HDUList(new_hdulist)
     return new_hdulist
 
@@ -90,4 +95,168 @@ def get_table_from_ldac(filename, frame=1):
     if frame>0:
         frame = frame*2
     tbl = Table.read(filename, hdu=frame)
-    return tbl
\ No newline at end of file
+    return tbl
+
+def _count_rows(n_rows, rows):
+    """
+    Number of rows selected from a table with ``n_rows`` rows
+    """
+    import numpy as np
+    if isinstance(rows, slice):
+        return len(range(*rows.indices(n_rows)))
+    rows = np.asarray(rows)
+    if rows.dtype==bool:
+        return int(np.count_nonzero(rows))
+    return len(rows)
+
+def _read_ldac_hdus(filename, frames, columns, rows, frame_column=None, max_workers=None):
+    """
+    Load the selected columns and rows from a set of frames in a fits_ldac file into a
+    single table. The output columns are allocated once (using the number of rows
+    selected from each frame) and each frame is copied directly into its
+    part of the table.
+    """
+    from astropy.io import fits
+    from astropy.table import Table
+    import numpy as np
+    if rows is None:
+        rows = slice(None)
+    hdulist = fits.open(filename, memmap=True)
+    hdus = []
+    data = []
+    try:
+        hdus = [hdulist[frame*2] for frame in frames]
+        # Get the column names and units from the header, since astropy keeps a
+        # reference to the data in ``hdu.columns``
+        header = hdus[0].header
+        names = [header['TTYPE{0}'.format(n+1)] for n in range(header['TFIELDS'])]
+        units = dict([(names[n], header.get('TUNIT{0}'.format(n+1))) 
+            for n in range(len(names))])
+        if columns is None:
+            columns = names
+        # Load the (memory mapped) data for each frame before any threads are started
+        data.extend([hdu.data for hdu in hdus])
+        counts = [_count_rows(hdu.header['NAXIS2'], rows) for hdu in hdus]
+        offsets = np.cumsum([0]+counts)
+        all_columns = []
+        for name in columns:
+            field = data[0].field(name)
+            dtype = field.dtype.newbyteorder('=')
+            all_columns.append(np.empty((offsets[-1],)+field.shape[1:], dtype=dtype))
+        
+        def copy_frame(n):
+            for name, values in zip(columns, all_columns):
+                values[offsets[n]:offsets[n+1]] = data[n].field(name)[rows]
+        
+        if max_workers is None or max_workers<=1 or len(frames)<=1:
+            for n in range(len(frames)):
+                copy_frame(n)
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                list(executor.map(copy_frame, range(len(frames))))
+            finally:
+                executor.shutdown(wait=True)
+    finally:
+        # Remove the references to the memory mapped data, otherwise astropy copies
+        # the entire table into memory when the file is closed
+        del data[:]
+        for hdu in hdus:
+            del hdu.data
+        hdulist.close()
+    
+    tbl = Table()
+    for name, values in zip(columns, all_columns):
+        tbl[name] = values
+        if units[name]:
+            tbl[name].unit = units[name]
+    if frame_column is not None:
+        tbl[frame_column] = np.repeat(np.array(frames, dtype=int), counts)
+    return tbl
+
+def read_ldac(filename, frames=1, columns=None, rows=None):
+    """
+    Load a subset of the columns and rows of a fits_ldac file. The file is memory
+    mapped and only the requested columns and rows are copied into memory, which uses
+    much less memory than `get_table_from_ldac` for large catalogs.
+    
+    Parameters
+    ----------
+    filename: str
+        Name of the file to open
+    frames: int or list of int (optional)
+        Number of the frame (or list of frames) to load, using the same numbering as
+        `get_table_from_ldac`. If multiple frames are given their rows are combined
+        into a single table. The default is ``1``.
+    columns: list of str (optional)
+        Names of the columns to load. The default is ``None``, which loads all of the
+        columns.
+    rows: slice or array (optional)
+        Rows to load from each frame (for example ``slice(0,1000)``, an array of row
+        indices or a boolean mask). The default is ``None``, which loads all of the rows.
+    
+    Returns
+    -------
+    tbl: `astropy.table.Table`
+        Table with the requested columns and rows
+    """
+    import numpy as np
+    if isinstance(frames, (int, np.integer)):
+        frames = [frames]
+    return _read_ldac_hdus(filename, frames, columns, rows)
+
+def get_ldac_frames(filename):
+    """
+    Get the numbers of all of the frames in a fits_ldac file
+    
+    Parameters
+    ----------
+    filename: str
+        Name of the file
+    
+    Returns
+    -------
+    frames: list of int
+        Number of each frame (see `get_table_from_ldac`)
+    """
+    from astropy.io import fits
+    hdulist = fits.open(filename, memmap=True)
+    n_hdus = len(hdulist)
+    hdulist.close()
+    return list(range(1, (n_hdus-1)//2+1))
+
+def read_ldac_frames(filename, frames=None, columns=None, rows=None, frame_column='frame',
+        max_workers=None):
+    """
+    Load multiple frames of a fits_ldac file (for example a catalog with a frame for
+    each CCD in an exposure) into a single table. This is much faster than loading each
+    frame with `get_table_from_ldac` and stacking the tables.
+    
+    Parameters
+    ----------
+    filename: str
+        Name of the file to open
+    frames: list of int (optional)
+        Frames to load (see `get_table_from_ldac`). The default is ``None``, which
+        loads all of the frames.
+    columns: list of str (optional)
+        Names of the columns to load. The default is ``None``, which loads all of the
+        columns.
+    rows: slice or array (optional)
+        Rows to load from each frame. The default is ``None``, which loads all of the rows.
+    frame_column: str (optional)
+        Name of the column added to the table with the frame number of each row.
+        If ``frame_column`` is ``None`` no column is added. The default is ``'frame'``.
+    max_workers: int (optional)
+        Maximum number of frames to copy at the same time. The default is ``None``,
+        which copies one frame at a time.
+    
+    Returns
+    -------
+    tbl: `astropy.table.Table`
+        Table with the rows from each frame (in the same order as ``frames``)
+    """
+    if frames is None:
+        frames = get_ldac_frames(filename)
+    return _read_ldac_hdus(filename, frames, columns, rows, frame_column, max_workers)
@@ -0,0 +1,625 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Stand-in versions of SExtractor, SCAMP, SWarp and PSFEx that can be used to test and
+benchmark pipelines without installing the AstrOmatic codes. The mock codes accept
+the same command line as the real codes and write the same kind of output files
+(FITS_LDAC catalogs, ``.head`` and ``.psf`` files, coadded images and VOTable XML logs
+with a ``Warnings`` table), but the values they contain are random.
+
+The time, CPU and memory used by each code can be set when the scripts are written
+(see `write_mock_codes`) or by setting the environment variables
+``MOCK_ASTROMATIC_RUNTIME``, ``MOCK_ASTROMATIC_CPU``, ``MOCK_ASTROMATIC_MEMORY``,
+``MOCK_ASTROMATIC_ROWS``, ``MOCK_ASTROMATIC_WARNINGS`` and ``MOCK_ASTROMATIC_FAIL``
+(see `default_options`).
+"""
+import os
+import sys
+import time
+
+# Names of the executables for each code
+executables = {
+    'PSFEx': 'psfex',
+    'SCAMP': 'scamp',
+    'SExtractor': 'sex',
+    'SWarp': 'swarp'
+}
+
+# Version reported by each mock code (see `astromatic_wrapper.api.Astromatic.get_version`)
+versions = {
+    'PSFEx': '3.17.1',
+    'SCAMP': '2.0.4',
+    'SExtractor': '2.19.5',
+    'SWarp': '2.38.0'
+}
+
+# Options used to control the mock codes:
+#   runtime: minimum time (in seconds) each code takes to run
+#   cpu: fraction of the runtime spent using the CPU (on ``NTHREADS`` processes)
+#   memory: memory (in MB) allocated by the code
+#   rows: number of sources in each frame of a catalog
+#   warnings: number of warnings written to the XML log
+#   fail: the code fails if any of its inputs contain this string (for example '[3]'
+#       to fail when running frame 3)
+default_options = {
+    'runtime': 0.,
+    'cpu': 0.,
+    'memory': 0,
+    'rows': 100,
+    'warnings': 1,
+    'fail': None
+}
+
+# Parameters written to a SExtractor catalog if no PARAMETERS_NAME file is given
+default_params = ['NUMBER', 'X_IMAGE', 'Y_IMAGE', 'XWIN_WORLD', 'YWIN_WORLD',
+    'MAG_AUTO', 'MAGERR_AUTO', 'FLUX_RADIUS', 'FLAGS']
+
+class MockCodeError(Exception):
+    """
+    Errors that cause a mock code to fail
+    """
+    pass
+
+def get_options(options=None):
+    """
+    Get the options used by a mock code. Environment variables take precedence over
+    ``options``, which take precedence over `default_options`.
+    """
+    all_options = dict(default_options)
+    if options is not None:
+        all_options.update(options)
+    for key, value in default_options.items():
+        env_value = os.environ.get('MOCK_ASTROMATIC_'+key.upper())
+        if env_value is not None:
+            if key=='fail':
+                all_options[key] = env_value
+            else:
+                all_options[key] = type(value)(env_value)
+    return all_options
+
+def parse_args(argv):
+    """
+    Split the command line of an AstrOmatic code into the input files and
+    config parameters
+
+    Parameters
+    ----------
+    argv: list
+        Command line arguments (not including the executable)
+
+    Returns
+    -------
+    filenames: list
+        Input files
+    config: dict
+        Config parameters (with ``'c'`` for the config file)
+    """
+    filenames = []
+    config = {}
+    n = 0
+    while n<len(argv):
+        arg = argv[n]
+        if arg.startswith('-') and n+1<len(argv):
+            config[arg[1:].upper()] = argv[n+1]
+            n += 2
+        else:
+            filenames.append(arg)
+            n += 1
+    return filenames, config
+
+def split_frame(filename):
+    """
+    Split a filename like 'image.fits[3]' into the filename and frame (``None`` if
+    no frame is specified)
+    """
+    if filename.endswith(']') and '[' in filename:
+        filename, frame = filename[:-1].rsplit('[', 1)
+        return filename, int(frame)
+    return filename, None
+
+def get_nthreads(config):
+    """
+    Number of processes used by the code (``NTHREADS==0`` uses all of the CPUs)
+    """
+    from astromatic_wrapper.utils.resources import get_cpu_count
+    nthreads = int(config.get('NTHREADS', 1))
+    if nthreads<=0:
+        nthreads = get_cpu_count()
+    return nthreads
+
+def burn_cpu(seconds, nthreads=1):
+    """
+    Keep ``nthreads`` CPUs busy for a given number of seconds. The extra threads are
+    run in forked processes (on platforms without ``os.fork`` only one CPU is used).
+    """
+    def burn():
+        end = time.time()+seconds
+        x = 0
+        while time.time()<end:
+            for n in range(1000):
+                x += n*n
+    pids = []
+    if hasattr(os, 'fork'):
+        for n in range(nthreads-1):
+            pid = os.fork()
+            if pid==0:
+                try:
+                    burn()
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+    burn()
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+def get_random_state(*args):
+    """
+    Random number generator seeded by the names of the inputs, so that a code run on
+    the same files produces the same output
+    """
+    import numpy as np
+    import zlib
+    seed = zlib.crc32(' '.join([str(arg) for arg in args]).encode('utf-8'))
+    return np.random.RandomState(seed & 0xffffffff)
+
+def get_image_header(frame=1, size=(2048, 4096)):
+    """
+    WCS header of a mock image frame
+    """
+    from astropy.io import fits
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = size[0]
+    header['NAXIS2'] = size[1]
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = 150.
+    header['CRVAL2'] = 2.+.2*(frame-1)
+    header['CRPIX1'] = size[0]/2.
+    header['CRPIX2'] = size[1]/2.
+    header['CD1_1'] = -7.3e-5
+    header['CD1_2'] = 0.
+    header['CD2_1'] = 0.
+    header['CD2_2'] = 7.3e-5
+    header['EQUINOX'] = 2000.
+    header['GAIN'] = 4.
+    return header
+
+def count_frames(filename):
+    """
+    Number of image frames in a FITS file (``1`` if the file doesn't exist)
+    """
+    from astropy.io import fits
+    if not os.path.isfile(filename):
+        return 1
+    hdulist = fits.open(filename, memmap=True)
+    try:
+        frames = len([hdu for hdu in hdulist if hdu.header.get('NAXIS', 0)>=2])
+    finally:
+        hdulist.close()
+    return max(frames, 1)
+
+def count_catalog_frames(filename):
+    """
+    Number of frames in a FITS_LDAC catalog (``1`` if the file can't be read)
+    """
+    from astromatic_wrapper.utils import ldac
+    try:
+        return max(len(ldac.get_ldac_frames(filename)), 1)
+    except (IOError, OSError):
+        return 1
+
+def read_params(filename):
+    """
+    Read the names and sizes of the parameters in a SExtractor parameters file, for
+    example ``FLUX_APER(3)`` is returned as ``('FLUX_APER', 3)``
+    """
+    if filename is None or not os.path.isfile(filename):
+        return [(param, 1) for param in default_params]
+    params = []
+    f = open(filename, 'r')
+    try:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line=='':
+                continue
+            if '(' in line:
+                name, size = line.rstrip(')').split('(')
+                params.append((name, int(size)))
+            else:
+                params.append((line, 1))
+    finally:
+        f.close()
+    return params
+
+def build_catalog(params, rows, random_state, frame=1):
+    """
+    Build a table of mock sources with a column for each parameter
+    """
+    import numpy as np
+    from astropy.table import Table
+    header = get_image_header(frame)
+    tbl = Table()
+    for name, size in params:
+        shape = (rows,) if size==1 else (rows, size)
+        if name=='NUMBER':
+            values = np.arange(1, rows+1, dtype=np.int32)
+        elif name.startswith('FLAGS') or name.startswith('IMAFLAGS'):
+            values = np.zeros(shape, dtype=np.int16)
+        elif name.endswith('_WORLD') and name.startswith('X'):
+            values = header['CRVAL1']+random_state.uniform(-.075, .075, shape)
+        elif name.endswith('_WORLD') and name.startswith('Y'):
+            values = header['CRVAL2']+random_state.uniform(-.15, .15, shape)
+        elif name.endswith('_IMAGE') and name.startswith('X'):
+            values = random_state.uniform(1, header['NAXIS1'], shape)
+        elif name.endswith('_IMAGE') and name.startswith('Y'):
+            values = random_state.uniform(1, header['NAXIS2'], shape)
+        elif name.startswith('MAGERR') or name.startswith('ERR'):
+            values = random_state.uniform(.001, .2, shape).astype(np.float32)
+        elif name.startswith('MAG'):
+            values = random_state.uniform(14, 24, shape).astype(np.float32)
+        else:
+            values = random_state.uniform(0, 10, shape).astype(np.float32)
+        tbl[name] = values
+    return tbl
+
+def write_ldac(filename, tables, headers):
+    """
+    Write a FITS_LDAC catalog with a LDAC_IMHEAD and LDAC_OBJECTS table for each frame
+    """
+    from astropy.io import fits
+    from astromatic_wrapper.utils import ldac
+    hdulist = [fits.PrimaryHDU()]
+    for tbl, header in zip(tables, headers):
+        imhead = ldac.convert_hdu_to_ldac(fits.ImageHDU(header=header))[0]
+        objects = fits.BinTableHDU(tbl.as_array())
+        objects.header['EXTNAME'] = 'LDAC_OBJECTS'
+        hdulist += [imhead, objects]
+    write_atomic(fits.HDUList(hdulist), filename)
+
+def write_atomic(hdulist, filename):
+    """
+    Write a FITS file to a temporary file and move it into place once it has been
+    written, so that other processes never see a partially written file
+    """
+    temp_name = '{0}.{1}.tmp'.format(filename, os.getpid())
+    hdulist.writeto(temp_name)
+    os.rename(temp_name, filename)
+
+def write_xml_log(xml_name, code, argv, warnings, error_msg=None, catalog=None):
+    """
+    Write a VOTable XML log with the same structure as the logs written by the
+    AstrOmatic codes (see `astromatic_wrapper.utils.xmllog.parse_xml_log`)
+
+    Parameters
+    ----------
+    xml_name: str
+        Name of the XML log
+    code: str
+        Name of the code
+    argv: list
+        Command line arguments used to run the code
+    warnings: list
+        Messages in the ``Warnings`` table
+    error_msg: str (optional)
+        Error message of the code
+    catalog: str (optional)
+        Name of a FITS_LDAC catalog linked to by the ``Source_List`` table
+    """
+    from xml.sax.saxutils import escape, quoteattr
+    date = time.strftime('%Y-%m-%d')
+    now = time.strftime('%H:%M:%S')
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<VOTABLE version="1.1"',
+        ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"',
+        ' xsi:noNamespaceSchemaLocation="http://www.ivoa.net/xml/VOTable/v1.1">',
+        '<DESCRIPTION>produced by {0}</DESCRIPTION>'.format(code),
+        '<RESOURCE ID="{0}" name="{0}">'.format(code),
+        ' <DESCRIPTION>Data related to {0}</DESCRIPTION>'.format(code),
+        ' <INFO name="QUERY_STATUS" value="OK" />',
+    ]
+    if catalog is not None:
+        lines += [
+            ' <TABLE ID="Source_List" name={0}>'.format(quoteattr(
+                os.path.basename(catalog))),
+            '  <FIELD name="NUMBER" datatype="int"/>',
+            '  <DATA><FITS extnum="2">',
+            '   <STREAM encoding="gzip" href={0} /> </FITS></DATA>'.format(
+                quoteattr(catalog)),
+            ' </TABLE>',
+        ]
+    param = ('  <PARAM name="{0}" datatype="char" arraysize="*" ucd="meta" '
+        'value={1}/>')
+    lines += [
+        ' <RESOURCE ID="MetaData" name="MetaData">',
+        '  <DESCRIPTION>{0} meta-data</DESCRIPTION>'.format(code),
+        '  <INFO name="QUERY_STATUS" value="OK" />',
+        param.format('Software', quoteattr(code)),
+        param.format('Version', quoteattr(versions[code])),
+        param.format('Date', quoteattr(date)),
+        param.format('Time', quoteattr(now)),
+    ]
+    # The codes only write an error message if they fail
+    if error_msg is not None:
+        lines.append(param.format('Error_Msg', quoteattr(error_msg)))
+    lines += [
+        '  <TABLE ID="Warnings" name="Warnings">',
+        '   <DESCRIPTION>{0} warnings (limited to the last 100)</DESCRIPTION>'.format(
+            code),
+        '   <FIELD name="Date" datatype="char" arraysize="*" ucd="time.end;meta.software"/>',
+        '   <FIELD name="Time" datatype="char" arraysize="*" ucd="time.end;meta.software"/>',
+        '   <FIELD name="Msg" datatype="char" arraysize="*" ucd="meta"/>',
+        '   <DATA><TABLEDATA>',
+    ]
+    for msg in warnings:
+        lines.append('    <TR><TD>{0}</TD><TD>{1}</TD><TD>{2}</TD></TR>'.format(
+            date, now, escape(msg)))
+    lines += [
+        '   </TABLEDATA></DATA>',
+        '  </TABLE>',
+        '  <RESOURCE ID="Config" name="Config">',
+        '   <DESCRIPTION>{0} configuration</DESCRIPTION>'.format(code),
+        param.format('Command_Line', quoteattr(' '.join([executables[code]]+argv))),
+        '  </RESOURCE>',
+        ' </RESOURCE>',
+        '</RESOURCE>',
+        '</VOTABLE>',
+    ]
+    f = open(xml_name, 'w')
+    try:
+        f.write('\n'.join(lines)+'\n')
+    finally:
+        f.close()
+
+def run_sextractor(filenames, config, options):
+    """
+    Write a FITS_LDAC catalog with a frame for each frame in the detection image
+    """
+    image, frame = split_frame(filenames[0])
+    catalog = config.get('CATALOG_NAME', 'test.cat')
+    frames = [frame] if frame is not None else range(1, count_frames(image)+1)
+    params = read_params(config.get('PARAMETERS_NAME'))
+    tables = []
+    headers = []
+    for frame in frames:
+        random_state = get_random_state(image, frame)
+        tables.append(build_catalog(params, options['rows'], random_state, frame))
+        headers.append(get_image_header(frame))
+    if config.get('CATALOG_TYPE', 'FITS_LDAC').upper().startswith('ASCII'):
+        from astropy.table import vstack
+        vstack(tables).write(catalog, format='ascii.commented_header')
+    else:
+        write_ldac(catalog, tables, headers)
+    return [catalog]
+
+def run_scamp(filenames, config, options):
+    """
+    Write a ``.head`` file with the astrometric solution of each frame next to each
+    catalog (and the reference catalog if ``SAVE_REFCATALOG`` is set)
+    """
+    outputs = []
+    suffix = config.get('HEADER_SUFFIX', '.head')
+    for catalog in filenames:
+        random_state = get_random_state(catalog)
+        head_name = os.path.splitext(catalog)[0]+suffix
+        f = open(head_name, 'w')
+        try:
+            for frame in range(1, count_catalog_frames(catalog)+1):
+                header = get_image_header(frame)
+                header['CRVAL1'] += random_state.normal(0, 1e-5)
+                header['CRVAL2'] += random_state.normal(0, 1e-5)
+                header['FLXSCALE'] = random_state.uniform(.9, 1.1)
+                header['MAGZEROP'] = 0.
+                header['ASTINST'] = 1
+                header['PHOTINST'] = 1
+                for key in ['NAXIS', 'NAXIS1', 'NAXIS2', 'GAIN']:
+                    del header[key]
+                for card in header.cards:
+                    f.write(str(card)+'\n')
+                f.write('END'+' '*77+'\n')
+        finally:
+            f.close()
+        outputs.append(head_name)
+    if config.get('SAVE_REFCATALOG', 'N').upper().startswith('Y'):
+        refcat = os.path.join(config.get('REFOUT_CATPATH', '.'), '{0}_mock.cat'.format(
+            config.get('ASTREF_CATALOG', '2MASS')))
+        params = [(param, 1) for param in ['X_WORLD', 'Y_WORLD', 'MAG', 'MAGERR']]
+        tbl = build_catalog(params, options['rows'], get_random_state(*filenames))
+        write_ldac(refcat, [tbl], [get_image_header()])
+        outputs.append(refcat)
+    return outputs
+
+def run_swarp(filenames, config, options):
+    """
+    Write a coadded image and weight map
+    """
+    import numpy as np
+    from astropy.io import fits
+    size = [int(x) for x in config.get('IMAGE_SIZE', '0').split(',')]
+    if len(size)==1:
+        size = size*2
+    size = [x if x>0 else 256 for x in size]
+    header = get_image_header(size=size)
+    image_name = config.get('IMAGEOUT_NAME', 'coadd.fits')
+    weight_name = config.get('WEIGHTOUT_NAME', 'coadd.weight.fits')
+    image = get_random_state(*filenames).normal(0, 1, size[::-1]).astype(np.float32)
+    write_atomic(fits.HDUList([fits.PrimaryHDU(image, header=header)]), image_name)
+    weight = np.full(size[::-1], len(filenames), dtype=np.float32)
+    write_atomic(fits.HDUList([fits.PrimaryHDU(weight, header=header)]), weight_name)
+    return [image_name, weight_name]
+
+def run_psfex(filenames, config, options):
+    """
+    Write a ``.psf`` file with a PSF model for each frame of each catalog
+    """
+    import numpy as np
+    from astropy.io import fits
+    size = [int(x) for x in config.get('PSF_SIZE', '25,25').split(',')]
+    if len(size)==1:
+        size = size*2
+    y, x = np.indices(size[::-1])
+    y = y-size[1]//2
+    x = x-size[0]//2
+    outputs = []
+    for catalog in filenames:
+        random_state = get_random_state(catalog)
+        psf_path = config.get('PSF_DIR', os.path.dirname(catalog))
+        psf_name = os.path.join(psf_path, os.path.splitext(os.path.basename(catalog))[0]+
+            config.get('PSF_SUFFIX', '.psf'))
+        hdulist = [fits.PrimaryHDU()]
+        for frame in range(count_catalog_frames(catalog)):
+            fwhm = random_state.uniform(3, 5)
+            sigma = fwhm/2.3548
+            psf = np.exp(-(x**2+y**2)/(2*sigma**2))
+            psf = (psf/psf.sum()).astype(np.float32)
+            col = fits.Column(name='PSF_MASK', format='{0}E'.format(psf.size),
+                dim='({0}, {1}, 1)'.format(*size), array=psf.reshape((1,1)+psf.shape))
+            hdu = fits.BinTableHDU.from_columns([col])
+            hdu.header['EXTNAME'] = 'PSF_DATA'
+            hdu.header['POLNAXIS'] = 0
+            hdu.header['POLNGRP'] = 0
+            hdu.header['PSF_FWHM'] = fwhm
+            hdu.header['PSF_SAMP'] = 1.
+            hdu.header['PSFNAXIS'] = 3
+            hdu.header['PSFAXIS1'] = size[0]
+            hdu.header['PSFAXIS2'] = size[1]
+            hdu.header['PSFAXIS3'] = 1
+            hdu.header['LOADED'] = options['rows']
+            hdu.header['ACCEPTED'] = int(options['rows']*.8)
+            hdu.header['CHI2'] = random_state.uniform(.8, 1.5)
+            hdulist.append(hdu)
+        write_atomic(fits.HDUList(hdulist), psf_name)
+        outputs.append(psf_name)
+    return outputs
+
+run_code = {
+    'PSFEx': run_psfex,
+    'SCAMP': run_scamp,
+    'SExtractor': run_sextractor,
+    'SWarp': run_swarp
+}
+
+def main(code, argv, options=None):
+    """
+    Run a mock AstrOmatic code
+
+    Parameters
+    ----------
+    code: str
+        Name of the code (``'SExtractor'``, ``'SCAMP'``, ``'SWarp'`` or ``'PSFEx'``)
+    argv: list
+        Command line arguments (not including the executable)
+    options: dict (optional)
+        Options used to control the code (see `default_options`)
+
+    Returns
+    -------
+    status: int
+        Exit status of the code (``0`` if successful, ``1`` if the code failed)
+    """
+    start = time.time()
+    if code not in run_code:
+        raise MockCodeError("'{0}' is not a mock code".format(code))
+    if '-v' in argv or '--version' in argv:
+        print('{0} version {1} ({2})'.format(code, versions[code], '2015-06-05'))
+        return 0
+    options = get_options(options)
+    filenames, config = parse_args(argv)
+    sys.stderr.write('----- {0} {1} started on {2}\n'.format(code, versions[code],
+        time.strftime('%Y-%m-%d at %H:%M:%S')))
+    # Use the requested memory and CPU time before writing the outputs
+    memory = b'\x01'*(int(options['memory'])*1024*1024)
+    cpu_time = options['runtime']*min(max(options['cpu'], 0.), 1.)
+    if cpu_time>0:
+        burn_cpu(cpu_time, get_nthreads(config))
+    remaining = start+options['runtime']-time.time()
+    if remaining>0:
+        time.sleep(remaining)
+    del memory
+    warnings = ['mock warning {0} for {1}'.format(n+1, ' '.join(filenames))
+        for n in range(options['warnings'])]
+    error_msg = None
+    outputs = []
+    try:
+        if len(filenames)==0:
+            raise MockCodeError('no input files')
+        if options['fail'] is not None and any([options['fail'] in filename
+                for filename in filenames]):
+            raise MockCodeError('mock failure for {0}'.format(' '.join(filenames)))
+        outputs = run_code[code](filenames, config, options)
+    except MockCodeError as error:
+        error_msg = '*Error*: {0}'.format(error)
+    if config.get('WRITE_XML', 'N').upper().startswith('Y'):
+        xml_name = config.get('XML_NAME', executables[code]+'.xml')
+        catalog = outputs[0] if code=='SExtractor' and len(outputs)>0 else None
+        write_xml_log(xml_name, code, argv, warnings, error_msg, catalog)
+    for msg in warnings:
+        sys.stderr.write('> WARNING: {0}\n'.format(msg))
+    if error_msg is not None:
+        sys.stderr.write('\n> \n{0}\n\n'.format(error_msg))
+        return 1
+    sys.stderr.write('> All done (in {0:.1f} s)\n'.format(time.time()-start))
+    return 0
+
+def write_mock_codes(path, **options):
+    """
+    Write executable scripts for each of the mock codes (named 'sex', 'scamp',
+    'swarp' and 'psfex'). Add ``path`` to the front of the ``PATH`` environment
+    variable to use the mock codes in place of the real codes, or set the ``cmd`` of
+    `astromatic_wrapper.api.Astromatic` to a script, for example::
+
+        >>> from astromatic_wrapper.utils import mock_codes
+        >>> scripts = mock_codes.write_mock_codes('/tmp/mock', runtime=2, cpu=.5) # doctest: +SKIP
+        >>> os.environ['PATH'] = '/tmp/mock'+os.pathsep+os.environ['PATH'] # doctest: +SKIP
+
+    Parameters
+    ----------
+    path: str
+        Directory to write the scripts to
+    options: keyword arguments
+        Default options used by the codes (see `default_options`). These can be
+        overridden at run time by setting ``MOCK_ASTROMATIC_<OPTION>`` environment
+        variables.
+
+    Returns
+    -------
+    scripts: dict
+        Full path of the script for each code, which can be used as the
+        ``build_paths`` of a `astromatic_wrapper.utils.pipeline.Pipeline`
+    """
+    import stat
+    from astromatic_wrapper.utils.pipeline import create_paths
+    for key in options:
+        if key not in default_options:
+            raise MockCodeError("Unknown option '{0}'".format(key))
+    create_paths(path)
+    # Make sure the package can be imported even if it isn't installed
+    package_path = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    scripts = {}
+    for code, executable in executables.items():
+        script = os.path.join(path, executable)
+        f = open(script, 'w')
+        try:
+            f.write('\n'.join([
+                '#!{0}'.format(sys.executable),
+                'import sys',
+                'sys.path.append({0!r})'.format(package_path),
+                'from astromatic_wrapper.utils import mock_codes',
+                'sys.exit(mock_codes.main({0!r}, sys.argv[1:], {1!r}))'.format(
+                    code, options),
+            ])+'\n')
+        finally:
+            f.close()
+        os.chmod(script, os.stat(script).st_mode|stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH)
+        scripts[code] = script
+    # `astromatic_wrapper.api.run_swarp` looks for 'SWARP' in ``Pipeline.build_paths``
+    scripts['SWARP'] = scripts['SWarp']
+    return scripts
+
+if __name__ == '__main__':
+    # Run a mock code using the name of its executable, for example
+    # python -m astromatic_wrapper.utils.mock_codes sex image.fits -CATALOG_NAME test.cat
+    codes = dict([(executable, code) for code, executable in executables.items()])
+    sys.exit(main(codes[sys.argv[1]], sys.argv[2:]))
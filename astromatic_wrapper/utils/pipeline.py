@@ -102,6 +102,272 @@ def check_path(path, auto_create=False):
         else:
             raise PipelineError("{0} does not exist".format(path))
 
+# Names of the arguments of each step function, so that functions used by many steps
+# are only inspected once
+_func_args = None
+
+def get_func_args(func):
+    """
+    Get the names of the arguments of a function. The names are cached for each
+    function, so a function used by many steps is only inspected once.
+    
+    Parameters
+    ----------
+    func: function
+        Function to inspect
+    
+    Returns
+    -------
+    args: tuple
+        Names of the arguments of ``func``
+    """
+    import inspect
+    import weakref
+    global _func_args
+    if _func_args is None:
+        _func_args = weakref.WeakKeyDictionary()
+    try:
+        return _func_args[func]
+    except (KeyError, TypeError):
+        pass
+    if hasattr(inspect, 'getfullargspec'):
+        args = tuple(inspect.getfullargspec(func).args)
+    else:
+        args = tuple(inspect.getargspec(func).args)
+    try:
+        _func_args[func] = args
+    except TypeError:
+        # Callables that can't be weakly referenced are inspected every time
+        pass
+    return args
+
+def execute_step(func, func_kwargs, catch_exceptions=False, step_id=None, 
+        run_step_idx=None):
+    """
+    Run the function for a single pipeline step. This is a module level function
+    so that it can be sent to other processes when a pipeline is run in parallel.
+    
+    Parameters
+    ----------
+    func: function
+        Function to run
+    func_kwargs: dict
+        Keyword arguments passed to ``func``
+    catch_exceptions: bool (optional)
+        If ``catch_exceptions==True`` any exception raised by ``func`` is caught and
+        a result with ``status=='error'`` and the traceback is returned instead.
+    step_id: str (optional)
+        Unique identifier of the step (used in warnings)
+    run_step_idx: int (optional)
+        Index of the step in ``Pipeline.run_steps`` (used in warnings)
+    
+    Returns
+    -------
+    result: dict
+        Result returned by ``func``
+    """
+    if not catch_exceptions:
+        return func(**func_kwargs)
+    try:
+        result = func(**func_kwargs)
+    except Exception as error:
+        import traceback
+        warning_str = "Exception occurred during step {0} (run_step_idx {1})".format(
+            step_id, run_step_idx)
+        warnings.warn(warning_str)
+        result = {
+            'status': 'error', 
+            'error': traceback.format_exc()
+        }
+    return result
+
+def get_cpu_times():
+    """
+    CPU time (user + system, in seconds) used by the current process and by all
+    of its child processes that have finished (for example astromatic codes)
+    """
+    times = os.times()
+    return times[0]+times[1], times[2]+times[3]
+
+def execute_timed_step(func, func_kwargs, catch_exceptions=False, step_id=None,
+        run_step_idx=None, profile=None, profile_path=None, trace=False):
+    """
+    Run the function for a single pipeline step (see `execute_step`) and measure the
+    time it takes to run. The step can also be profiled using ``cProfile`` or
+    ``tracemalloc``.
+    
+    Parameters
+    ----------
+    func: function
+        Function to run
+    func_kwargs: dict
+        Keyword arguments passed to ``func``
+    catch_exceptions: bool (optional)
+        See `execute_step`
+    step_id: str (optional)
+        Unique identifier of the step (used in warnings)
+    run_step_idx: int (optional)
+        Index of the step in ``Pipeline.run_steps`` (used in warnings)
+    profile: str (optional)
+        Either ``'cprofile'``, which saves the profile of the step (that can be read
+        with `pstats.Stats`) to ``profile_path``, or ``'tracemalloc'``, which saves a
+        `tracemalloc.Snapshot` of the memory allocated by the step to
+        ``profile_path``. The default is ``None``, which does not profile the step.
+    profile_path: str (optional)
+        Name of the file to save the profile to
+    trace: bool (optional)
+        Record trace events for the step (see `astromatic_wrapper.utils.trace`). If
+        events are not already being recorded in the current process (for example in
+        a worker process) the events recorded while the step ran are returned in
+        ``timing['trace_events']``.
+    
+    Returns
+    -------
+    result: dict
+        Result returned by ``func``
+    timing: dict
+        ``start`` and ``end`` time (in seconds since the epoch), ``wall_time``,
+        ``cpu_time`` used by python and ``child_cpu_time`` used by subprocesses
+        (in seconds) and the ``pid`` of the process that ran the step
+    """
+    import time
+    from timeit import default_timer
+    from astromatic_wrapper.utils import trace as trace_events
+    started_trace = trace and trace_events.start_tracing('worker {0}'.format(os.getpid()))
+    if profile=='cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile=='tracemalloc':
+        import tracemalloc
+        tracemalloc.start()
+    elif profile is not None:
+        raise PipelineError("profile must be 'cprofile' or 'tracemalloc'")
+    start = time.time()
+    start_timer = default_timer()
+    start_cpu, start_child_cpu = get_cpu_times()
+    try:
+        with trace_events.span(str(step_id), 'step', func=func.__name__,
+                run_step_idx=run_step_idx):
+            result = execute_step(func, func_kwargs, catch_exceptions, step_id,
+                run_step_idx)
+    finally:
+        wall_time = default_timer()-start_timer
+        cpu, child_cpu = get_cpu_times()
+        if profile=='cprofile':
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        elif profile=='tracemalloc':
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(profile_path)
+        events = trace_events.stop_tracing() if started_trace else None
+    timing = {
+        'start': start,
+        'end': start+wall_time,
+        'wall_time': wall_time,
+        'cpu_time': cpu-start_cpu,
+        'child_cpu_time': child_cpu-start_child_cpu,
+        'pid': os.getpid()
+    }
+    if events is not None:
+        timing['trace_events'] = events
+    return result, timing
+
+class StepScheduler(object):
+    """
+    Keep track of which steps are ready to run, given the dependencies between steps.
+    Steps whose dependencies have all finished are returned in the order they
+    appear in the list of steps.
+    """
+    def __init__(self, steps, dependencies):
+        """
+        Parameters
+        ----------
+        steps: list of tuples
+            ``(run_step_idx, step)`` for each step to run
+        dependencies: dict
+            Keys are step ids and values are the set of step ids that must finish
+            before the step can run (see `Pipeline.get_dependencies`)
+        """
+        import heapq
+        self.steps = dict([(step.step_id, (idx, step)) for idx, step in steps])
+        self.blocking = {}
+        self.dependents = {}
+        self.ready = []
+        self.unfinished = len(steps)
+        for idx, step in steps:
+            deps = dependencies.get(step.step_id, set())
+            self.blocking[step.step_id] = len(deps)
+            for dep in deps:
+                self.dependents.setdefault(dep, []).append(step.step_id)
+            if len(deps)==0:
+                heapq.heappush(self.ready, (idx, step.step_id))
+    
+    def pop_ready(self):
+        """
+        Remove and return all of the ``(run_step_idx, step)`` tuples that are
+        ready to run
+        """
+        import heapq
+        ready = []
+        while len(self.ready)>0:
+            idx, step_id = heapq.heappop(self.ready)
+            ready.append(self.steps[step_id])
+        return ready
+    
+    def release(self, step_id):
+        """
+        Mark a step as finished, which may make some of its dependents ready to run
+        """
+        import heapq
+        self.unfinished -= 1
+        for dependent in self.dependents.pop(step_id, []):
+            self.blocking[dependent] -= 1
+            if self.blocking[dependent]==0:
+                heapq.heappush(self.ready, (self.steps[dependent][0], dependent))
+    
+    def finished(self):
+        """
+        Whether or not all of the steps have been released
+        """
+        return self.unfinished==0
+
+def topological_sort(steps, dependencies):
+    """
+    Sort a list of steps so that every step comes after the steps it depends on.
+    Steps are otherwise kept in their original order.
+    
+    Raises a :py:class:`astromatic.utils.pipeline.PipelineError` if the
+    dependencies are circular.
+    
+    Parameters
+    ----------
+    steps: list of tuples
+        ``(run_step_idx, step)`` for each step
+    dependencies: dict
+        Keys are step ids and values are the set of step ids that must finish
+        before the step can run (see `Pipeline.get_dependencies`)
+    
+    Returns
+    -------
+    sorted_steps: list of tuples
+        ``(run_step_idx, step)`` for each step in the order they can be run
+    """
+    scheduler = StepScheduler(steps, dependencies)
+    sorted_steps = []
+    ready = scheduler.pop_ready()
+    while len(ready)>0:
+        for idx, step in ready:
+            sorted_steps.append((idx, step))
+            scheduler.release(step.step_id)
+        ready = scheduler.pop_ready()
+    if not scheduler.finished():
+        blocked = [step_id for step_id, count in scheduler.blocking.items() if count>0]
+        raise PipelineError(
+            "Circular dependencies found between steps {0}".format(sorted(blocked)))
+    return sorted_steps
+
 class Pipeline(object):
     def __init__(self, paths={}, pipeline_name=None,
             next_id=0, create_paths=False, **kwargs):
@@ -142,7 +408,12 @@ class Pipeline(object):
         self.run_steps = None
         self.run_warnings = None
         self.run_step_idx = 0
+        self.run_completed = set()
+        self.run_workers = 1
         self.paths = paths
+        # Index of the steps by step_id and by tag (see `Pipeline.compile`)
+        self.step_index = {}
+        self.tag_index = {}
         
         # Set additional keyword arguements
         for key, value in kwargs.items():
@@ -164,7 +435,8 @@ class Pipeline(object):
             warnings.warn(
                 "'log' path has not been set for the pipeline. Log files will not be saved.")
      
-    def add_step(self, func, tags=[], ignore_errors=False, ignore_exceptions=False, **kwargs):
+    def add_step(self, func, tags=[], ignore_errors=False, ignore_exceptions=False, 
+            depends_on=[], input_files=[], output_files=[], resources=None, **kwargs):
         """
         Add a new `PipelineStep` to the pipeline
         
@@ -190,23 +462,167 @@ class Pipeline(object):
             for the step that threw an exception and continue running. The default is
             ``ignore_exceptions==False``, which will stop the pipeline and raise an
             exception.
+        depends_on: list (optional)
+            List of step ids that must finish before this step is run.
+        input_files: list (optional)
+            List of files read by the step. The step will depend on any other step
+            that lists one of these files in its ``output_files``.
+        output_files: list (optional)
+            List of files created by the step.
+        resources: dict (optional)
+            Number of ``cpus`` and ``memory`` (in MB) used by the step, which are used to
+            decide how many steps can run at the same time when the pipeline is run
+            with multiple ``workers``. If ``resources`` is ``None`` and ``func`` has a
+            ``get_resources(func_kwargs, workers)`` attribute (for example
+            `astromatic_wrapper.api.run_swarp`) the resources are inferred from the
+            step kwargs and number of workers, otherwise the step uses 1 CPU.
         kwargs: dict
             Keyword arguments passed to the ``func`` when the pipeline is run
+        
+        Returns
+        -------
+        step_id: int
+            Unique identifier for the new step
         """
         step_id = self.next_id
         self.next_id += 1
-        self.steps.append(PipelineStep(
+        step = PipelineStep(
             func,
             step_id,
             tags,
             ignore_errors,
             ignore_exceptions,
-            kwargs
-        ))
+            kwargs,
+            depends_on,
+            input_files,
+            output_files,
+            resources
+        )
+        step.compile()
+        self.steps.append(step)
+        self._index_step(step)
+        return step_id
+    
+    def compile(self):
+        """
+        Rebuild the index of steps by ``step_id`` and tag used to select the steps
+        that are run (see `Pipeline.run`) and precompute the arguments of each step
+        function (see `PipelineStep.compile`). This is done automatically as each step
+        is added, and steps whose tags are changed after they were added are
+        re-indexed the next time steps are selected (see `Pipeline.select_steps`).
+        """
+        self.step_index = {}
+        self.tag_index = {}
+        for step in self.steps:
+            step.compile()
+            self._index_step(step)
+    
+    def _index_step(self, step):
+        self.step_index[step.step_id] = step
+        # Keep a copy of the tags that were indexed, so that steps whose tags are
+        # changed after they are added can be re-indexed
+        step.indexed_tags = tuple(step.tags)
+        for tag in step.indexed_tags:
+            self.tag_index.setdefault(tag, set()).add(step.step_id)
+    
+    def _reindex_step(self, step):
+        for tag in getattr(step, 'indexed_tags', ()):
+            step_ids = self.tag_index.get(tag, set())
+            step_ids.discard(step.step_id)
+            if len(step_ids)==0:
+                self.tag_index.pop(tag, None)
+        self._index_step(step)
+    
+    def select_steps(self, steps, run_tags=[], ignore_tags=[]):
+        """
+        Select the steps that have a tag in ``run_tags`` (or all of the steps if
+        ``run_tags`` is empty) and no tags in ``ignore_tags``, using the tag index
+        of the pipeline. Steps whose tags have changed since they were indexed are
+        re-indexed first.
+        
+        Parameters
+        ----------
+        steps: list of `PipelineStep`
+            Steps to select from
+        run_tags: list (optional)
+            Tags of the steps to select
+        ignore_tags: list (optional)
+            Tags of the steps to skip (these take precedence over ``run_tags``)
+        
+        Returns
+        -------
+        selected: list of `PipelineStep`
+            Steps that were selected (in the same order as ``steps``)
+        """
+        if len(run_tags)==0 and len(ignore_tags)==0:
+            return list(steps)
+        if getattr(self, 'tag_index', None) is None:
+            self.compile()
+        # Re-index any steps whose tags were changed after they were indexed
+        for step in steps:
+            if (self.step_index.get(step.step_id) is step and
+                    tuple(step.tags)!=getattr(step, 'indexed_tags', None)):
+                self._reindex_step(step)
+        run_tags = set(run_tags)
+        ignore_tags = set(ignore_tags)
+        run_ids = set()
+        for tag in run_tags:
+            run_ids.update(self.tag_index.get(tag, ()))
+        ignore_ids = set()
+        for tag in ignore_tags:
+            ignore_ids.update(self.tag_index.get(tag, ()))
+        selected = []
+        for step in steps:
+            if self.step_index.get(step.step_id) is step:
+                if (len(run_tags)==0 or step.step_id in run_ids) and (
+                        step.step_id not in ignore_ids):
+                    selected.append(step)
+            # Steps that were not added to the pipeline using `Pipeline.add_step`
+            # are not in the index
+            elif (len(run_tags)==0 or not run_tags.isdisjoint(step.tags)) and (
+                    ignore_tags.isdisjoint(step.tags)):
+                selected.append(step)
+        return selected
+    
+    def get_dependencies(self, steps=None):
+        """
+        Get the steps that each step depends on, either because they were listed in
+        ``depends_on`` or because they create one of the step's ``input_files``.
+        
+        Parameters
+        ----------
+        steps: list of `PipelineStep` (optional)
+            Steps to get the dependencies for. Only dependencies on steps contained in
+            ``steps`` are returned, so a step that depends on a step that is not
+            being run is not blocked. The default is ``Pipeline.steps``.
+        
+        Returns
+        -------
+        dependencies: dict
+            Keys are the ``step_id`` of each step in ``steps`` and values are the
+            set of ``step_id``'s that must finish before the step can run
+        """
+        if steps is None:
+            steps = self.steps
+        step_ids = set([step.step_id for step in steps])
+        # Map each output file to the steps that create it
+        producers = {}
+        for step in self.steps + list(steps):
+            for filename in getattr(step, 'output_files', []):
+                producers.setdefault(os.path.normpath(filename), set()).add(step.step_id)
+        dependencies = {}
+        for step in steps:
+            step_deps = set(getattr(step, 'depends_on', []))
+            for filename in getattr(step, 'input_files', []):
+                step_deps.update(producers.get(os.path.normpath(filename), []))
+            step_deps.discard(step.step_id)
+            dependencies[step.step_id] = step_deps & step_ids
+        return dependencies
     
     def run(self, run_tags=[], ignore_tags=[], run_steps=None, run_name=None,
             resume=False, ignore_errors=None, ignore_exceptions=None,
-            start_idx=None, current_step_idx=None):
+            start_idx=None, current_step_idx=None, workers=None, cache=None,
+            resources=None, profile=None, trace=None, queue=None):
         """
         Run the pipeline given a list of PipelineSteps
         
@@ -249,8 +665,59 @@ class Pipeline(object):
             Index of ``Pipeline.run_steps`` to begin running the pipeline. All steps in 
             ``Pipeline.run_steps`` after ``start_idx`` will be run in order. The default
             value is ``None``, which will not change the current ``Pipeline.run_step_idx``.
+        workers: int (optional)
+            Number of processes used to run the steps. If ``workers`` is ``None`` or ``1``
+            (the default) the steps are run one at a time in the current process. Otherwise
+            the steps are dispatched to a pool of ``workers`` processes, so the step
+            functions and their kwargs must be picklable. Functions that accept a
+            ``pipeline`` argument receive a copy of the pipeline without its steps
+            (see `Pipeline.get_worker_copy`), so any changes they make to it are not
+            returned to the main process.
+        cache: bool or `astromatic_wrapper.utils.cache.StepCache` (optional)
+            If ``cache`` is ``True`` or a ``StepCache``, a step is skipped (and its
+            cached result is used) if it was already run successfully with the same
+            function, kwargs and ``input_files`` and none of its ``output_files`` have
+            changed since. If ``cache==True`` the results are stored in
+            ``Pipeline.paths['cache']`` (or a 'step_cache' directory in
+            ``Pipeline.paths['temp']`` if no 'cache' path was given). The default is
+            ``None``, which runs every step.
+        resources: dict (optional)
+            Number of ``cpus`` and ``memory`` (in MB) available to the steps when
+            ``workers>1``. Steps are only started when there are enough free CPUs
+            and memory for them (see `Pipeline.add_step`). The default is the larger of
+            ``workers`` and the number of CPUs on the machine, and the total physical
+            memory of the machine.
+        profile: str (optional)
+            Profile each step that is run using either ``'cprofile'`` or
+            ``'tracemalloc'`` (see `execute_timed_step`). The profile of each step is
+            saved in ``paths['log']`` as '<step_id>.prof' (for cProfile) or
+            '<step_id>.tracemalloc'. The default is ``None``, which only records the
+            time taken by each step (see `Pipeline.get_timing_table`).
+        trace: str or bool (optional)
+            Name of a file to save a Chrome Trace Event JSON file of the run to, which
+            can be viewed in ``chrome://tracing`` or Perfetto. The trace has a span for
+            each step, each frame run by `astromatic_wrapper.api.Astromatic.run_frames`,
+            each astromatic code launched (and its subprocess launch), each XML log
+            read and each time the pipeline is saved, labelled with the pid of the
+            process (and the thread) that ran it. If ``trace==True`` the trace is saved
+            in ``paths['log']`` with the same name as the log file and a '.trace.json'
+            extension. The default is ``None``, which doesn't record a trace.
+        queue: str or `astromatic_wrapper.utils.work_queue.WorkQueue` (optional)
+            Directory (on a filesystem shared by all of the nodes) of a queue used to
+            run the steps on other nodes. Each step is added to the queue once all of
+            the steps it depends on have finished and is run by the first
+            ``astromatic-worker`` process to claim it (see
+            `astromatic_wrapper.utils.work_queue.run_worker`), so as with ``workers``
+            the step functions and their kwargs must be picklable. ``queue`` can't be
+            used with ``workers>1`` and ``resources`` are ignored (each worker runs
+            one step at a time). The default is ``None``, which runs the steps on
+            the current node.
+        
+        Each step is started as soon as all of the steps it depends on (see
+        `Pipeline.add_step`) have finished, whether or not they were successful. When
+        ``workers`` is ``None`` the steps are run in the order of ``Pipeline.run_steps``
+        unless a step depends on a step that comes after it.
         """
-        import inspect
         # If no steps are specified and the user is not resuming a previous run,
         # run all of the steps associated with the pipeline
         if run_steps is not None:
@@ -259,112 +726,747 @@ class Pipeline(object):
             self.run_steps = [step for step in self.steps]
         # Filter the steps based on run_tags and ignore_tags, with ignore tags 
         # taking precendent
-        self.run_steps = [step for step in self.run_steps if
-            (len(run_tags) == 0 or any([tag in run_tags for tag in step.tags])) and
-            not any([tag in ignore_tags for tag in step.tags])]
+        self.run_steps = self.select_steps(self.run_steps, run_tags, ignore_tags)
         
-        # Set the path of the log file for the current run
-        dill_dump=False
+        # Set the path of the log file for the current run. The pipeline is saved
+        # to the log file once at the beginning of the run and the result of each
+        # step is appended to a journal as it finishes
+        self._logfile = None
+        self._journal = None
         if 'log' in self.paths:
             if run_name is None:
-                logfile = os.path.join(self.paths['log'], 'pipeline.p')
+                self._logfile = os.path.join(self.paths['log'], 'pipeline.p')
             else:
-                logfile = os.path.join(self.paths['log'], 'pipeline-{0}.p'.format(run_name))
-            logger.info('Pipeline state will be saved to {0}'.format(logfile))
-            # Save the pipeline in the log directory
-            try:
-                import dill
-                dill_dump=True
-                dill.dump(self, open(logfile, 'wb'))
-            except ImportError:
-                warnings.warn(
-                    'Pipeline requires "dill" package to save log file. '
-                    'Attempting to use pickle')
-                import pickle
-                try:
-                    pickle.dump(self, open(logfile, 'wb'))
-                except:
-                    warnings.warn('Unable to dump using pickle, no log file will be saved')
+                self._logfile = os.path.join(self.paths['log'], 
+                    'pipeline-{0}.p'.format(run_name))
+            logger.info('Pipeline state will be saved to {0}'.format(self._logfile))
+            from astromatic_wrapper.utils.journal import RunJournal
+            self._journal = RunJournal(os.path.splitext(self._logfile)[0]+'.journal')
         # If the user specifies a starting index use it, otherwise start at the 
-        # first step unless the user specified to resume where it left off
+        # first step unless the user specified to resume where it left off.
+        # Steps that finished in a previous (parallel) run are only skipped
+        # when resuming
         if start_idx is not None:
             self.run_step_idx = start_idx
+            self.run_completed = set()
         elif not resume:
             self.run_step_idx = 0
-        # Run each step in order
-        steps = self.run_steps[self.run_step_idx:]
-        for step in steps:
-            logger.info('running step {0}: {1}'.format(step.step_id, step.tags))
-            logger.debug('function kwargs: {0}'.format(step.func_kwargs))
-            func_kwargs = step.func_kwargs.copy()
-            
-            # Some functions use step_id to keep track of log files, so the id of
-            # the current step is added to the funciton call
-            if 'step_id' in inspect.getargspec(step.func).args:
-                func_kwargs['step_id'] = step.step_id
-            # Some functions require the Pipeline as a parameter,
-            # so pass the pipeline to the function
-            if 'pipeline' in inspect.getargspec(step.func).args:
+            self.run_completed = set()
+        if profile is not None:
+            if profile not in ['cprofile', 'tracemalloc']:
+                raise PipelineError("profile must be 'cprofile' or 'tracemalloc'")
+            if 'log' not in self.paths:
+                raise PipelineError("A 'log' path is required to save step profiles")
+        if trace is True:
+            if self._logfile is None:
+                raise PipelineError("A 'log' path is required to save the trace")
+            trace = os.path.splitext(self._logfile)[0]+'.trace.json'
+        elif trace is False:
+            trace = None
+        if queue is not None and workers is not None and workers>1:
+            raise PipelineError("A pipeline can't be run with both a queue and workers>1")
+        # Number of steps running at the same time (used by steps to decide how
+        # many threads to use)
+        if workers is None or workers<=1:
+            self.run_workers = 1
+        else:
+            self.run_workers = workers
+        from astromatic_wrapper.utils import trace as trace_events
+        started_trace = trace is not None and trace_events.start_tracing('pipeline')
+        try:
+            self._run_steps(ignore_errors, ignore_exceptions, workers, cache, resources,
+                profile, trace is not None, queue)
+        finally:
+            if started_trace:
+                trace_events.save_trace(trace, trace_events.stop_tracing())
+                logger.info('Saved trace to {0}'.format(trace))
+        result = {
+            'status': 'success',
+            'warnings': self.get_result_table('warnings', ['filename'])
+        }
+        return result
+    
+    def _run_steps(self, ignore_errors, ignore_exceptions, workers, cache, resources,
+            profile, trace, queue=None):
+        """
+        Save the pipeline and run each step in ``Pipeline.run_steps`` that hasn't
+        finished. See `Pipeline.run` for a description of the parameters.
+        """
+        # Save the pipeline in the log directory
+        self.save_checkpoint()
+        if cache is True:
+            from astromatic_wrapper.utils.cache import StepCache
+            if 'cache' in self.paths:
+                cache = StepCache(self.paths['cache'])
+            elif 'temp' in self.paths:
+                cache = StepCache(os.path.join(self.paths['temp'], 'step_cache'))
+            else:
+                raise PipelineError(
+                    "A 'cache' or 'temp' path is required to cache step results")
+        elif cache is False:
+            cache = None
+        steps = [(idx, step) for idx, step in enumerate(self.run_steps)
+            if idx>=self.run_step_idx and step.step_id not in self.run_completed]
+        dependencies = self.get_dependencies([step for idx, step in steps])
+        if queue is not None:
+            self._run_queue(steps, dependencies, queue, ignore_errors, ignore_exceptions,
+                cache, profile, trace)
+        elif workers is None or workers<=1:
+            # Run each step in order
+            for idx, step in topological_sort(steps, dependencies):
+                key, result = self._load_cached_result(step, cache)
+                timing = None
+                if result is None:
+                    logger.info('running step {0}: {1}'.format(step.step_id, step.tags))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug('function kwargs: {0}'.format(step.func_kwargs))
+                    result, timing = execute_timed_step(step.func,
+                        self._get_func_kwargs(step),
+                        self._catch_exceptions(step, ignore_exceptions), step.step_id, idx,
+                        profile, self._get_profile_path(step, profile), trace)
+                    self._cache_result(cache, key, step, result)
+                self._complete_step(idx, step, result, ignore_errors, timing)
+        else:
+            self._run_parallel(steps, dependencies, workers, ignore_errors, ignore_exceptions,
+                cache, resources, profile, trace)
+    
+    def _run_parallel(self, steps, dependencies, workers, ignore_errors, ignore_exceptions,
+            cache=None, resources=None, profile=None, trace=False):
+        """
+        Run a set of steps using a pool of processes. Each step is submitted once
+        all of the steps it depends on have finished and there are enough free CPUs
+        and memory to run it. Results are processed (and the pipeline is saved) in the
+        order the steps finish.
+        
+        Parameters
+        ----------
+        steps: list of tuples
+            ``(run_step_idx, step)`` for each step to run
+        dependencies: dict
+            Dependencies of each step (see `Pipeline.get_dependencies`)
+        workers: int
+            Maximum number of processes to run at one time
+        ignore_errors: bool
+            See `Pipeline.run`
+        ignore_exceptions: bool
+            See `Pipeline.run`
+        cache: `astromatic_wrapper.utils.cache.StepCache` (optional)
+            Cache of step results
+        resources: dict (optional)
+            CPUs and memory available to the steps (see `Pipeline.run`)
+        profile: str (optional)
+            Profiler used for each step (see `Pipeline.run`)
+        trace: bool (optional)
+            Whether or not to record trace events in the worker processes
+        """
+        try:
+            from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        except ImportError:
+            raise PipelineError(
+                "Running a pipeline with multiple workers requires 'concurrent.futures' "
+                "(install the 'futures' package for Python 2)")
+        # Check for circular dependencies before starting any steps
+        from astromatic_wrapper.utils.resources import (ResourcePool, get_cpu_count,
+            get_total_memory)
+        from astromatic_wrapper.utils import trace as trace_events
+        topological_sort(steps, dependencies)
+        scheduler = StepScheduler(steps, dependencies)
+        if resources is None:
+            resources = {}
+        pool = ResourcePool(resources.get('cpus', max(workers, get_cpu_count())),
+            resources.get('memory', get_total_memory()))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        pending = {}
+        # Steps that are ready to run but are waiting for resources
+        waiting = []
+        try:
+            while not scheduler.finished():
+                for idx, step in scheduler.pop_ready():
+                    key, result = self._load_cached_result(step, cache)
+                    if result is not None:
+                        self._complete_step(idx, step, result, ignore_errors)
+                        scheduler.release(step.step_id)
+                        continue
+                    waiting.append((idx, step, key,
+                        pool.get_required(self._get_step_resources(step))))
+                # Start the steps (in order) that fit in the available resources
+                waiting.sort(key=lambda x: x[0])
+                still_waiting = []
+                for idx, step, key, required in waiting:
+                    if len(pending)>=workers or not pool.fits(required):
+                        still_waiting.append((idx, step, key, required))
+                        continue
+                    pool.acquire(required)
+                    logger.info('submitting step {0}: {1}'.format(step.step_id, step.tags))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug('function kwargs: {0}'.format(step.func_kwargs))
+                    future = executor.submit(execute_timed_step, step.func,
+                        self._get_func_kwargs(step, True, required['cpus']),
+                        self._catch_exceptions(step, ignore_exceptions), step.step_id, idx,
+                        profile, self._get_profile_path(step, profile), trace)
+                    pending[future] = (idx, step, key, required)
+                waiting = still_waiting
+                if len(pending)==0:
+                    continue
+                done, not_done = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, step, key, required = pending.pop(future)
+                    pool.release(required)
+                    result, timing = future.result()
+                    trace_events.add_events(timing.pop('trace_events', []))
+                    self._cache_result(cache, key, step, result)
+                    self._complete_step(idx, step, result, ignore_errors, timing)
+                    scheduler.release(step.step_id)
+        finally:
+            # Don't start any new steps if the pipeline stopped due to an error
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+    
+    def _run_queue(self, steps, dependencies, queue, ignore_errors, ignore_exceptions,
+            cache=None, profile=None, trace=False):
+        """
+        Run a set of steps using workers that claim them from a queue on a shared
+        filesystem. Each step is added to the queue once all of the steps it depends
+        on have finished, and results are processed (and the pipeline is saved) in
+        the order the steps finish.
+        
+        Parameters
+        ----------
+        steps: list of tuples
+            ``(run_step_idx, step)`` for each step to run
+        dependencies: dict
+            Dependencies of each step (see `Pipeline.get_dependencies`)
+        queue: str or `astromatic_wrapper.utils.work_queue.WorkQueue`
+            Queue used to run the steps
+        ignore_errors: bool
+            See `Pipeline.run`
+        ignore_exceptions: bool
+            See `Pipeline.run`
+        cache: `astromatic_wrapper.utils.cache.StepCache` (optional)
+            Cache of step results
+        profile: str (optional)
+            Profiler used for each step (see `Pipeline.run`)
+        trace: bool (optional)
+            Whether or not to record trace events in the workers
+        """
+        import time
+        from astromatic_wrapper.utils.work_queue import WorkQueue
+        from astromatic_wrapper.utils import trace as trace_events
+        if not isinstance(queue, WorkQueue):
+            queue = WorkQueue(queue)
+        # Check for circular dependencies before starting any steps
+        topological_sort(steps, dependencies)
+        scheduler = StepScheduler(steps, dependencies)
+        queue.start()
+        logger.info('Running steps with the queue in {0}'.format(queue.path))
+        pending = {}
+        try:
+            while not scheduler.finished():
+                for idx, step in scheduler.pop_ready():
+                    key, result = self._load_cached_result(step, cache)
+                    if result is not None:
+                        self._complete_step(idx, step, result, ignore_errors)
+                        scheduler.release(step.step_id)
+                        continue
+                    logger.info('queueing step {0}: {1}'.format(step.step_id, step.tags))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug('function kwargs: {0}'.format(step.func_kwargs))
+                    queue.put(idx, {
+                        'step_id': step.step_id,
+                        'func': step.func,
+                        'func_kwargs': self._get_func_kwargs(step, True),
+                        'catch_exceptions': self._catch_exceptions(step, ignore_exceptions),
+                        'profile': profile,
+                        'profile_path': self._get_profile_path(step, profile),
+                        'trace': trace
+                    })
+                    pending[idx] = (step, key)
+                if len(pending)==0:
+                    continue
+                records = queue.get_results()
+                if len(records)==0:
+                    queue.requeue_stalled()
+                    time.sleep(queue.poll_interval)
+                    continue
+                for record in records:
+                    idx = record['run_step_idx']
+                    # A step that was requeued may finish on more than one worker,
+                    # so only the first result is used
+                    pending_step = pending.pop(idx, None)
+                    if pending_step is None:
+                        continue
+                    step, key = pending_step
+                    if 'exception' in record:
+                        raise PipelineError(
+                            'Exception in step {0} on worker {1}:\n{2}'.format(
+                            step.step_id, record['worker'], record['exception']))
+                    result, timing = record['result'], record['timing']
+                    timing['worker'] = record['worker']
+                    trace_events.add_events(timing.pop('trace_events', []))
+                    self._cache_result(cache, key, step, result)
+                    self._complete_step(idx, step, result, ignore_errors, timing)
+                    scheduler.release(step.step_id)
+        finally:
+            # Don't start any new steps if the pipeline stopped due to an error
+            queue.clear()
+    
+    def export_job_array(self, path, chunk_size=1, run_tags=[], ignore_tags=[],
+            run_steps=None, ignore_exceptions=None):
+        """
+        Save the steps of the pipeline as a job array that can be run on a batch
+        cluster. The steps are split into chunks of (at most) ``chunk_size`` steps,
+        and each chunk is saved in a file that contains the functions and kwargs of
+        its steps, so each array task only needs to run
+        ``astromatic-job-array run <path> <index>`` (see
+        `astromatic_wrapper.utils.job_array.run_chunk`). Once all of the chunks have
+        finished their results are added to the pipeline using
+        `Pipeline.merge_job_array`.
+        
+        Steps that depend on other steps (see `Pipeline.add_step`) are put in later
+        stages than the steps they depend on. Each stage must be submitted as a
+        separate job array that starts once the previous stage has finished (for
+        example using ``--dependency=afterok`` in SLURM). A copy of the pipeline is
+        also saved in ``path`` as 'pipeline.p', which is used by
+        ``astromatic-job-array merge``.
+        
+        Parameters
+        ----------
+        path: str
+            Directory used to save the job array (this must be visible to all of the
+            nodes)
+        chunk_size: int (optional)
+            Maximum number of steps in each chunk
+        run_tags: list (optional)
+            See `Pipeline.run`
+        ignore_tags: list (optional)
+            See `Pipeline.run`
+        run_steps: list of `PipelineStep` (optional)
+            See `Pipeline.run`
+        ignore_exceptions: bool (optional)
+            See `Pipeline.run`
+        
+        Returns
+        -------
+        manifest: dict
+            Number of ``steps`` and ``chunks`` and the ``stages`` of the job array,
+            where each stage is a list with the index of the first and last chunk
+            in the stage (see `astromatic_wrapper.utils.job_array.read_manifest`)
+        """
+        import uuid
+        from astromatic_wrapper.utils import job_array
+        if chunk_size<1:
+            raise PipelineError('chunk_size must be at least 1')
+        if run_steps is None:
+            run_steps = self.steps
+        self.run_steps = self.select_steps(run_steps, run_tags, ignore_tags)
+        self.run_step_idx = 0
+        self.run_completed = set()
+        # Results are saved in the chunk journals and merged later
+        self._logfile = None
+        self._journal = None
+        check_path(path, self.create_paths)
+        steps = list(enumerate(self.run_steps))
+        dependencies = self.get_dependencies(self.run_steps)
+        # Split the steps into stages, where every step only depends on steps
+        # in previous stages
+        scheduler = StepScheduler(steps, dependencies)
+        stages = []
+        ready = scheduler.pop_ready()
+        while len(ready)>0:
+            stages.append(ready)
+            for idx, step in ready:
+                scheduler.release(step.step_id)
+            ready = scheduler.pop_ready()
+        if not scheduler.finished():
+            # Raise an error describing the circular dependencies
+            topological_sort(steps, dependencies)
+        manifest = {
+            'run_id': uuid.uuid4().hex,
+            'steps': len(steps),
+            'chunks': 0,
+            'stages': []
+        }
+        for stage in stages:
+            first_chunk = manifest['chunks']
+            for n in range(0, len(stage), chunk_size):
+                chunk = {'run_id': manifest['run_id'], 'tasks': []}
+                for idx, step in stage[n:n+chunk_size]:
+                    chunk['tasks'].append({
+                        'step_id': step.step_id,
+                        'run_step_idx': idx,
+                        'func': step.func,
+                        'func_kwargs': self._get_func_kwargs(step, True),
+                        'catch_exceptions': self._catch_exceptions(step,
+                            ignore_exceptions),
+                        'ignore_errors': step.ignore_errors
+                    })
+                job_array.save_object(job_array.get_chunk_name(path, manifest['chunks']),
+                    chunk)
+                manifest['chunks'] += 1
+            manifest['stages'].append([first_chunk, manifest['chunks']-1])
+        job_array.save_object(job_array.get_pipeline_name(path), self)
+        job_array.write_manifest(path, manifest)
+        logger.info('Exported {0} steps in {1} chunks to {2}'.format(
+            manifest['steps'], manifest['chunks'], path))
+        return manifest
+    
+    def merge_job_array(self, path, ignore_errors=None):
+        """
+        Add the results of the steps run in a job array (see
+        `Pipeline.export_job_array`) to the pipeline. Steps in chunks that haven't
+        been run are left unfinished (with a warning).
+        
+        Parameters
+        ----------
+        path: str
+            Directory of the job array
+        ignore_errors: bool (optional)
+            See `Pipeline.run`
+        
+        Returns
+        -------
+        result: dict
+            Result of the job array, with the same keys as the result of
+            `Pipeline.run`
+        """
+        from astromatic_wrapper.utils import job_array
+        steps = dict([(step.step_id, (idx, step)) for idx, step in
+            enumerate(self.run_steps)])
+        for record in job_array.merge_chunks(path):
+            idx, step = steps[record['step_id']]
+            if 'exception' in record:
+                raise PipelineError('Exception in step {0}:\n{1}'.format(
+                    step.step_id, record['exception']))
+            self._complete_step(idx, step, record['results'], ignore_errors,
+                record.get('timing'))
+        unfinished = len(self.run_steps)-len(self.run_completed)
+        if unfinished>0:
+            warnings.warn('{0} steps in the job array have not finished'.format(unfinished))
+        result = {
+            'status': 'success',
+            'warnings': self.get_result_table('warnings', ['filename'])
+        }
+        return result
+    
+    def _get_profile_path(self, step, profile):
+        """
+        Name of the file used to save the profile of a step
+        """
+        if profile is None:
+            return None
+        ext = {'cprofile': 'prof', 'tracemalloc': 'tracemalloc'}[profile]
+        return os.path.join(self.paths['log'], '{0}.{1}'.format(step.step_id, ext))
+    
+    def _get_step_resources(self, step):
+        """
+        Get the CPUs and memory used by a step, either given when the step was added
+        or inferred from the step kwargs by ``step.func.get_resources``
+        """
+        resources = getattr(step, 'resources', None)
+        if resources is None:
+            get_resources = getattr(step.func, 'get_resources', None)
+            if get_resources is None:
+                resources = {}
+            else:
+                resources = get_resources(step.func_kwargs,
+                    workers=getattr(self, 'run_workers', 1))
+        return resources
+    
+    def _load_cached_result(self, step, cache):
+        """
+        Get the cache key for a step and its cached result (if there is one)
+        """
+        if cache is None:
+            return None, None
+        from astromatic_wrapper.utils.cache import CacheKeyError
+        try:
+            key = cache.get_key(step)
+        except CacheKeyError as error:
+            warnings.warn('Step {0} will not be cached: {1}'.format(step.step_id, error))
+            return None, None
+        result = cache.load(key)
+        if result is not None:
+            logger.info('using cached result for step {0}: {1}'.format(
+                step.step_id, step.tags))
+        return key, result
+    
+    def _cache_result(self, cache, key, step, result):
+        """
+        Save the result of a step in the cache (if it was successful)
+        """
+        if (cache is not None and key is not None and isinstance(result, dict) and 
+                result.get('status')=='success'):
+            cache.save(key, step, result)
+    
+    def get_worker_copy(self, cpus=None):
+        """
+        Get a copy of the pipeline without its steps, run state or results, which is
+        passed to steps that take a ``pipeline`` argument when they are run in
+        another process. This keeps the cost of sending each step to a worker from
+        growing with the number of steps in the pipeline.
+        
+        Parameters
+        ----------
+        cpus: int (optional)
+            Number of CPUs reserved for the step (see `Pipeline.run`), which is
+            saved as ``step_cpus`` and used by the ``run_*`` functions in
+            `astromatic_wrapper.api` to set ``NTHREADS``
+        
+        Returns
+        -------
+        pipeline: `Pipeline`
+            Copy of the pipeline with the same ``paths``, ``run_workers`` and any
+            other attributes (such as ``build_paths``)
+        """
+        state = self.__getstate__()
+        state.update({
+            'steps': [],
+            'run_steps': None,
+            'run_warnings': None,
+            'run_completed': set(),
+            'step_index': {},
+            'tag_index': {},
+            'step_cpus': cpus,
+            '_logfile': None,
+            '_journal': None
+        })
+        pipeline = Pipeline.__new__(Pipeline)
+        pipeline.__dict__.update(state)
+        return pipeline
+    
+    def _get_func_kwargs(self, step, worker=False, cpus=None):
+        """
+        Get the keyword arguments used to call the function in a given step. If
+        ``worker`` is ``True`` the step is run in another process and is passed a
+        copy of the pipeline without its steps, with the number of ``cpus`` reserved
+        for the step (see `Pipeline.get_worker_copy`).
+        """
+        # Recompile the step if its function was changed after it was added
+        if getattr(step, 'compiled_func', None) is not step.func:
+            step.compile()
+        func_kwargs = step.func_kwargs.copy()
+        # Some functions use step_id to keep track of log files, so the id of
+        # the current step is added to the funciton call
+        func_kwargs.update(step.kwargs_template)
+        # Some functions require the Pipeline as a parameter,
+        # so pass the pipeline to the function
+        if step.pass_pipeline:
+            if worker:
+                func_kwargs['pipeline'] = self.get_worker_copy(cpus)
+            else:
                 func_kwargs['pipeline'] = self
-            # Attempt to run the step. If an exception occurs, use the
-            # ignore_exceptions parameter to determine whether to 
-            # stop the Pipeline's execution or warn the user and
-            # continue
-            if (ignore_exceptions is not None and ignore_exceptions) or (
-                    ignore_exceptions is None and step.ignore_exceptions):
-                try:
-                    result = step.func(**func_kwargs)
-                except Exception as error:
-                    import traceback
-                    warning_str = "Exception occurred during step {0} (run_step_idx {1})".format(
-                        step.step_id, self.run_step_idx)
-                    warnings.warn(warning_str)
-                    result = {
-                        'status': 'error', 
-                        'error': traceback.format_exc()
-                    }
+        return func_kwargs
+    
+    def _catch_exceptions(self, step, ignore_exceptions):
+        """
+        Whether or not exceptions raised by a step should be caught
+        """
+        return (ignore_exceptions is not None and ignore_exceptions) or (
+            ignore_exceptions is None and step.ignore_exceptions)
+    
+    def _complete_step(self, idx, step, result, ignore_errors, timing=None):
+        """
+        Store the result of a step, check it for errors and save the pipeline
+        
+        Parameters
+        ----------
+        idx: int
+            Index of the step in ``Pipeline.run_steps``
+        step: `PipelineStep`
+            Step that was run
+        result: dict
+            Result returned by the step function
+        ignore_errors: bool
+            See `Pipeline.run`
+        timing: dict (optional)
+            Time taken to run the step (see `execute_timed_step`)
+        """
+        step.results = result
+        step.timing = timing
+        # Check that the result is a dictionary with a 'status' key
+        if result is None or not isinstance(result, dict) or 'status' not in result:
+            warning_str = "Step {0} (run_step_idx {1}) did not return a valid result".format(
+                step.step_id, idx)
+            warnings.warn(warning_str)
+            result = {
+                'status': 'unknown',
+                'result': result
+            }
+        # If there was an error in the step, use ignore_errors to determine whether
+        # or not to raise an exception
+        if result['status'].lower() == 'error':
+            if ((ignore_errors is None and not step.ignore_errors) or
+                    not ignore_errors):
+                raise PipelineError(
+                    'Error returned in step {0} (run_step_idx {1})'.format(
+                        step.step_id, idx
+                    ))
             else:
-                result = step.func(**func_kwargs)
-            
-            step.results = result
-            # Check that the result is a dictionary with a 'status' key
-            if result is None or not isinstance(result, dict) or 'status' not in result:
-                warning_str = "Step {0} (run_step_idx {1}) did not return a valid result".format(
-                    step.step_id, self.run_step_idx)
+                warning_str = "Error in step {0} (run_step_idx{1})".format(
+                    step.step_id, idx)
+                warning_str += ", see results for more"
                 warnings.warn(warning_str)
-                result = {
-                    'status': 'unknown',
-                    'result': result
-                }
-            # If there was an error in the step, use ignore_errors to determine whether
-            # or not to raise an exception
-            if result['status'].lower() == 'error':
-                if ((ignore_errors is None and not step.ignore_errors) or
-                        not ignore_errors):
-                    raise PipelineError(
-                        'Error returned in step {0} (run_step_idx {1})'.format(
-                            step.step_id, self.run_step_idx
-                        ))
-                else:
-                    warning_str = "Error in step {0} (run_step_idx{1})".format(
-                        step.step_id, self.run_step_idx)
-                    warning_str += ", see results for more"
-                    warnings.warn(warning_str)
-            # Increase the run_step_idx and save the pipeline
+        # Mark the step as completed and move the run_step_idx past
+        # all of the steps that have finished
+        self.run_completed.add(step.step_id)
+        while (self.run_step_idx<len(self.run_steps) and
+                self.run_steps[self.run_step_idx].step_id in self.run_completed):
             self.run_step_idx+=1
-            if dill_dump:
+        if getattr(self, '_journal', None) is not None:
+            from timeit import default_timer
+            from astromatic_wrapper.utils import trace
+            start = default_timer()
+            with trace.span('journal', 'checkpoint', step_id=step.step_id):
+                self._journal.append({
+                    'step_id': step.step_id,
+                    'results': step.results,
+                    'run_step_idx': self.run_step_idx,
+                    'timing': timing
+                })
+            if timing is not None:
+                timing['journal_time'] = default_timer()-start
+    
+    def save_checkpoint(self):
+        """
+        Save the pipeline to the log file for the current run (if a 'log' path
+        was specified) and start a new journal for the results of each step.
+        When the log file is loaded the results in the journal are applied to
+        the pipeline (see `Pipeline.replay_journal`).
+        """
+        from timeit import default_timer
+        from astromatic_wrapper.utils import trace
+        logfile = getattr(self, '_logfile', None)
+        if logfile is None:
+            return
+        start = default_timer()
+        with trace.span('checkpoint', 'checkpoint', filename=logfile):
+            self._save_checkpoint(logfile)
+        self.checkpoint_time = default_timer()-start
+        logger.info('Saved pipeline in {0:.3f}s'.format(self.checkpoint_time))
+    
+    def _save_checkpoint(self, logfile):
+        journal = getattr(self, '_journal', None)
+        if journal is not None:
+            journal.start()
+        self._from_checkpoint = True
+        try:
+            try:
+                import dill
                 dill.dump(self, open(logfile, 'wb'))
-            else:
+            except ImportError:
+                warnings.warn(
+                    'Pipeline requires "dill" package to save log file. '
+                    'Attempting to use pickle')
+                import pickle
                 try:
-                    import pickle
                     pickle.dump(self, open(logfile, 'wb'))
                 except:
                     warnings.warn('Unable to dump using pickle, no log file will be saved')
-        result = {
-            'status': 'success',
-            'warnings': self.get_result_table('warnings', ['filename'])
-        }
-        return result
+        finally:
+            self._from_checkpoint = False
+    
+    def replay_journal(self):
+        """
+        Update the pipeline with the results of every step saved in the journal
+        of the current run. This is called automatically when a pipeline is loaded
+        from its log file, so a pipeline loaded after a crash is in the same
+        state as it was after the last step that finished.
+        """
+        journal = getattr(self, '_journal', None)
+        if journal is None:
+            return
+        steps = dict([(step.step_id, step) for step in self.steps])
+        if self.run_steps is not None:
+            steps.update([(step.step_id, step) for step in self.run_steps])
+        for record in journal.read():
+            step = steps[record['step_id']]
+            step.results = record['results']
+            step.timing = record.get('timing')
+            self.run_completed.add(step.step_id)
+            self.run_step_idx = record['run_step_idx']
+    
+    def get_timing_table(self):
+        """
+        Get the time taken to run each step. Steps whose cached result was used
+        (see `Pipeline.run`) are not included.
+        
+        Returns
+        -------
+        timing: `astropy.table.Table`
+            Table with the ``step``, ``func``, ``pid`` of the process that ran the
+            step, ``start`` and ``end`` time (in seconds since the epoch),
+            ``wall_time``, ``cpu_time`` used by python, ``child_cpu_time`` used by
+            subprocesses (such as the astromatic codes) and the time taken to save
+            the result of the step to the journal (``journal_time``). The time taken to
+            save the pipeline at the beginning of the run is stored in
+            ``timing.meta['checkpoint_time']``. If no steps have been timed ``None``
+            is returned.
+        """
+        from astropy.table import Table
+        columns = ['pid', 'start', 'end', 'wall_time', 'cpu_time', 'child_cpu_time',
+            'journal_time']
+        rows = []
+        for step in self.steps:
+            timing = getattr(step, 'timing', None)
+            if timing is None:
+                continue
+            rows.append([step.step_id, step.func.__name__]+
+                [timing.get(column, 0.) for column in columns])
+        if len(rows)==0:
+            return None
+        timing = Table(rows=rows, names=['step', 'func']+columns)
+        timing.meta['checkpoint_time'] = getattr(self, 'checkpoint_time', None)
+        return timing
+    
+    def get_metrics_table(self):
+        """
+        Get the resources used by each step. Steps that run an astromatic code (for
+        example `astromatic_wrapper.api.run_sex`) return a ``usage`` dict with the
+        wall time, CPU time, memory and I/O used by the code (see
+        `astromatic_wrapper.api.wait_process`), and any other step function can return
+        the same ``usage`` key to be included. Values that were not measured
+        for a step (for example I/O counters on platforms other than Linux) are ``0``.
+        
+        Returns
+        -------
+        metrics: `astropy.table.Table`
+            Table with the ``step``, ``func`` and resources used by each step that
+            returned a ``usage`` (``None`` if no steps have)
+        """
+        from astropy.table import Table
+        columns = ['wall_time', 'user_time', 'sys_time', 'max_rss', 'read_chars',
+            'write_chars', 'read_bytes', 'write_bytes']
+        rows = []
+        for step in self.steps:
+            if step.results is None or step.results.get('usage') is None:
+                continue
+            usage = step.results['usage']
+            for key in usage:
+                if key not in columns:
+                    columns.append(key)
+            rows.append((step.step_id, step.func.__name__, usage))
+        if len(rows)==0:
+            return None
+        data = [[row[0] for row in rows], [row[1] for row in rows]]
+        for column in columns:
+            data.append([row[2].get(column, 0) for row in rows])
+        return Table(data, names=['step', 'func']+columns)
+    
+    def __getstate__(self):
+        # Don't save the cached result tables
+        state = self.__dict__.copy()
+        state.pop('_result_tables', None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Pipelines saved before steps were indexed
+        if 'tag_index' not in state:
+            self.compile()
+        if state.get('_from_checkpoint', False):
+            self._from_checkpoint = False
+            self.replay_journal()
     
     def get_result_table(self, key, meta_fields=[]):
         """
@@ -372,6 +1474,15 @@ class Pipeline(object):
         run. This function expects the result for the given key to be an astropy Table that
         can be vstacked with the results from previous steps.
         
+        The table for each step (with the additional ``step`` and ``func`` columns) and
+        the combined table are cached, so calling this function repeatedly (for example
+        while the pipeline is running) only stacks the tables of the steps that finished
+        since the last call onto the end of the combined table. The tables are only all
+        stacked again if the results of a step that is already in the table have
+        changed or a step finished before a step that is already in the table, so
+        the rows are always in the same order as the steps. The returned table is shared between calls, so make a copy before
+        modifying it.
+        
         Parameters
         ----------
         key: str
@@ -389,36 +1500,66 @@ class Pipeline(object):
         all_results: `astropy.table.Table`
             A table with the results from
         """
-        from astropy.table import vstack
-        all_results = None
+        from astropy.table import Table, vstack
+        if getattr(self, '_result_tables', None) is None:
+            self._result_tables = {}
+        cache = self._result_tables.setdefault((key, tuple(meta_fields)), {
+            'steps': {},
+            'table': None
+        })
+        step_tables = {}
+        tables = []
+        # Tables of the steps that were not in the table at the last call
+        new_tables = []
+        rebuild = False
         for step in self.steps:
-            result_tbl = None
-            if step.results is not None:
-                if key in step.results:
-                    result_tbl = step.results[key]
-                    # Add the step number and name of the function called in the step
-                    # to the record for each item in the results table.
-                    result_tbl['step'] = step.step_id
-                    result_tbl['func'] = step.func.__name__
-            if result_tbl is not None:
+            if step.results is None or key not in step.results:
+                continue
+            result_tbl = step.results[key]
+            if result_tbl is None:
+                continue
+            cached = cache['steps'].get(step.step_id)
+            if cached is None or cached[0] is not result_tbl:
+                # Add the step number and name of the function called in the step
+                # to the record for each item in the results table (without
+                # modifying the table stored in the step results)
+                step_tbl = Table(result_tbl, copy=False)
+                step_tbl['step'] = step.step_id
+                step_tbl['func'] = step.func.__name__
                 for f in meta_fields:
                     if f in result_tbl.meta:
-                        result_tbl[f] = result_tbl.meta[f]
+                        step_tbl[f] = result_tbl.meta[f]
                     else:
                         warnings.warn("'{0}' not found in table metadata".format(f))
-                if all_results is None:
-                    all_results = result_tbl
-                else:
-                    all_results = vstack([all_results, result_tbl])
-        return all_results
-
+                if cached is not None:
+                    rebuild = True
+                cached = (result_tbl, step_tbl)
+                new_tables.append(step_tbl)
+            elif len(new_tables)>0:
+                # A step that finished before this call comes after a new step, so
+                # the tables are stacked again to keep the rows in step order
+                rebuild = True
+            step_tables[step.step_id] = cached
+            tables.append(cached[1])
+        # Rebuild the table if the results of a step in the table were removed
+        if len(step_tables)-len(new_tables)!=len(cache['steps']):
+            rebuild = True
+        cache['steps'] = step_tables
+        if len(tables)==0:
+            cache['table'] = None
+        elif rebuild or cache['table'] is None:
+            cache['table'] = vstack(tables)
+        elif len(new_tables)>0:
+            cache['table'] = vstack([cache['table']]+new_tables)
+        return cache['table']
+    
 class PipelineStep:
     """
     A single step in the pipeline. This takes a function and a set of tags and kwargs
     associated with it and stores them in the pipeline.
     """
     def __init__(self, func, step_id, tags=[], ignore_errors=False, ignore_exceptions=False, 
-            func_kwargs={}):
+            func_kwargs={}, depends_on=[], input_files=[], output_files=[], resources=None):
         """
         Initialize a PipelineStep object
         
@@ -444,6 +1585,15 @@ class PipelineStep:
             exception.
         func_kwargs: dict
             Keyword arguments passed to the ``func`` when the pipeline is run
+        depends_on: list (optional)
+            List of step ids that must finish before this step is run
+        input_files: list (optional)
+            List of files read by the step. The step will depend on any other step
+            that lists one of these files in its ``output_files``.
+        output_files: list (optional)
+            List of files created by the step
+        resources: dict (optional)
+            Number of ``cpus`` and ``memory`` (in MB) used by the step
         """
         self.func = func
         self.tags = tags
@@ -451,4 +1601,24 @@ class PipelineStep:
         self.ignore_errors = ignore_errors
         self.ignore_exceptions = ignore_exceptions
         self.func_kwargs = func_kwargs
-        self.results = None
\ No newline at end of file
+        self.depends_on = depends_on
+        self.input_files = input_files
+        self.output_files = output_files
+        self.resources = resources
+        self.results = None
+        self.timing = None
+    
+    def compile(self):
+        """
+        Precompute the names of the arguments of ``func`` and the keyword arguments
+        that are added to ``func_kwargs`` when the step is run (the ``step_id`` if
+        ``func`` has a ``step_id`` argument), so that ``func`` isn't inspected every
+        time the step is run. If ``func`` has a ``pipeline`` argument
+        ``pass_pipeline`` is ``True``.
+        """
+        self.func_args = get_func_args(self.func)
+        self.kwargs_template = {}
+        if 'step_id' in self.func_args:
+            self.kwargs_template['step_id'] = self.step_id
+        self.pass_pipeline = 'pipeline' in self.func_args
+        self.compiled_func = self.func
\ No newline at end of file
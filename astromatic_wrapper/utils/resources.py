@@ -0,0 +1,105 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Keep track of the CPUs and memory used by pipeline steps that run at the same time
+"""
+import os
+
+def get_cpu_count():
+    """
+    Number of CPUs on the current machine (``1`` if the number can't be determined)
+    """
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def get_total_memory():
+    """
+    Total physical memory of the current machine in MB, or ``None`` if it can't be
+    determined
+    """
+    try:
+        pages = os.sysconf('SC_PHYS_PAGES')
+        page_size = os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+    if pages<=0 or page_size<=0:
+        return None
+    return pages*page_size//(1024*1024)
+
+class ResourcePool(object):
+    """
+    CPUs and memory (in MB) available to run steps. A step is only started when
+    there are enough free CPUs and memory, and a step that needs more than the
+    total available (for example a step that uses all of the CPUs) only runs when
+    nothing else is running.
+    """
+    def __init__(self, cpus=None, memory=None):
+        """
+        Parameters
+        ----------
+        cpus: int (optional)
+            Number of CPUs that can be used at the same time. The default is the
+            number of CPUs on the current machine.
+        memory: int (optional)
+            Memory (in MB) that can be used at the same time. The default is
+            ``None``, which does not limit the memory used.
+        """
+        if cpus is None:
+            cpus = get_cpu_count()
+        self.total = {'cpus': cpus, 'memory': memory}
+        self.available = dict(self.total)
+
+    def get_required(self, resources):
+        """
+        Get the resources required by a step, limited to the total resources in the
+        pool (so that every step can eventually be run).
+
+        Parameters
+        ----------
+        resources: dict
+            ``cpus`` and ``memory`` (in MB) used by the step. Steps use 1 CPU and no
+            memory unless otherwise specified.
+
+        Returns
+        -------
+        required: dict
+            ``cpus`` and ``memory`` required to run the step
+        """
+        required = {
+            'cpus': min(resources.get('cpus', 1), self.total['cpus']),
+            'memory': resources.get('memory', 0)
+        }
+        if self.total['memory'] is None:
+            required['memory'] = 0
+        else:
+            required['memory'] = min(required['memory'], self.total['memory'])
+        return required
+
+    def fits(self, required):
+        """
+        Whether or not there are enough free resources to start a step
+        """
+        if required['cpus']>self.available['cpus']:
+            return False
+        if self.available['memory'] is not None and required['memory']>self.available['memory']:
+            return False
+        return True
+
+    def acquire(self, required):
+        """
+        Reserve the resources used by a step
+        """
+        self.available['cpus'] -= required['cpus']
+        if self.available['memory'] is not None:
+            self.available['memory'] -= required['memory']
+
+    def release(self, required):
+        """
+        Free the resources used by a step that has finished
+        """
+        self.available['cpus'] += required['cpus']
+        if self.available['memory'] is not None:
+            self.available['memory'] += required['memory']
@@ -6,5 +6,6 @@ def get_package_data():
         'astromatic_wrapper.utils.tests': [
             os.path.join('data', 'test.ldac.fits'),
             os.path.join('data', 'multiext.ldac.fits'),
+            os.path.join('data', 'sex.log.xml'),
         ]
     }
\ No newline at end of file
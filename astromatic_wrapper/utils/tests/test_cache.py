@@ -0,0 +1,143 @@
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+from astropy.tests.helper import pytest
+
+from astromatic_wrapper.utils import cache, pipeline
+
+def copy_file(in_file, out_file, counter, suffix=''):
+    # Keep track of the number of times the function was run
+    f = open(counter, 'a')
+    f.write('x')
+    f.close()
+    f = open(in_file, 'r')
+    text = f.read()
+    f.close()
+    f = open(out_file, 'w')
+    f.write(text+suffix)
+    f.close()
+    return {'status': 'success', 'text': text+suffix}
+
+def count_calls(counter, value):
+    f = open(counter, 'a')
+    f.write('x')
+    f.close()
+    return {'status': 'success'}
+
+def write_text(filename, text):
+    f = open(filename, 'w')
+    f.write(text)
+    f.close()
+    # Make sure the modification time changes
+    os.utime(filename, (time.time()+10, time.time()+10))
+
+def test_normalize():
+    config1 = OrderedDict([('CATALOG_NAME', 'test.cat'), ('FILTER', False)])
+    config2 = OrderedDict([('FILTER', False), ('CATALOG_NAME', 'test.cat')])
+    assert cache.normalize({'config': config1})==cache.normalize({'config': config2})
+    assert cache.normalize([1,2])!=cache.normalize([2,1])
+    assert cache.normalize({'frames': range(1,3)})==cache.normalize({'frames': [1,2]})
+    # Large arrays that only differ in the middle have different keys
+    array1 = np.zeros(10000)
+    array2 = array1.copy()
+    array2[5000] = 1
+    assert repr(array1)==repr(array2)
+    assert cache.normalize({'data': array1})!=cache.normalize({'data': array2})
+    assert cache.normalize(array1)==cache.normalize(array1.copy())
+    assert cache.normalize(array1)!=cache.normalize(array1.astype('f4'))
+    assert cache.normalize(array1)!=cache.normalize(array1.reshape(100,100))
+    with pytest.raises(cache.CacheKeyError):
+        cache.normalize({'value': object()})
+
+@pytest.mark.parametrize('hash_files', [False, True])
+def test_pipeline_cache(tmpdir, hash_files):
+    in_file = os.path.join(str(tmpdir), 'in.txt')
+    out_file = os.path.join(str(tmpdir), 'out.txt')
+    counter = os.path.join(str(tmpdir), 'counter.txt')
+    write_text(in_file, 'a')
+    step_cache = cache.StepCache(os.path.join(str(tmpdir), 'cache'), hash_files)
+    
+    def get_count():
+        return len(open(counter).read())
+    
+    pipe = pipeline.Pipeline(paths={'temp': str(tmpdir)})
+    pipe.add_step(copy_file, in_file=in_file, out_file=out_file, counter=counter,
+        input_files=[in_file], output_files=[out_file])
+    pipe.run(cache=step_cache)
+    assert get_count()==1
+    pipe.steps[0].results = None
+    pipe.run(cache=step_cache)
+    assert get_count()==1
+    assert pipe.steps[0].results=={'status': 'success', 'text': 'a'}
+    
+    # Changing an input file, output file, or the kwargs reruns the step
+    write_text(in_file, 'b')
+    pipe.run(cache=step_cache)
+    assert get_count()==2
+    assert pipe.steps[0].results['text']=='b'
+    os.remove(out_file)
+    pipe.run(cache=step_cache)
+    assert get_count()==3
+    pipe.steps[0].func_kwargs['suffix'] = 'c'
+    pipe.run(cache=step_cache, workers=2)
+    assert get_count()==4
+    pipe.run(cache=step_cache, workers=2)
+    assert get_count()==4
+    assert pipe.steps[0].results['text']=='bc'
+    
+    # Steps with kwargs that can't be used in a key are run without the cache
+    pipe2 = pipeline.Pipeline(paths={'temp': str(tmpdir)})
+    pipe2.add_step(count_calls, counter=counter, value=object())
+    for n in range(2):
+        with pytest.warns(UserWarning):
+            pipe2.run(cache=step_cache)
+    assert get_count()==6
+    
+    # Results are stored in the temp path by default
+    pipe.run(cache=True)
+    assert os.path.isdir(os.path.join(str(tmpdir), 'step_cache'))
+
+def log_step(step_id, counter):
+    f = open(counter, 'a')
+    f.write('x')
+    f.close()
+    return {'status': 'success', 'log': '{0}.xml'.format(step_id)}
+
+def test_step_id_key(tmpdir):
+    counter = os.path.join(str(tmpdir), 'counter.txt')
+    step_cache = cache.StepCache(os.path.join(str(tmpdir), 'cache'))
+    # Steps that use their step_id are not shared, even if their kwargs are the same
+    pipe = pipeline.Pipeline(paths={'temp': str(tmpdir)})
+    pipe.add_step(log_step, counter=counter)
+    pipe.add_step(log_step, counter=counter)
+    pipe.run(cache=step_cache)
+    assert len(open(counter).read())==2
+    assert pipe.steps[0].results['log']!=pipe.steps[1].results['log']
+
+def test_save_error(tmpdir):
+    path = os.path.join(str(tmpdir), 'cache')
+    step_cache = cache.StepCache(path)
+    pipe = pipeline.Pipeline(paths={'temp': str(tmpdir)})
+    pipe.add_step(count_calls, counter=os.path.join(str(tmpdir), 'counter.txt'))
+    # Results that can't be pickled are not cached and don't leave temporary files
+    step_cache.save('test', pipe.steps[0], {'status': 'success', 'func': lambda x: x})
+    assert os.listdir(path)==[]
+
+def test_missing_output(tmpdir):
+    counter = os.path.join(str(tmpdir), 'counter.txt')
+    out_file = os.path.join(str(tmpdir), 'out.txt')
+    step_cache = cache.StepCache(os.path.join(str(tmpdir), 'cache'))
+    # Steps that don't create their output files are not cached
+    pipe = pipeline.Pipeline(paths={'temp': str(tmpdir)})
+    pipe.add_step(count_calls, counter=counter, value=1, output_files=[out_file])
+    pipe.run(cache=step_cache)
+    pipe.run(cache=step_cache)
+    assert len(open(counter).read())==2
+    # Results saved with a missing output file are never used
+    key = step_cache.get_key(pipe.steps[0])
+    step_cache.save(key, pipe.steps[0], {'status': 'success'})
+    assert step_cache.load(key) is None
+    write_text(out_file, 'a')
+    step_cache.save(key, pipe.steps[0], {'status': 'success'})
+    assert step_cache.load(key)=={'status': 'success'}
@@ -0,0 +1,116 @@
+import os
+from astropy.tests.helper import pytest
+
+from astromatic_wrapper.utils import pipeline
+from astromatic_wrapper.utils import job_array
+
+def write_file(filename, text):
+    f = open(filename, 'w')
+    f.write(text)
+    f.close()
+    return {'status': 'success', 'pid': os.getpid()}
+
+def append_file(in_file, out_file, text):
+    f = open(in_file, 'r')
+    old_text = f.read()
+    f.close()
+    return write_file(out_file, old_text+text)
+
+def count_steps(pipeline):
+    return {'status': 'success', 'steps': len(pipeline.steps)}
+
+def divide(var1, var2):
+    return {'status': 'success', 'quotient': var1/var2}
+
+def fail_once(filename):
+    if not os.path.exists(filename):
+        open(filename, 'w').close()
+        raise ValueError('first run')
+    return {'status': 'success'}
+
+def test_job_array(tmpdir):
+    path = os.path.join(str(tmpdir), 'jobs')
+    pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+    file1 = os.path.join(str(tmpdir), 'file1.txt')
+    file2 = os.path.join(str(tmpdir), 'file2.txt')
+    step1 = pipe.add_step(append_file, in_file=file1, out_file=file2, text='b',
+        input_files=[file1], output_files=[file2])
+    pipe.add_step(write_file, filename=file1, text='a', output_files=[file1])
+    for n in range(3):
+        pipe.add_step(write_file, filename=os.path.join(str(tmpdir), str(n)), text='c')
+    pipe.add_step(write_file, ['skip'], filename=file1, text='d')
+    pipe.add_step(count_steps)
+    manifest = pipe.export_job_array(path, chunk_size=2, ignore_tags=['skip'])
+    assert manifest['steps']==6
+    assert manifest['chunks']==4
+    # The step that depends on file1 is run in a second stage
+    assert manifest['stages']==[[0,2], [3,3]]
+    # Chunks contain a copy of the pipeline without its steps
+    tasks = job_array.load_object(job_array.get_chunk_name(path, 2))['tasks']
+    assert tasks[0]['func_kwargs']['pipeline'].steps==[]
+    assert job_array.read_manifest(path)==manifest
+    assert [task['step_id'] for task in
+        job_array.load_object(job_array.get_chunk_name(path, 3))['tasks']]==[step1]
+
+    for index in range(3):
+        assert job_array.run_chunk(path, index)
+    with pytest.warns(UserWarning):
+        pipe.merge_job_array(path)
+    assert pipe.run_completed==set([1,2,3,4,6])
+    assert pipe.run_step_idx==0
+    assert pipe.steps[6].results['steps']==0
+
+    assert job_array.main(['run', path, '4', '--offset', '1'])==0
+    assert open(file2).read()=='ab'
+    # Steps that already finished are not run again
+    os.remove(file2)
+    assert job_array.run_chunk(path, 3)
+    assert not os.path.exists(file2)
+    assert job_array.main(['merge', path])==0
+    merged = job_array.load_object(job_array.get_pipeline_name(path))
+    assert merged.run_completed==set([0,1,2,3,4,6])
+    assert merged.run_step_idx==6
+    assert merged.steps[0].results['status']=='success'
+    assert len(merged.get_timing_table())==6
+
+def test_job_array_errors(tmpdir):
+    path = str(tmpdir)
+    pipe = pipeline.Pipeline()
+    pipe.add_step(divide, var1=1, var2=0)
+    pipe.add_step(divide, var1=1, var2=0, ignore_exceptions=True)
+    pipe.add_step(divide, var1=1, var2=0, ignore_exceptions=True, ignore_errors=True)
+    with pytest.raises(pipeline.PipelineError):
+        pipe.export_job_array(path, chunk_size=0)
+    pipe.export_job_array(path)
+    assert not job_array.run_chunk(path, 0)
+    assert not job_array.run_chunk(path, 1)
+    assert job_array.run_chunk(path, 2)
+    with pytest.raises(pipeline.PipelineError):
+        pipe.merge_job_array(path)
+
+    pipe.export_job_array(path, ignore_exceptions=True)
+    for index in range(3):
+        job_array.run_chunk(path, index)
+    with pytest.raises(pipeline.PipelineError):
+        pipe.merge_job_array(path)
+    result = pipe.merge_job_array(path, ignore_errors=True)
+    assert result['status']=='success'
+    assert [step.results['status'] for step in pipe.steps]==['error']*3
+
+def test_retry_chunk(tmpdir):
+    path = os.path.join(str(tmpdir), 'jobs')
+    pipe = pipeline.Pipeline(create_paths=True)
+    pipe.add_step(write_file, filename=os.path.join(str(tmpdir), 'a'), text='a')
+    pipe.add_step(fail_once, filename=os.path.join(str(tmpdir), 'b'))
+    pipe.export_job_array(path, chunk_size=2)
+    assert not job_array.run_chunk(path, 0)
+    with pytest.raises(pipeline.PipelineError):
+        pipe.merge_job_array(path)
+    # Running the chunk again only retries the step that raised an exception
+    assert job_array.run_chunk(path, 0)
+    records = job_array.merge_chunks(path)
+    assert [record['step_id'] for record in records]==[0, 1]
+    assert 'exception' not in records[1]
+    pipe.merge_job_array(path)
+    assert pipe.steps[1].results=={'status': 'success'}
+    assert pipe.run_completed==set([0, 1])
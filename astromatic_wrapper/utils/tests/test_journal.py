@@ -0,0 +1,75 @@
+import os
+from astropy.table import Table
+from astropy.tests.helper import pytest
+
+from astromatic_wrapper.utils import journal, pipeline
+
+def success_func(value):
+    return {
+        'status': 'success',
+        'value': value,
+        'warnings': Table([[value]], names=('value',))
+    }
+
+def test_journal(tmpdir):
+    filename = os.path.join(str(tmpdir), 'test.journal')
+    run_journal = journal.RunJournal(filename)
+    assert list(run_journal.read())==[]
+    run_journal.start()
+    assert list(run_journal.read())==[]
+    for n in range(3):
+        run_journal.append({'step_id': n})
+    assert list(run_journal.read())==[{'step_id': 0}, {'step_id': 1}, {'step_id': 2}]
+    
+    # Records that can't be serialized are skipped without affecting later records
+    import threading
+    with pytest.warns(UserWarning):
+        run_journal.append({'step_id': 3, 'lock': threading.Lock()})
+    run_journal.append({'step_id': 4})
+    assert list(run_journal.read())==[{'step_id': n} for n in [0, 1, 2, 4]]
+    
+    # A journal from a different run is ignored
+    other_journal = journal.RunJournal(filename)
+    with pytest.warns(UserWarning):
+        assert list(other_journal.read())==[]
+    
+    # A partially written record is skipped
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    f = open(filename, 'wb')
+    f.write(data[:-3])
+    f.close()
+    with pytest.warns(UserWarning):
+        assert list(run_journal.read())==[{'step_id': n} for n in [0, 1, 2]]
+
+def test_pipeline_journal(tmpdir):
+    pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+    for n in range(5):
+        pipe.add_step(success_func, value=n)
+    pipe.run()
+    records = list(pipe._journal.read())
+    assert [record['step_id'] for record in records]==list(range(5))
+    assert [record['run_step_idx'] for record in records]==list(range(1,6))
+    
+    # Loading the pipeline replays the journal
+    serializer = journal.get_serializer()
+    new_pipe = serializer.load(open(os.path.join(str(tmpdir), 'pipeline.p'), 'rb'))
+    assert new_pipe.run_step_idx==5
+    assert new_pipe.run_completed==set(range(5))
+    assert [step.results['value'] for step in new_pipe.steps]==list(range(5))
+    assert len(new_pipe.get_result_table('warnings'))==5
+
+def lock_func():
+    import threading
+    return {'status': 'success', 'lock': threading.Lock()}
+
+def test_pipeline_journal_error(tmpdir):
+    # A step result that can't be saved in the journal doesn't stop the run
+    pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+    pipe.add_step(lock_func)
+    pipe.add_step(success_func, value=1)
+    with pytest.warns(UserWarning):
+        result = pipe.run()
+    assert result['status']=='success'
+    assert [record['step_id'] for record in pipe._journal.read()]==[1]
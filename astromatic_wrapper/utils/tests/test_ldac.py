@@ -42,6 +42,37 @@ def test_get_table_from_ldac(filename, frame):
     test_tbl = ldac.get_table_from_ldac(filename, frame)
     assert all(data_tbl==test_tbl)
 
+def test_read_ldac():
+    import numpy as np
+    filename = os.path.join(data_path, 'multiext.ldac.fits')
+    tbl = ldac.read_ldac(filename, 2)
+    assert all(tbl==Table(tbl_data[1]))
+    tbl = ldac.read_ldac(filename, 1, columns=['MAG_AUTO', 'XWIN_WORLD'], rows=slice(2,5))
+    assert tbl.colnames==['MAG_AUTO', 'XWIN_WORLD']
+    assert all(tbl==Table(tbl_data[0])[['MAG_AUTO', 'XWIN_WORLD']][2:5])
+    tbl = ldac.read_ldac(filename, [1,2], columns=['YWIN_WORLD'], rows=np.array([0,9]))
+    assert list(tbl['YWIN_WORLD'])==[tbl_data[0]['YWIN_WORLD'][0], 
+        tbl_data[0]['YWIN_WORLD'][9], tbl_data[1]['YWIN_WORLD'][0],
+        tbl_data[1]['YWIN_WORLD'][9]]
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_read_ldac_frames(max_workers):
+    import numpy as np
+    from astropy.table import vstack
+    filename = os.path.join(data_path, 'multiext.ldac.fits')
+    assert ldac.get_ldac_frames(filename)==[1,2]
+    tbl = ldac.read_ldac_frames(filename, max_workers=max_workers)
+    assert list(tbl['frame'])==[1]*10+[2]*10
+    assert all(tbl[['XWIN_WORLD', 'YWIN_WORLD', 'MAG_AUTO']]==
+        vstack([Table(tbl_data[0]), Table(tbl_data[1])]))
+    mask = np.zeros(10, dtype=bool)
+    mask[[1,3]] = True
+    tbl = ldac.read_ldac_frames(filename, [2,1], ['MAG_AUTO'], mask, 'ccd', max_workers)
+    assert tbl.colnames==['MAG_AUTO', 'ccd']
+    assert list(tbl['ccd'])==[2,2,1,1]
+    assert list(tbl['MAG_AUTO'])==[tbl_data[1]['MAG_AUTO'][1], tbl_data[1]['MAG_AUTO'][3],
+        tbl_data[0]['MAG_AUTO'][1], tbl_data[0]['MAG_AUTO'][3]]
+
 def test_convert_table_to_ldac():
     tbl = Table(tbl_data[0])
     hdulist = fits.open(os.path.join(data_path, 'test.ldac.fits'))
@@ -50,6 +81,14 @@ def test_convert_table_to_ldac():
         for n in range(len(hdulist[m].header.cards)):
             assert set(new_hdulist[m].header.cards[n])==set(hdulist[m].header.cards[n])
 
+def test_convert_array_to_ldac():
+    hdulist = fits.open(os.path.join(data_path, 'test.ldac.fits'))
+    new_hdulist = ldac.convert_table_to_ldac(tbl_data[0])
+    for m in range(len(hdulist)):
+        for n in range(len(hdulist[m].header.cards)):
+            assert set(new_hdulist[m].header.cards[n])==set(hdulist[m].header.cards[n])
+    assert all(Table(new_hdulist[2].data)==Table(tbl_data[0]))
+
 def test_save_table_as_ldac(tmpdir):
     tbl = Table(tbl_data[0])
     hdulist = fits.open(os.path.join(data_path, 'test.ldac.fits'))
@@ -58,4 +97,18 @@ def test_save_table_as_ldac(tmpdir):
     new_hdulist = fits.open(filename)
     for m in range(len(hdulist)):
         for n in range(len(hdulist[m].header.cards)):
-            assert set(new_hdulist[m].header.cards[n])==set(hdulist[m].header.cards[n])
\ No newline at end of file
+            assert set(new_hdulist[m].header.cards[n])==set(hdulist[m].header.cards[n])
+
+def test_read_ldac_invalid_frame(monkeypatch):
+    filename = os.path.join(data_path, 'multiext.ldac.fits')
+    hdulists = []
+    def fits_open(*args, **kwargs):
+        hdulists.append(open_file(*args, **kwargs))
+        return hdulists[-1]
+    open_file = fits.open
+    monkeypatch.setattr(fits, 'open', fits_open)
+    with pytest.raises(IndexError):
+        ldac.read_ldac_frames(filename, [1,3])
+    # The file is closed even though the frame doesn't exist
+    assert len(hdulists)==1
+    assert hdulists[0]._file.closed
@@ -0,0 +1,49 @@
+import os
+
+from astropy.io import fits
+
+from astromatic_wrapper.utils import ldac, mock_codes, xmllog
+
+def test_mock_codes(tmpdir):
+    path = str(tmpdir)
+    image = os.path.join(path, 'img.fits')
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=[[0.,0.]]),
+        fits.ImageHDU(data=[[0.,0.]])]).writeto(image)
+    params = os.path.join(path, 'default.param')
+    f = open(params, 'w')
+    f.write('NUMBER\nXWIN_WORLD\nYWIN_WORLD\n#FLAGS\nFLUX_APER(3)\n')
+    f.close()
+    catalog = os.path.join(path, 'img.cat')
+    xml_name = os.path.join(path, 'sex.xml')
+    assert mock_codes.main('SExtractor', [image, '-CATALOG_NAME', catalog,
+        '-PARAMETERS_NAME', params, '-WRITE_XML', 'Y', '-XML_NAME', xml_name],
+        {'rows': 10, 'warnings': 2})==0
+    # A frame is written for each image extension
+    assert ldac.get_ldac_frames(catalog)==[1,2]
+    tbl = ldac.get_table_from_ldac(catalog, frame=2)
+    assert tbl.colnames==['NUMBER', 'XWIN_WORLD', 'YWIN_WORLD', 'FLUX_APER']
+    assert len(tbl)==10
+    assert tbl['FLUX_APER'].shape==(10,3)
+    warnings, error_msg = xmllog.parse_xml_log(xml_name)
+    assert len(warnings)==2
+    assert error_msg is None
+    
+    assert mock_codes.main('SCAMP', [catalog])==0
+    header = fits.Header.fromtextfile(os.path.join(path, 'img.head'))
+    assert header['CTYPE1']=='RA---TAN'
+    assert open(os.path.join(path, 'img.head')).read().count('END ')==2
+    assert mock_codes.main('PSFEx', [catalog, '-PSF_SIZE', '15,15'])==0
+    psf = fits.open(os.path.join(path, 'img.psf'))
+    assert len(psf)==3
+    assert psf[1].data['PSF_MASK'].shape==(1,1,15,15)
+    psf.close()
+    coadd = os.path.join(path, 'coadd.fits')
+    assert mock_codes.main('SWarp', [image, '-IMAGEOUT_NAME', coadd, '-WEIGHTOUT_NAME',
+        os.path.join(path, 'coadd.weight.fits'), '-IMAGE_SIZE', '30,20'])==0
+    assert fits.getdata(coadd).shape==(20,30)
+    
+    # Codes fail if an input contains the 'fail' string
+    assert mock_codes.main('SExtractor', [image+'[2]', '-CATALOG_NAME', catalog,
+        '-WRITE_XML', 'Y', '-XML_NAME', xml_name], {'fail': '[2]'})==1
+    warnings, error_msg = xmllog.parse_xml_log(xml_name)
+    assert error_msg=='*Error*: mock failure for {0}[2]'.format(image)
@@ -65,6 +65,36 @@ def test_func3(var1,var2):
         'diff': var1/var2
     }
 
+def write_file(filename, text):
+    import time
+    time.sleep(.1)
+    f = open(filename, 'w')
+    f.write(text)
+    f.close()
+    return {'status': 'success'}
+
+def append_file(in_file, out_file, text):
+    f = open(in_file, 'r')
+    old_text = f.read()
+    f.close()
+    return write_file(out_file, old_text+text)
+
+def count_steps(pipeline):
+    return {
+        'status': 'success',
+        'steps': len(pipeline.steps),
+        'paths': pipeline.paths
+    }
+
+def record_time(filename):
+    import time
+    start = time.time()
+    time.sleep(.5)
+    f = open(filename, 'w')
+    f.write('{0} {1}'.format(start, time.time()))
+    f.close()
+    return {'status': 'success'}
+
 class TestPipeline:
     def test_empty_init(self):
         pipe = pipeline.Pipeline()
@@ -119,6 +149,49 @@ class TestPipeline:
         assert set(step.tags)==set(['tag1','tag2'])
         assert step.func_kwargs=={'var1':5,'var2':10}
         assert step.results==None
+        # The step function is inspected when the step is added
+        assert step.func_args==('pipeline', 'step_id', 'var1', 'var2')
+        assert step.kwargs_template=={'step_id': 0}
+        assert step.pass_pipeline
+        assert pipe.tag_index=={'tag1': set([0]), 'tag2': set([0])}
+
+    def test_select_steps(self):
+        def record_step(step_id):
+            return {'status': 'success', 'step_id': step_id}
+
+        pipe = pipeline.Pipeline()
+        pipe.add_step(record_step, ['a', 'sex'])
+        pipe.add_step(record_step, ['b', 'sex'])
+        pipe.add_step(record_step, ['b', 'scamp'])
+        assert [step.step_id for step in pipe.select_steps(pipe.steps)]==[0, 1, 2]
+        assert [step.step_id for step in pipe.select_steps(pipe.steps, ['b'])]==[1, 2]
+        assert [step.step_id for step in
+            pipe.select_steps(pipe.steps, ['sex'], ['b'])]==[0]
+        assert [step.step_id for step in pipe.select_steps(pipe.steps, ['c'])]==[]
+        # Steps that weren't added with add_step are selected using their tags
+        extra = pipeline.PipelineStep(record_step, 10, ['b'])
+        assert [step.step_id for step in
+            pipe.select_steps(pipe.steps+[extra], ['b'], ['scamp'])]==[1, 10]
+        # Steps are re-indexed if their tags are changed after they were added
+        pipe.steps[0].tags.append('b')
+        pipe.run(run_tags=['b'], ignore_tags=['scamp'])
+        assert [step.step_id for step in pipe.run_steps]==[0, 1]
+        assert pipe.tag_index['b']==set([0, 1, 2])
+        pipe.steps[2].tags.remove('scamp')
+        pipe.run(run_tags=['b'], ignore_tags=['scamp'])
+        assert [step.step_id for step in pipe.run_steps]==[0, 1, 2]
+        assert 'scamp' not in pipe.tag_index
+        pipe.steps[0].tags = ['c']
+        assert [step.step_id for step in pipe.select_steps(pipe.steps, ['c'])]==[0]
+        assert [step.step_id for step in pipe.select_steps(pipe.steps, ['a'])]==[]
+        assert pipe.steps[1].results['step_id']==1
+        # Steps are recompiled if their function is changed
+        def record_pipeline(pipeline):
+            return {'status': 'success', 'steps': len(pipeline.steps)}
+        pipe.steps[0].func = record_pipeline
+        pipe.run(run_steps=[pipe.steps[0]])
+        assert pipe.steps[0].kwargs_template=={}
+        assert pipe.steps[0].results=={'status': 'success', 'steps': 3}
     
     def test_run_basic(self, tmpdir):
         temp_path = os.path.join(str(tmpdir), 'temp')
@@ -186,4 +259,239 @@ class TestPipeline:
         assert new_pipe.steps[0].results==None
         assert new_pipe.steps[1].results=={'diff': 2.5, 'status': 'success'}
         assert new_pipe.steps[2].results=={'error': 'Division by 0', 'status': 'error'}
-        assert new_pipe.steps[3].results['status']=='error'
\ No newline at end of file
+        assert new_pipe.steps[3].results['status']=='error'
+
+    def test_run_parallel(self, tmpdir):
+        temp_path = os.path.join(str(tmpdir), 'temp')
+        log_path = os.path.join(str(tmpdir), 'log')
+        paths = {
+            'temp': temp_path,
+            'log': log_path
+        }
+        pipe = pipeline.Pipeline(paths=paths, create_paths=True)
+        pipe.add_step(test_func1, ['func1'], var1=3, var2=4)
+        pipe.add_step(test_func2, ['func2'], var1=25, var2=10)
+        pipe.add_step(test_func2, ['func2'], var1=1, var2=0)
+        pipe.add_step(test_func3, var1=1, var2=0)
+        result = pipe.run(ignore_errors=True, ignore_exceptions=True, workers=2)
+        assert result['status']=='success'
+        assert pipe.steps[0].results=={'next_id': 4, 'status': 'success', 'step_id': 0, 'sum': 7}
+        assert pipe.steps[1].results=={'diff': 2.5, 'status': 'success'}
+        assert pipe.steps[2].results=={'error': 'Division by 0', 'status': 'error'}
+        assert pipe.steps[3].results['status']=='error'
+        assert pipe.run_step_idx==4
+
+        pipe = pipeline.Pipeline(paths=paths, create_paths=True)
+        pipe.add_step(test_func1, ['func1'], var1=3, var2=4)
+        pipe.add_step(test_func2, ['func2'], var1=1, var2=0)
+        pipe.add_step(test_func2, ['func2'], var1=25, var2=10)
+        with pytest.raises(pipeline.PipelineError):
+            pipe.run(workers=2)
+        pipe = dill.load(open(os.path.join(paths['log'], 'pipeline.p'), 'rb'))
+        assert 1 not in pipe.run_completed
+        # Resuming the pipeline only runs the steps that did not finish
+        completed = set(pipe.run_completed)
+        for step in pipe.steps:
+            step.results = None
+        pipe.run(resume=True, ignore_errors=True, workers=2)
+        for step in pipe.steps:
+            assert (step.results is None) == (step.step_id in completed)
+        assert pipe.steps[1].results=={'error': 'Division by 0', 'status': 'error'}
+
+        # Steps run in other processes receive a copy of the pipeline without its steps
+        pipe = pipeline.Pipeline(paths=paths, create_paths=True)
+        for n in range(3):
+            pipe.add_step(count_steps)
+        pipe.run(workers=2)
+        assert pipe.steps[2].results=={'status': 'success', 'steps': 0, 'paths': paths}
+        worker_copy = pipe.get_worker_copy()
+        assert worker_copy.paths==paths and len(pipe.steps)==3
+        assert worker_copy.run_steps is None and worker_copy.tag_index=={}
+        pipe.run()
+        assert pipe.steps[2].results['steps']==3
+
+    def test_dependencies(self, tmpdir):
+        pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+        file1 = os.path.join(str(tmpdir), 'file1.txt')
+        file2 = os.path.join(str(tmpdir), 'file2.txt')
+        file3 = os.path.join(str(tmpdir), 'file3.txt')
+        step2 = pipe.add_step(append_file, in_file=file1, out_file=file2, text='b',
+            input_files=[file1], output_files=[file2])
+        step3 = pipe.add_step(append_file, in_file=file2, out_file=file3, text='c',
+            depends_on=[step2])
+        step1 = pipe.add_step(write_file, filename=file1, text='a', output_files=[file1])
+        assert pipe.get_dependencies()=={step1: set(), step2: set([step1]), step3: set([step2])}
+        # Only dependencies on steps that are being run block a step
+        assert pipe.get_dependencies(pipe.steps[1:])=={step1: set(), step3: set()}
+
+        pipe.run()
+        assert open(file3).read()=='abc'
+        assert pipe.run_step_idx==3
+
+        os.remove(file3)
+        pipe.run(workers=3)
+        assert open(file3).read()=='abc'
+
+        pipe.steps[2].depends_on = [step3]
+        with pytest.raises(pipeline.PipelineError):
+            pipe.run()
+
+    def test_get_result_table(self):
+        pipe = pipeline.Pipeline()
+        pipe.add_step(test_func2, var1=1, var2=2)
+        pipe.add_step(test_func2, var1=3, var2=4)
+        pipe.add_step(test_func3, var1=5, var2=6)
+        tbl1 = Table([[1,2]], names=['code'], meta={'filename': 'a.xml'})
+        tbl2 = Table([[3]], names=['code'], meta={'filename': 'b.xml'})
+        pipe.steps[0].results = {'status': 'success', 'warnings': tbl1}
+        pipe.steps[1].results = {'status': 'success', 'warnings': None}
+        pipe.steps[2].results = {'status': 'success', 'warnings': tbl2}
+        result = pipe.get_result_table('warnings', ['filename'])
+        assert list(result['code'])==[1,2,3]
+        assert list(result['step'])==[0,0,2]
+        assert list(result['func'])==['test_func2', 'test_func2', 'test_func3']
+        assert list(result['filename'])==['a.xml', 'a.xml', 'b.xml']
+        # The step results are not modified
+        assert tbl1.colnames==['code']
+        # The table is only rebuilt when the results change
+        assert pipe.get_result_table('warnings', ['filename']) is result
+        # Tables of steps that finished since the last call keep the order of the steps
+        pipe.steps[1].results = {'status': 'success', 'warnings': tbl2}
+        result = pipe.get_result_table('warnings', ['filename'])
+        assert list(result['step'])==[0,0,1,2]
+        # The table is rebuilt if the results of a step in the table change
+        pipe.steps[2].results = {'status': 'success', 'warnings': tbl1}
+        result = pipe.get_result_table('warnings', ['filename'])
+        assert list(result['step'])==[0,0,1,2,2]
+        pipe.steps[0].results = None
+        result = pipe.get_result_table('warnings', ['filename'])
+        assert list(result['step'])==[1,2,2]
+        assert pipe.get_result_table('errors') is None
+        # The cached tables are not saved with the pipeline
+        assert '_result_tables' not in pipe.__getstate__()
+
+    def test_get_result_table_order(self):
+        def record_step(step_id):
+            return {'status': 'success'}
+
+        pipe = pipeline.Pipeline()
+        for n in range(3):
+            pipe.add_step(record_step)
+        # Steps that finish out of order are stacked in the order of the steps
+        pipe.steps[1].results = {'status': 'success', 'warnings': Table([[1]], names=['code'])}
+        assert list(pipe.get_result_table('warnings')['step'])==[1]
+        pipe.steps[0].results = {'status': 'success', 'warnings': Table([[0]], names=['code'])}
+        assert list(pipe.get_result_table('warnings')['step'])==[0,1]
+        pipe.steps[2].results = {'status': 'success', 'warnings': Table([[2]], names=['code'])}
+        result = pipe.get_result_table('warnings')
+        assert list(result['step'])==[0,1,2]
+        # The same table is built without the cached tables
+        pipe._result_tables = None
+        assert list(pipe.get_result_table('warnings')['step'])==list(result['step'])
+
+    def test_run_resources(self, tmpdir):
+        pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+        filenames = [os.path.join(str(tmpdir), '{0}.txt'.format(n)) for n in range(4)]
+        pipe.add_step(record_time, filename=filenames[0], resources={'cpus': 2})
+        pipe.add_step(record_time, filename=filenames[1], resources={'cpus': 8})
+        pipe.add_step(record_time, filename=filenames[2], resources={'memory': 600})
+        pipe.add_step(record_time, filename=filenames[3], resources={'memory': 600})
+        pipe.run(workers=4, resources={'cpus': 4, 'memory': 1000})
+        times = []
+        for filename in filenames:
+            start, end = open(filename).read().split()
+            times.append((float(start), float(end)))
+        def overlap(t1, t2):
+            return t1[0]<t2[1] and t2[0]<t1[1]
+        # Step 1 needs more than all of the CPUs so it runs alone, and steps 2 and 3
+        # don't have enough memory to run at the same time
+        assert not overlap(times[0], times[1])
+        assert not overlap(times[1], times[2])
+        assert not overlap(times[1], times[3])
+        assert not overlap(times[2], times[3])
+        # Steps 0 and 2 fit together
+        assert overlap(times[0], times[2])
+
+    def test_get_metrics_table(self):
+        pipe = pipeline.Pipeline()
+        pipe.add_step(test_func2, var1=1, var2=2)
+        pipe.add_step(test_func2, var1=3, var2=4)
+        pipe.add_step(test_func3, var1=5, var2=6)
+        assert pipe.get_metrics_table() is None
+        pipe.steps[0].results = {'status': 'success', 'usage': {'wall_time': 2.,
+            'user_time': 1.5, 'sys_time': .5, 'max_rss': 100., 'read_bytes': 10}}
+        pipe.steps[1].results = {'status': 'success'}
+        pipe.steps[2].results = {'status': 'success', 'usage': {'wall_time': 1.,
+            'frames': 3}}
+        metrics = pipe.get_metrics_table()
+        assert list(metrics['step'])==[0, 2]
+        assert list(metrics['func'])==['test_func2', 'test_func3']
+        assert list(metrics['wall_time'])==[2., 1.]
+        assert list(metrics['max_rss'])==[100., 0]
+        assert list(metrics['read_bytes'])==[10, 0]
+        assert list(metrics['frames'])==[0, 3]
+
+    def test_get_timing_table(self, tmpdir):
+        import pstats
+        pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+        assert pipe.get_timing_table() is None
+        file1 = os.path.join(str(tmpdir), 'file1.txt')
+        file2 = os.path.join(str(tmpdir), 'file2.txt')
+        pipe.add_step(write_file, filename=file1, text='a')
+        pipe.add_step(write_file, filename=file2, text='b')
+        pipe.run(profile='cprofile')
+        timing = pipe.get_timing_table()
+        assert list(timing['step'])==[0, 1]
+        assert list(timing['func'])==['write_file', 'write_file']
+        assert all(timing['wall_time']>=.1)
+        assert all(abs(timing['end']-timing['start']-timing['wall_time'])<1e-3)
+        assert timing['start'][1]>=timing['end'][0]
+        assert list(timing['pid'])==[os.getpid()]*2
+        assert timing.meta['checkpoint_time']>0
+        stats = pstats.Stats(os.path.join(str(tmpdir), '0.prof'))
+        assert any([func[2]=='write_file' for func in stats.stats])
+        # The timing is saved in the journal
+        new_pipe = dill.load(open(os.path.join(str(tmpdir), 'pipeline.p'), 'rb'))
+        assert list(new_pipe.get_timing_table()['wall_time'])==list(timing['wall_time'])
+
+        if sys.version_info >= (3,4):
+            import tracemalloc
+            pipe.run(workers=2, profile='tracemalloc')
+            timing = pipe.get_timing_table()
+            assert os.getpid() not in list(timing['pid'])
+            snapshot = tracemalloc.Snapshot.load(os.path.join(str(tmpdir), '1.tracemalloc'))
+            assert len(snapshot.traces)>0
+        with pytest.raises(pipeline.PipelineError):
+            pipe.run(profile='yappi')
+
+    def test_trace(self, tmpdir):
+        import json
+        pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+        file1 = os.path.join(str(tmpdir), 'file1.txt')
+        file2 = os.path.join(str(tmpdir), 'file2.txt')
+        pipe.add_step(write_file, filename=file1, text='a')
+        pipe.add_step(write_file, filename=file2, text='b')
+        pipe.run(trace=True)
+        trace = json.load(open(os.path.join(str(tmpdir), 'pipeline.trace.json')))
+        events = trace['traceEvents']
+        steps = [event for event in events if event.get('cat')=='step']
+        assert [event['name'] for event in steps]==['0', '1']
+        assert all([event['ph']=='X' and event['dur']>=1e5 for event in steps])
+        assert all([event['pid']==os.getpid() for event in steps])
+        names = [event['name'] for event in events]
+        assert 'checkpoint' in names
+        assert names.count('journal')==2
+        # Events are recorded in the worker processes
+        trace_file = os.path.join(str(tmpdir), 'parallel.json')
+        pipe.run(workers=2, trace=trace_file)
+        events = json.load(open(trace_file))['traceEvents']
+        steps = [event for event in events if event.get('cat')=='step']
+        assert sorted([event['name'] for event in steps])==['0', '1']
+        assert os.getpid() not in [event['pid'] for event in steps]
+        assert 'checkpoint' in [event['name'] for event in events]
+        # No events are recorded unless a trace is requested
+        from astromatic_wrapper.utils import trace
+        assert not trace.is_tracing()
+        pipe = pipeline.Pipeline()
+        with pytest.raises(pipeline.PipelineError):
+            pipe.run(trace=True)
@@ -0,0 +1,21 @@
+from astromatic_wrapper.utils import resources
+
+def test_resource_pool():
+    pool = resources.ResourcePool(cpus=4, memory=1000)
+    required = pool.get_required({'cpus': 3, 'memory': 800})
+    assert required=={'cpus': 3, 'memory': 800}
+    assert pool.fits(required)
+    pool.acquire(required)
+    assert pool.available=={'cpus': 1, 'memory': 200}
+    assert pool.fits(pool.get_required({}))
+    assert not pool.fits(pool.get_required({'cpus': 1, 'memory': 300}))
+    # Steps that need more than the total resources run when the pool is empty
+    large = pool.get_required({'cpus': 16, 'memory': 4000})
+    assert large=={'cpus': 4, 'memory': 1000}
+    assert not pool.fits(large)
+    pool.release(required)
+    assert pool.fits(large)
+    
+    # Memory is not limited if the total memory isn't given
+    pool = resources.ResourcePool(cpus=2)
+    assert pool.get_required({'memory': 10**6})=={'cpus': 1, 'memory': 0}
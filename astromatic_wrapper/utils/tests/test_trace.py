@@ -0,0 +1,32 @@
+import json
+import os
+
+from astromatic_wrapper.utils import trace
+
+def test_span(tmpdir):
+    # Spans are not recorded unless tracing has been started
+    with trace.span('ignored'):
+        pass
+    assert trace.stop_tracing()==[]
+    assert trace.start_tracing('main')
+    assert not trace.start_tracing()
+    with trace.span('outer', 'test', value=1):
+        with trace.span('inner', 'test'):
+            pass
+    try:
+        with trace.span('failed', 'test'):
+            raise ValueError()
+    except ValueError:
+        pass
+    events = trace.stop_tracing()
+    assert not trace.is_tracing()
+    assert events[0]=={'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0,
+        'args': {'name': 'main'}}
+    inner, outer, failed = events[1:]
+    assert outer['name']=='outer' and outer['args']=={'value': 1}
+    assert outer['ts']<=inner['ts'] and inner['ts']+inner['dur']<=outer['ts']+outer['dur']
+    assert failed['args']=={'error': 'ValueError'}
+    
+    filename = os.path.join(str(tmpdir), 'trace.json')
+    trace.save_trace(filename, events)
+    assert json.load(open(filename))['traceEvents']==events
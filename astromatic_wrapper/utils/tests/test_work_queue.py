@@ -0,0 +1,124 @@
+import os
+import multiprocessing
+from astropy.tests.helper import pytest
+
+from astromatic_wrapper.utils import pipeline
+from astromatic_wrapper.utils import work_queue
+
+def write_file(filename, text):
+    import time
+    time.sleep(.1)
+    f = open(filename, 'w')
+    f.write(text)
+    f.close()
+    return {'status': 'success', 'pid': os.getpid()}
+
+def append_file(in_file, out_file, text):
+    f = open(in_file, 'r')
+    old_text = f.read()
+    f.close()
+    return write_file(out_file, old_text+text)
+
+def count_steps(pipeline):
+    return {'status': 'success', 'pid': os.getpid(), 'steps': len(pipeline.steps)}
+
+def divide(var1, var2):
+    return {'status': 'success', 'quotient': var1/var2}
+
+class DuplicateQueue(work_queue.WorkQueue):
+    """
+    Queue that returns every result twice, as if each step was requeued and run by
+    two workers
+    """
+    def get_results(self):
+        records = work_queue.WorkQueue.get_results(self)
+        return records+[dict(record, worker='duplicate') for record in records]
+
+def test_claim(tmpdir):
+    queue = work_queue.WorkQueue(str(tmpdir), heartbeat_timeout=0)
+    run_id = queue.start()
+    queue.put(1, {'step_id': 'b'})
+    queue.put(0, {'step_id': 'a'})
+    # Steps are claimed in order and only once
+    claimed, task = queue.claim('worker1')
+    assert task=={'step_id': 'a', 'run_id': run_id, 'run_step_idx': 0}
+    assert queue.claim('worker2')[1]['step_id']=='b'
+    assert queue.claim('worker2') is None
+
+    queue.finish(claimed, {'run_id': run_id, 'run_step_idx': 0, 'worker': 'worker1'})
+    queue.finish('missing', {'run_id': 'old run', 'run_step_idx': 2, 'worker': 'worker1'})
+    assert queue.get_results()==[{'run_id': run_id, 'run_step_idx': 0, 'worker': 'worker1'}]
+    assert queue.get_results()==[]
+
+    # Steps are requeued when the heartbeat of the worker that claimed them stops
+    queue.heartbeat('worker2', {'count': 1})
+    assert queue.requeue_stalled()==[]
+    queue.heartbeat('worker2', {'count': 2})
+    assert queue.requeue_stalled()==[]
+    with pytest.warns(UserWarning):
+        assert queue.requeue_stalled()==['000000001']
+    assert queue.claim('worker1')[1]['step_id']=='b'
+
+    assert not queue.stopped()
+    work_queue.main([str(tmpdir), '--stop'])
+    assert queue.stopped()
+    assert work_queue.run_worker(str(tmpdir))==0
+    queue.start()
+    assert not queue.stopped()
+    assert os.listdir(os.path.join(str(tmpdir), 'claimed'))==[]
+
+def test_run_queue(tmpdir):
+    queue_path = os.path.join(str(tmpdir), 'queue')
+    workers = [multiprocessing.Process(target=work_queue.run_worker,
+        args=(queue_path, .01, .1)) for n in range(3)]
+    for worker in workers:
+        worker.start()
+    try:
+        queue = work_queue.WorkQueue(queue_path, poll_interval=.01)
+        pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+        file1 = os.path.join(str(tmpdir), 'file1.txt')
+        file2 = os.path.join(str(tmpdir), 'file2.txt')
+        pipe.add_step(append_file, in_file=file1, out_file=file2, text='b',
+            input_files=[file1], output_files=[file2])
+        pipe.add_step(write_file, filename=file1, text='a', output_files=[file1])
+        for n in range(4):
+            pipe.add_step(write_file, filename=os.path.join(str(tmpdir), str(n)), text='c')
+        # Steps receive a copy of the pipeline without its steps
+        pipe.add_step(count_steps)
+        result = pipe.run(queue=queue)
+        assert result['status']=='success'
+        assert open(file2).read()=='ab'
+        assert all([step.results['pid']!=os.getpid() for step in pipe.steps])
+        assert pipe.steps[-1].results['steps']==0
+        assert pipe.run_step_idx==7
+        assert len(pipe.get_timing_table())==7
+
+        pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+        pipe.add_step(divide, var1=1, var2=0)
+        with pytest.raises(pipeline.PipelineError):
+            pipe.run(queue=queue)
+        pipe.run(queue=queue, ignore_exceptions=True, ignore_errors=True)
+        assert pipe.steps[0].results['status']=='error'
+        with pytest.raises(pipeline.PipelineError):
+            pipe.run(queue=queue, workers=2)
+    finally:
+        work_queue.WorkQueue(queue_path).stop()
+        for worker in workers:
+            worker.join()
+    assert os.listdir(os.path.join(queue_path, 'heartbeats'))==[]
+
+def test_duplicate_results(tmpdir):
+    queue_path = os.path.join(str(tmpdir), 'queue')
+    worker = multiprocessing.Process(target=work_queue.run_worker,
+        args=(queue_path, .01, .1))
+    worker.start()
+    try:
+        pipe = pipeline.Pipeline(paths={'log': str(tmpdir)}, create_paths=True)
+        for n in range(3):
+            pipe.add_step(write_file, filename=os.path.join(str(tmpdir), str(n)), text='c')
+        pipe.run(queue=DuplicateQueue(queue_path, poll_interval=.01))
+        assert pipe.run_completed==set([0, 1, 2])
+        assert all([step.timing['worker']!='duplicate' for step in pipe.steps])
+    finally:
+        work_queue.WorkQueue(queue_path).stop()
+        worker.join()
@@ -0,0 +1,46 @@
+import os
+from astropy.tests.helper import pytest
+
+from astromatic_wrapper.utils import xmllog
+
+data_path = os.path.join(os.path.dirname(os.path.relpath(__file__)), 'data')
+
+def test_parse_xml_log():
+    filename = os.path.join(data_path, 'sex.log.xml')
+    warnings, error_msg = xmllog.parse_xml_log(filename)
+    assert error_msg=='*Error*: test.fits not found'
+    assert warnings.colnames==['Date', 'Time', 'Msg']
+    assert len(warnings)==2
+    assert list(warnings['Msg'])==['Keyword GAIN not found in test.fits', 'FLAG_IMAGE missing']
+    assert warnings.meta['filename']==filename
+
+def test_parse_xml_log_errors(tmpdir):
+    # Truncated log files and logs without warnings raise an XMLLogError
+    f = open(os.path.join(data_path, 'sex.log.xml'))
+    text = f.read()
+    f.close()
+    filename = os.path.join(str(tmpdir), 'truncated.xml')
+    f = open(filename, 'w')
+    f.write(text[:len(text)//2])
+    f.close()
+    with pytest.raises(xmllog.XMLLogError):
+        xmllog.parse_xml_log(filename)
+    filename = os.path.join(str(tmpdir), 'no_warnings.xml')
+    f = open(filename, 'w')
+    f.write('<VOTABLE><RESOURCE></RESOURCE></VOTABLE>')
+    f.close()
+    with pytest.raises(xmllog.XMLLogError):
+        xmllog.parse_xml_log(filename)
+
+def test_empty_warnings(tmpdir):
+    filename = os.path.join(str(tmpdir), 'empty.xml')
+    f = open(filename, 'w')
+    f.write('<VOTABLE xmlns="http://www.ivoa.net/xml/VOTable/v1.1"><RESOURCE>'
+        '<TABLE ID="Warnings"><FIELD name="Msg" datatype="char"/>'
+        '<FIELD name="Count" datatype="int"/><DATA><TABLEDATA>'
+        '<TR><TD>test</TD><TD></TD></TR></TABLEDATA></DATA></TABLE></RESOURCE></VOTABLE>')
+    f.close()
+    warnings, error_msg = xmllog.parse_xml_log(filename)
+    assert error_msg is None
+    assert list(warnings['Count'])==[0]
+    assert list(warnings['Msg'])==['test']
@@ -0,0 +1,156 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Record the time spent in different parts of a pipeline run as
+`Chrome Trace Event <https://github.com/catapult-project/catapult/wiki/Trace-Event-Format>`_
+spans, which can be viewed in ``chrome://tracing`` or Perfetto.
+
+Events are only recorded in a process after `start_tracing` is called in that
+process, so spans cost almost nothing when tracing is turned off.
+"""
+import os
+import time
+import threading
+
+# Events recorded by the current process
+_recorder = None
+
+def is_tracing():
+    """
+    Whether or not events are being recorded in the current process
+    """
+    # A process forked while tracing inherits the recorder of its parent
+    return _recorder is not None and _recorder['pid']==os.getpid()
+
+def start_tracing(process_name=None):
+    """
+    Start recording events in the current process. If events are already being
+    recorded nothing is changed.
+
+    Parameters
+    ----------
+    process_name: str (optional)
+        Name used to label the process in the trace
+
+    Returns
+    -------
+    started: bool
+        ``True`` if recording was started, ``False`` if events were already being
+        recorded
+    """
+    global _recorder
+    if is_tracing():
+        return False
+    pid = os.getpid()
+    _recorder = {'pid': pid, 'events': [], 'lock': threading.Lock()}
+    if process_name is not None:
+        _recorder['events'].append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+            'tid': 0, 'args': {'name': process_name}})
+    return True
+
+def stop_tracing():
+    """
+    Stop recording events in the current process
+
+    Returns
+    -------
+    events: list
+        Events recorded since `start_tracing` was called
+    """
+    global _recorder
+    if not is_tracing():
+        return []
+    events = _recorder['events']
+    _recorder = None
+    return events
+
+def add_events(events):
+    """
+    Add events recorded by another process (for example a pipeline worker)
+    """
+    if is_tracing():
+        with _recorder['lock']:
+            _recorder['events'].extend(events)
+
+class Span(object):
+    """
+    Context manager that records a complete (``'X'``) event for the code run
+    inside of it
+    """
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.time()
+        event = {
+            'name': self.name,
+            'cat': self.cat,
+            'ph': 'X',
+            'ts': self.start*1e6,
+            'dur': (end-self.start)*1e6,
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': self.args
+        }
+        if exc_type is not None:
+            event['args'] = dict(self.args, error=exc_type.__name__)
+        add_events([event])
+        return False
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_null_span = _NullSpan()
+
+def span(name, cat='', **args):
+    """
+    Record the time spent running a block of code, for example::
+
+        with trace.span('read XML log', 'xml', filename=xml_name):
+            ...
+
+    Parameters
+    ----------
+    name: str
+        Name of the span
+    cat: str (optional)
+        Category of the span
+    args: keyword arguments
+        Additional information shown for the span
+
+    Returns
+    -------
+    span: context manager
+        Context manager that records the span if events are being recorded
+    """
+    if not is_tracing():
+        return _null_span
+    return Span(name, cat, args)
+
+def save_trace(filename, events):
+    """
+    Save a list of events as a Chrome Trace Event JSON file
+
+    Parameters
+    ----------
+    filename: str
+        Name of the file
+    events: list
+        Events to save
+    """
+    import json
+    f = open(filename, 'w')
+    try:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    finally:
+        f.close()
@@ -0,0 +1,443 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Queue of pipeline steps stored in a directory on a shared filesystem, so that the
+steps of a pipeline can be run by workers on any node that can see the directory
+(see `Pipeline.run` and the ``astromatic-worker`` command).
+
+The queue doesn't use file locks (which are unreliable on many shared filesystems).
+Instead a worker claims a step by renaming its task file from the 'pending' directory
+into the 'claimed' directory, which only one worker can do, and writes the result to
+the 'results' directory. Every file is written to a temporary file first and renamed
+once it is complete, so partially written files are never read. Each worker also
+updates a heartbeat file, and steps claimed by a worker whose heartbeat stops are put
+back in the queue.
+"""
+import os
+import time
+import logging
+import warnings
+
+logger = logging.getLogger('astromatic.work_queue')
+
+def get_worker_id():
+    """
+    Unique identifier of the current worker process (the hostname and pid)
+    """
+    import socket
+    return '{0}-{1}'.format(socket.gethostname(), os.getpid())
+
+class WorkQueue(object):
+    """
+    Queue of steps stored in a directory on a shared filesystem
+    """
+    def __init__(self, path, poll_interval=1., heartbeat_timeout=60.):
+        """
+        Parameters
+        ----------
+        path: str
+            Directory used to store the queue (this must be visible to all of the
+            workers)
+        poll_interval: float (optional)
+            Time (in seconds) to wait between checks for new steps or results
+        heartbeat_timeout: float (optional)
+            If the heartbeat of a worker hasn't changed for ``heartbeat_timeout``
+            seconds the worker is assumed to have died and the steps it claimed are
+            put back in the queue. This should be several times larger than the
+            ``heartbeat_interval`` of the workers.
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        # Last heartbeat read from each worker and when it was read
+        self._heartbeats = {}
+
+    def _get_dir(self, name):
+        return os.path.join(self.path, name)
+
+    def _write(self, filename, obj):
+        """
+        Pickle an object to a temporary file and move it into place
+        """
+        import uuid
+        from astromatic_wrapper.utils.journal import get_serializer
+        temp_name = os.path.join(os.path.dirname(filename),
+            '.{0}.tmp'.format(uuid.uuid4().hex))
+        f = open(temp_name, 'wb')
+        try:
+            get_serializer().dump(obj, f, protocol=2)
+        finally:
+            f.close()
+        os.rename(temp_name, filename)
+
+    def _read(self, filename):
+        from astromatic_wrapper.utils.journal import get_serializer
+        f = open(filename, 'rb')
+        try:
+            return get_serializer().load(f)
+        finally:
+            f.close()
+
+    def _list(self, name):
+        """
+        Names of the (complete) files in one of the queue directories, in order
+        """
+        try:
+            filenames = os.listdir(self._get_dir(name))
+        except OSError:
+            return []
+        return sorted([filename for filename in filenames if not filename.startswith('.')])
+
+    def create_dirs(self):
+        """
+        Create the queue directories (if they don't already exist)
+        """
+        from astromatic_wrapper.utils.pipeline import create_paths
+        create_paths([self._get_dir(name) for name in
+            ['pending', 'claimed', 'results', 'heartbeats']])
+
+    def start(self):
+        """
+        Start a new run, removing any steps and results left over from a previous run
+
+        Returns
+        -------
+        run_id: str
+            Unique identifier of the run
+        """
+        import uuid
+        self.create_dirs()
+        for name in ['pending', 'claimed', 'results']:
+            for filename in self._list(name):
+                try:
+                    os.remove(os.path.join(self._get_dir(name), filename))
+                except OSError:
+                    pass
+        stop_file = self._get_dir('stop')
+        if os.path.exists(stop_file):
+            os.remove(stop_file)
+        self.run_id = uuid.uuid4().hex
+        self._heartbeats = {}
+        return self.run_id
+
+    def put(self, run_step_idx, task):
+        """
+        Add a step to the queue
+
+        Parameters
+        ----------
+        run_step_idx: int
+            Index of the step in ``Pipeline.run_steps`` (steps are claimed in this
+            order)
+        task: dict
+            ``func`` and ``func_kwargs`` of the step and the other arguments passed to
+            `astromatic_wrapper.utils.pipeline.execute_timed_step`
+        """
+        task = dict(task, run_id=self.run_id, run_step_idx=run_step_idx)
+        self._write(os.path.join(self._get_dir('pending'),
+            '{0:09d}.task'.format(run_step_idx)), task)
+
+    def claim(self, worker_id):
+        """
+        Claim the next step in the queue
+
+        Parameters
+        ----------
+        worker_id: str
+            Identifier of the worker claiming the step
+
+        Returns
+        -------
+        claimed: tuple
+            Name of the claimed task file and the task, or ``None`` if there are no
+            steps in the queue
+        """
+        for filename in self._list('pending'):
+            claimed = os.path.join(self._get_dir('claimed'),
+                '{0}.{1}'.format(filename, worker_id))
+            try:
+                os.rename(os.path.join(self._get_dir('pending'), filename), claimed)
+            except OSError:
+                # Another worker claimed the step first
+                continue
+            try:
+                return claimed, self._read(claimed)
+            except Exception:
+                warnings.warn("Unable to read task '{0}'".format(claimed))
+                os.remove(claimed)
+        return None
+
+    def finish(self, claimed, record):
+        """
+        Save the result of a claimed step
+
+        Parameters
+        ----------
+        claimed: str
+            Name of the claimed task file (see `WorkQueue.claim`)
+        record: dict
+            Result of the step
+        """
+        self._write(os.path.join(self._get_dir('results'),
+            '{0:09d}.{1}.result'.format(record['run_step_idx'], record['worker'])), record)
+        try:
+            os.remove(claimed)
+        except OSError:
+            # The step was put back in the queue or the queue was restarted
+            pass
+
+    def get_results(self):
+        """
+        Remove and return the results of the steps that have finished in the current
+        run (results from previous runs are discarded)
+
+        Returns
+        -------
+        records: list
+            Result of each step that finished since the last call
+        """
+        records = []
+        for filename in self._list('results'):
+            filename = os.path.join(self._get_dir('results'), filename)
+            record = self._read(filename)
+            os.remove(filename)
+            if record.get('run_id')==self.run_id:
+                records.append(record)
+        return records
+
+    def heartbeat(self, worker_id, info):
+        """
+        Update the heartbeat of a worker
+
+        Parameters
+        ----------
+        worker_id: str
+            Identifier of the worker
+        info: dict
+            Information about the worker (this must change each time the heartbeat
+            is updated, for example by including a counter)
+        """
+        self._write(os.path.join(self._get_dir('heartbeats'), worker_id), info)
+
+    def get_heartbeats(self):
+        """
+        Get the last heartbeat of every worker
+
+        Returns
+        -------
+        heartbeats: dict
+            Keys are worker ids and values are the last info saved by the worker
+        """
+        heartbeats = {}
+        for worker_id in self._list('heartbeats'):
+            try:
+                heartbeats[worker_id] = self._read(os.path.join(
+                    self._get_dir('heartbeats'), worker_id))
+            except (IOError, OSError, EOFError):
+                # The worker stopped
+                pass
+        return heartbeats
+
+    def remove_heartbeat(self, worker_id):
+        try:
+            os.remove(os.path.join(self._get_dir('heartbeats'), worker_id))
+        except OSError:
+            pass
+
+    def requeue_stalled(self):
+        """
+        Put steps claimed by workers whose heartbeat hasn't changed for
+        ``heartbeat_timeout`` seconds back in the queue. The time is measured using
+        the clock of the current process, so the clocks on different nodes don't
+        need to agree.
+
+        Returns
+        -------
+        requeued: list
+            Names of the tasks that were put back in the queue
+        """
+        now = time.time()
+        heartbeats = self.get_heartbeats()
+        requeued = []
+        for filename in self._list('claimed'):
+            task_name, worker_id = filename.split('.task.', 1)
+            heartbeat = heartbeats.get(worker_id)
+            last = self._heartbeats.get(worker_id)
+            if last is None or last[0]!=heartbeat:
+                self._heartbeats[worker_id] = (heartbeat, now)
+                continue
+            if now-last[1]<self.heartbeat_timeout:
+                continue
+            try:
+                os.rename(os.path.join(self._get_dir('claimed'), filename),
+                    os.path.join(self._get_dir('pending'), task_name+'.task'))
+            except OSError:
+                continue
+            warnings.warn("Worker {0} stopped responding, requeued task {1}".format(
+                worker_id, task_name))
+            requeued.append(task_name)
+        return requeued
+
+    def clear(self):
+        """
+        Remove all of the steps that haven't been claimed
+        """
+        for filename in self._list('pending'):
+            try:
+                os.remove(os.path.join(self._get_dir('pending'), filename))
+            except OSError:
+                pass
+
+    def stop(self):
+        """
+        Tell all of the workers to exit once they finish their current step
+        """
+        self.create_dirs()
+        open(self._get_dir('stop'), 'w').close()
+
+    def stopped(self):
+        return os.path.exists(self._get_dir('stop'))
+
+class Heartbeat(object):
+    """
+    Thread that updates the heartbeat of a worker at regular intervals
+    """
+    def __init__(self, queue, worker_id, interval=10.):
+        import socket
+        import threading
+        self.queue = queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self.info = {'host': socket.gethostname(), 'pid': os.getpid(), 'count': 0,
+            'step_id': None}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while True:
+            self.beat()
+            self._stop.wait(self.interval)
+            if self._stop.is_set():
+                break
+
+    def beat(self, step_id=None):
+        self.info['count'] += 1
+        self.info['time'] = time.time()
+        if step_id is not None:
+            self.info['step_id'] = step_id
+        try:
+            self.queue.heartbeat(self.worker_id, dict(self.info))
+        except (IOError, OSError) as error:
+            logger.warning('Unable to write heartbeat: {0}'.format(error))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.queue.remove_heartbeat(self.worker_id)
+
+def run_worker(path, poll_interval=1., heartbeat_interval=10., idle_timeout=None,
+        max_steps=None):
+    """
+    Claim and run steps from a `WorkQueue` until the queue is stopped (see
+    `WorkQueue.stop`).
+
+    Parameters
+    ----------
+    path: str
+        Directory of the queue
+    poll_interval: float (optional)
+        Time (in seconds) to wait before checking for new steps when the queue is
+        empty
+    heartbeat_interval: float (optional)
+        Time (in seconds) between updates of the worker's heartbeat
+    idle_timeout: float (optional)
+        Exit if no steps have been run for ``idle_timeout`` seconds. The default is
+        ``None``, which waits for new steps until the queue is stopped.
+    max_steps: int (optional)
+        Exit after running ``max_steps`` steps
+
+    Returns
+    -------
+    steps: int
+        Number of steps that were run
+    """
+    import traceback
+    from astromatic_wrapper.utils.pipeline import execute_timed_step
+    queue = WorkQueue(path)
+    queue.create_dirs()
+    worker_id = get_worker_id()
+    heartbeat = Heartbeat(queue, worker_id, heartbeat_interval)
+    heartbeat.start()
+    logger.info('worker {0} started on {1}'.format(worker_id, path))
+    steps = 0
+    idle_start = time.time()
+    try:
+        while not queue.stopped():
+            claimed = queue.claim(worker_id)
+            if claimed is None:
+                if idle_timeout is not None and time.time()-idle_start>idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                continue
+            claimed, task = claimed
+            logger.info('running step {0}'.format(task['step_id']))
+            heartbeat.beat(task['step_id'])
+            record = {
+                'run_id': task['run_id'],
+                'run_step_idx': task['run_step_idx'],
+                'step_id': task['step_id'],
+                'worker': worker_id
+            }
+            try:
+                record['result'], record['timing'] = execute_timed_step(task['func'],
+                    task['func_kwargs'], task['catch_exceptions'], task['step_id'],
+                    task['run_step_idx'], task.get('profile'), task.get('profile_path'),
+                    task.get('trace', False))
+            except Exception:
+                record['exception'] = traceback.format_exc()
+            queue.finish(claimed, record)
+            steps += 1
+            if max_steps is not None and steps>=max_steps:
+                break
+            idle_start = time.time()
+    finally:
+        heartbeat.stop()
+    logger.info('worker {0} ran {1} steps'.format(worker_id, steps))
+    return steps
+
+def main(argv=None):
+    """
+    Entry point of the ``astromatic-worker`` command, which runs a worker for the
+    queue in a given directory (see `run_worker`)
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run pipeline steps from a queue on a shared filesystem')
+    parser.add_argument('path', help='Directory of the queue')
+    parser.add_argument('--poll-interval', type=float, default=1.,
+        help='Seconds to wait between checks for new steps')
+    parser.add_argument('--heartbeat-interval', type=float, default=10.,
+        help='Seconds between heartbeats')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+        help='Exit after this many seconds without running a step')
+    parser.add_argument('--max-steps', type=int, default=None,
+        help='Exit after running this many steps')
+    parser.add_argument('--stop', action='store_true',
+        help='Tell the workers using the queue to exit and return')
+    args = parser.parse_args(argv)
+    if args.stop:
+        WorkQueue(args.path).stop()
+        return 0
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    run_worker(args.path, args.poll_interval, args.heartbeat_interval, args.idle_timeout,
+        args.max_steps)
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Functions to read the warnings and error messages from the XML (VOTable) log files
+generated by AstrOmatic codes without parsing the entire VOTable
+"""
+import numpy as np
+
+class XMLLogError(Exception):
+    """
+    Errors generated while reading an XML log file
+    """
+    pass
+
+# Convert VOTable datatypes to numpy types and the value used for empty cells
+datatypes = {
+    'boolean': (bool, False),
+    'unsignedByte': (int, 0),
+    'short': (int, 0),
+    'int': (int, 0),
+    'long': (int, 0),
+    'float': (float, 0),
+    'double': (float, 0),
+}
+
+def _strip_namespace(tag):
+    if '}' in tag:
+        return tag.split('}', 1)[1]
+    return tag
+
+def _convert(value, datatype):
+    dtype, fill_value = datatypes.get(datatype, (str, ''))
+    if value is None or value.strip()=='':
+        return fill_value
+    if dtype is bool:
+        return value.strip().lower() in ['t', 'true', '1']
+    if dtype is str:
+        return value
+    return dtype(value)
+
+def parse_xml_log(filename):
+    """
+    Read the warnings table and error message from an AstrOmatic XML log file.
+    The file is read incrementally and only the ``Warnings`` table and
+    ``Error_Msg`` parameter are kept in memory, so there is no need to remove
+    links to FITS_LDAC catalogs (as is necessary for
+    `astropy.io.votable.parse`).
+
+    Raises a :py:class:`astromatic_wrapper.utils.xmllog.XMLLogError` if the file
+    is not valid XML or does not contain a ``Warnings`` table.
+
+    Parameters
+    ----------
+    filename: str
+        Name of the XML file
+
+    Returns
+    -------
+    warnings: `astropy.table.Table`
+        Table of warnings generated by the code (with masked values filled
+        in with zeros)
+    error_msg: str
+        Error message generated by the code, or ``None`` if there is no error message
+    """
+    from xml.etree.ElementTree import iterparse, ParseError
+    from astropy.table import Table
+
+    error_msg = None
+    fields = None
+    rows = []
+    in_warnings = False
+    try:
+        context = iterparse(filename, events=('start', 'end'))
+        for event, elem in context:
+            tag = _strip_namespace(elem.tag)
+            if event=='start':
+                if tag=='TABLE' and (elem.get('ID')=='Warnings' or
+                        elem.get('name')=='Warnings'):
+                    in_warnings = True
+                    fields = []
+                continue
+            if tag=='PARAM' and elem.get('name')=='Error_Msg':
+                error_msg = elem.get('value')
+            elif in_warnings:
+                if tag=='FIELD':
+                    fields.append((elem.get('name'), elem.get('datatype')))
+                elif tag=='TR':
+                    rows.append([td.text for td in elem
+                        if _strip_namespace(td.tag)=='TD'])
+                elif tag=='TABLE':
+                    in_warnings = False
+                else:
+                    # Keep the cells until the entire row has been read
+                    continue
+            # Free the memory used by elements that have already been read
+            elem.clear()
+    except ParseError as error:
+        raise XMLLogError("Unable to parse '{0}': {1}".format(filename, error))
+    if fields is None:
+        raise XMLLogError("No Warnings table found in '{0}'".format(filename))
+
+    names = [name for name, datatype in fields]
+    columns = []
+    for n, (name, datatype) in enumerate(fields):
+        values = [_convert(row[n] if n<len(row) else None, datatype) for row in rows]
+        dtype = datatypes.get(datatype, (str, ''))[0]
+        columns.append(np.array(values, dtype=dtype))
+    warnings = Table(columns, names=names)
+    warnings.meta['filename'] = filename
+    return warnings, error_msg
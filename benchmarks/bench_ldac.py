@@ -0,0 +1,99 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Benchmarks of converting large catalogs to FITS_LDAC
+(`astromatic_wrapper.utils.ldac.convert_table_to_ldac`) and saving them
+(`astromatic_wrapper.utils.ldac.save_table_as_ldac`). The catalogs have columns similar
+to a SExtractor catalog, with up to several million rows.
+
+The benchmarks are run by asv with the other benchmarks (see bench_pipeline.py). A
+quick summary for the current checkout can also be printed without asv using::
+
+    python benchmarks/bench_ldac.py 10000 1000000 5000000
+"""
+import os
+import shutil
+import tempfile
+from timeit import default_timer
+
+import numpy as np
+from astropy.table import Table
+
+from astromatic_wrapper.utils import ldac
+
+# Number of rows in each benchmarked catalog
+row_counts = [10000, 1000000, 5000000]
+
+def build_catalog(rows):
+    """
+    Build a catalog with ``rows`` rows and columns similar to a SExtractor catalog
+    """
+    random = np.random.RandomState(0)
+    return Table([
+        np.arange(1, rows+1, dtype='i4'),
+        random.uniform(0, 4096, rows),
+        random.uniform(0, 4096, rows),
+        random.uniform(0, 360, rows),
+        random.uniform(-90, 90, rows),
+        random.uniform(15, 25, rows).astype('f4'),
+        random.uniform(0, .1, rows).astype('f4'),
+        random.randint(0, 256, rows).astype('i2')
+    ], names=['NUMBER', 'X_IMAGE', 'Y_IMAGE', 'ALPHA_J2000', 'DELTA_J2000',
+        'MAG_AUTO', 'MAGERR_AUTO', 'FLAGS'])
+
+class TimeConvertTableToLdac(object):
+    """
+    Time and memory used to convert a catalog to a FITS_LDAC HDUList
+    """
+    params = row_counts
+    param_names = ['rows']
+    timeout = 600
+    
+    def setup(self, rows):
+        self.tbl = build_catalog(rows)
+    
+    def time_convert_table(self, rows):
+        ldac.convert_table_to_ldac(self.tbl)
+    
+    def peakmem_convert_table(self, rows):
+        ldac.convert_table_to_ldac(self.tbl)
+
+class TimeSaveTableAsLdac(object):
+    """
+    Time taken to convert a catalog to FITS_LDAC and write it to disk
+    """
+    params = row_counts
+    param_names = ['rows']
+    number = 1
+    repeat = 3
+    timeout = 600
+    
+    def setup(self, rows):
+        # setup is run before each repeat, so each run writes a new file
+        self.tbl = build_catalog(rows)
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'catalog.ldac.fits')
+    
+    def teardown(self, rows):
+        shutil.rmtree(self.path)
+    
+    def time_save_table(self, rows):
+        ldac.save_table_as_ldac(self.tbl, self.filename)
+
+if __name__ == '__main__':
+    import sys
+    counts = [int(arg) for arg in sys.argv[1:]] or row_counts
+    print('{0:>10} {1:>12} {2:>12}'.format('rows', 'convert (s)', 'save (s)'))
+    for rows in counts:
+        tbl = build_catalog(rows)
+        start = default_timer()
+        ldac.convert_table_to_ldac(tbl)
+        convert_time = default_timer()-start
+        path = tempfile.mkdtemp()
+        try:
+            start = default_timer()
+            ldac.save_table_as_ldac(tbl, os.path.join(path, 'catalog.ldac.fits'))
+            save_time = default_timer()-start
+        finally:
+            shutil.rmtree(path)
+        print('{0:>10} {1:>12.3f} {2:>12.3f}'.format(rows, convert_time, save_time))
@@ -0,0 +1,174 @@
+# Copyright 2015 Fred Moolekamp
+# BSD 3-clause license
+"""
+Benchmarks of the time added by `astromatic_wrapper.utils.pipeline.Pipeline` to each
+step of a pipeline (building the kwargs of each step, logging, checking the result,
+journaling the result and saving the pipeline). Every step runs a trivial function
+so almost all of the time measured is overhead.
+
+The benchmarks use `airspeed velocity <https://asv.readthedocs.io>`_ to track
+regressions across commits (see asv.conf.json), for example::
+
+    asv run master~10..master
+    asv compare master~1 master
+    asv publish
+
+A quick summary for the current checkout can also be printed without asv using::
+
+    python benchmarks/bench_pipeline.py 10 1000 100000
+"""
+import os
+import shutil
+import tempfile
+import warnings
+from timeit import default_timer
+
+from astromatic_wrapper.utils.pipeline import Pipeline
+
+# Number of steps in each benchmarked pipeline
+step_counts = [10, 1000, 100000]
+
+def trivial_step(value, step_id):
+    return {'status': 'success'}
+
+def build_pipeline(steps, path, log=True):
+    """
+    Build a pipeline with ``steps`` trivial steps. If ``log==True`` the pipeline is
+    saved to a log directory in ``path`` and each result is written to the journal.
+    """
+    paths = {'temp': os.path.join(path, 'temp')}
+    if log:
+        paths['log'] = os.path.join(path, 'log')
+    pipeline = Pipeline(paths=paths, create_paths=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for n in range(steps):
+            pipeline.add_step(trivial_step, ['bench', 'step{0}'.format(n)], value=n)
+    return pipeline
+
+def measure_run(pipeline):
+    """
+    Run a pipeline and split the time taken into the time spent in the step functions,
+    saving the pipeline (``checkpoint_time``), writing results to the journal and the
+    remaining overhead added to each step
+
+    Returns
+    -------
+    measurements: dict
+        ``total_time`` of the run, ``overhead_per_step``, ``journal_time_per_step`` and
+        ``checkpoint_time`` (all in seconds)
+    """
+    start = default_timer()
+    pipeline.run()
+    total_time = default_timer()-start
+    timing = pipeline.get_timing_table()
+    steps = len(pipeline.steps)
+    step_time = float(timing['wall_time'].sum())
+    journal_time = float(timing['journal_time'].sum())
+    checkpoint_time = timing.meta['checkpoint_time'] or 0.
+    return {
+        'total_time': total_time,
+        'overhead_per_step': (total_time-step_time-journal_time-checkpoint_time)/steps,
+        'journal_time_per_step': journal_time/steps,
+        'checkpoint_time': checkpoint_time
+    }
+
+class TimeBuildPipeline(object):
+    """
+    Time taken to add the steps to a pipeline
+    """
+    params = step_counts
+    param_names = ['steps']
+    timeout = 600
+    
+    def setup(self, steps):
+        self.path = tempfile.mkdtemp()
+    
+    def teardown(self, steps):
+        shutil.rmtree(self.path)
+    
+    def time_add_steps(self, steps):
+        build_pipeline(steps, self.path)
+
+class TimeSelectSteps(object):
+    """
+    Time taken to select the steps with a given tag (see `Pipeline.select_steps`)
+    """
+    params = step_counts
+    param_names = ['steps']
+    timeout = 600
+    
+    def setup(self, steps):
+        self.path = tempfile.mkdtemp()
+        self.pipeline = build_pipeline(steps, self.path)
+    
+    def teardown(self, steps):
+        shutil.rmtree(self.path)
+    
+    def time_select_steps(self, steps):
+        self.pipeline.select_steps(self.pipeline.steps, ['bench'], ['step1'])
+
+class TimePipelineRun(object):
+    """
+    Time taken to run a pipeline of trivial steps, with and without a log directory
+    (which saves the pipeline and journals the result of each step)
+    """
+    params = (step_counts, [False, True])
+    param_names = ['steps', 'log']
+    number = 1
+    repeat = 3
+    timeout = 1200
+    
+    def setup(self, steps, log):
+        self.path = tempfile.mkdtemp()
+        self.pipeline = build_pipeline(steps, self.path, log)
+    
+    def teardown(self, steps, log):
+        shutil.rmtree(self.path)
+    
+    def time_run(self, steps, log):
+        self.pipeline.run()
+
+class TrackOverhead(object):
+    """
+    Overhead added to each step and the time taken to save the pipeline (the
+    pipelines are only run once for all of the measurements)
+    """
+    params = step_counts
+    param_names = ['steps']
+    timeout = 1200
+    
+    def setup_cache(self):
+        path = tempfile.mkdtemp()
+        try:
+            return dict([(steps, measure_run(build_pipeline(steps, path)))
+                for steps in step_counts])
+        finally:
+            shutil.rmtree(path)
+    
+    def track_overhead_per_step(self, measurements, steps):
+        return measurements[steps]['overhead_per_step']
+    track_overhead_per_step.unit = 'seconds'
+    
+    def track_journal_time_per_step(self, measurements, steps):
+        return measurements[steps]['journal_time_per_step']
+    track_journal_time_per_step.unit = 'seconds'
+    
+    def track_checkpoint_time(self, measurements, steps):
+        return measurements[steps]['checkpoint_time']
+    track_checkpoint_time.unit = 'seconds'
+
+if __name__ == '__main__':
+    import sys
+    counts = [int(arg) for arg in sys.argv[1:]] or step_counts
+    print('{0:>8} {1:>12} {2:>16} {3:>16} {4:>16}'.format('steps', 'total (s)',
+        'overhead (us)', 'journal (us)', 'checkpoint (s)'))
+    for steps in counts:
+        path = tempfile.mkdtemp()
+        try:
+            result = measure_run(build_pipeline(steps, path))
+        finally:
+            shutil.rmtree(path)
+        print('{0:>8} {1:>12.3f} {2:>16.1f} {3:>16.1f} {4:>16.3f}'.format(steps,
+            result['total_time'], result['overhead_per_step']*1e6,
+            result['journal_time_per_step']*1e6, result['checkpoint_time']))
@@ -72,7 +72,7 @@ scripts = [fname for fname in glob.glob(os.path.join('scripts', '*'))
 # Get configuration information from all of the various subpackages.
 # See the docstring for setup_helpers.update_package_files for more
 # details.
-package_info = get_package_info()
+package_info = get_package_info(exclude=['benchmarks'])
 
 # Add the project-global data
 package_info['package_data'].setdefault(PACKAGENAME, [])
@@ -81,7 +81,8 @@ package_info['package_data'][PACKAGENAME].append('data/*')
 # Define entry points for command-line scripts
 entry_points = {}
 entry_points['console_scripts'] = [
-    'astropy-package-template-example = packagename.example_mod:main',
+    'astromatic-job-array = astromatic_wrapper.utils.job_array:main',
+    'astromatic-worker = astromatic_wrapper.utils.work_queue:main',
 ]
 
 # Include all .c files, recursively, including those generated by